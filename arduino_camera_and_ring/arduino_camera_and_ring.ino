@@ -12,6 +12,18 @@ const int LED_RING_PIN = 6;
 // Настройки светодиодного кольца
 const int LED_COUNT = 8;          // 8 светодиодов в кольце
 const int LED_BRIGHTNESS = 10;    // Яркость 10/255
+const int FLASH_BRIGHTNESS = 255; // Яркость вспышки при снимке
+
+// Узоры подсветки (задаются командой с ПК)
+const byte LED_PATTERN_OFF = 0;
+const byte LED_PATTERN_WHITE = 1;
+const byte LED_PATTERN_WARM = 2;
+
+byte ledBrightness = LED_BRIGHTNESS;
+byte ledPattern = LED_PATTERN_OFF;
+bool flashing = false;
+unsigned long flashUntil = 0;
+bool hostControl = false;         // После первой команды кольцом управляет ПК
 
 // Переменные для обработки кнопки
 int lastButtonState = HIGH;
@@ -22,11 +34,28 @@ const unsigned long LONG_PRESS_TIME = 1000;
 bool longPressSent = false;
 bool cameraActive = false;        // Состояние камеры
 
+// Обмен с ПК: кадр 0xA5 | тип | номер | аргумент | millis() (4 байта, LE) | CRC-8
+const long SERIAL_BAUDRATE = 115200;
+const byte FRAME_SYNC = 0xA5;
+const byte FRAME_SIZE = 9;
+const byte EVENT_SHORT_PRESS = 0x01;
+const byte EVENT_LONG_PRESS = 0x02;
+// Команды с ПК (подтверждаются кадром ACK: аргумент - номер команды,
+// вместо времени - состояние: яркость | узор << 8 | вспышка << 16)
+const byte CMD_SET_BRIGHTNESS = 0x10;
+const byte CMD_SET_PATTERN = 0x11;
+const byte CMD_FLASH = 0x12;      // аргумент - длительность в десятках мс
+const byte EVENT_ACK = 0x20;
+byte frameSeq = 0;                // Номер кадра (ПК по нему видит потерянные события)
+
+byte rxFrame[FRAME_SIZE];         // Принимаемый кадр команды
+byte rxPos = 0;
+
 // Создаем объект для светодиодного кольца
 Adafruit_NeoPixel ledRing = Adafruit_NeoPixel(LED_COUNT, LED_RING_PIN, NEO_GRB + NEO_KHZ800);
 
 void setup() {
-  Serial.begin(9600);
+  Serial.begin(SERIAL_BAUDRATE);
   pinMode(BUTTON_PIN, INPUT_PULLUP);
   
   // Инициализация светодиодного кольца
@@ -39,6 +68,14 @@ void setup() {
 }
 
 void loop() {
+  readCommands();
+  
+  // Окончание вспышки
+  if (flashing && (long)(millis() - flashUntil) >= 0) {
+    flashing = false;
+    applyLedRing();
+  }
+  
   int currentButtonState = digitalRead(BUTTON_PIN);
   
   // Если состояние кнопки изменилось
@@ -58,10 +95,12 @@ void loop() {
         if (pressDuration < LONG_PRESS_TIME && !longPressSent) {
           // Короткое нажатие - переключение камеры
           cameraActive = !cameraActive;  // Меняем состояние камеры
-          Serial.println("SHORT_PRESS");
+          sendEvent(EVENT_SHORT_PRESS, cameraActive ? 1 : 0);
           
-          // Обновляем светодиодное кольцо
-          updateLedRing();
+          // Обновляем светодиодное кольцо (если им не управляет ПК)
+          if (!hostControl) {
+            updateLedRing();
+          }
         }
       }
       lastButtonState = currentButtonState;
@@ -74,7 +113,7 @@ void loop() {
     
     if (pressDuration >= LONG_PRESS_TIME) {
       // Длинное нажатие
-      Serial.println("LONG_PRESS");
+      sendEvent(EVENT_LONG_PRESS, 0);
       longPressSent = true;
     }
   }
@@ -82,17 +121,96 @@ void loop() {
   delay(10);
 }
 
-void updateLedRing() {
-  if (cameraActive) {
-    // Камера включена - зажигаем кольцо БЕЛЫМ цветом
-    for(int i = 0; i < LED_COUNT; i++) {
-      ledRing.setPixelColor(i, ledRing.Color(255, 255, 255)); // Белый (R=255, G=255, B=255)
+// CRC-8, полином 0x07 (так же считает main.py)
+byte crc8(const byte *data, byte len) {
+  byte crc = 0;
+  for (byte i = 0; i < len; i++) {
+    crc ^= data[i];
+    for (byte bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+// Отправка кадра: тип, аргумент и 32-битное значение
+void sendFrame(byte type, byte arg, unsigned long value) {
+  byte frame[FRAME_SIZE];
+  frame[0] = FRAME_SYNC;
+  frame[1] = type;
+  frame[2] = frameSeq++;
+  frame[3] = arg;
+  for (byte i = 0; i < 4; i++) {
+    frame[4 + i] = (value >> (8 * i)) & 0xFF;
+  }
+  frame[8] = crc8(frame + 1, FRAME_SIZE - 2);
+  Serial.write(frame, FRAME_SIZE);
+}
+
+// Отправка события кнопки одним кадром с номером и временем устройства
+void sendEvent(byte type, byte arg) {
+  sendFrame(type, arg, millis());
+}
+
+// Прием команд с ПК (без блокировки цикла кнопки)
+void readCommands() {
+  while (Serial.available() > 0) {
+    byte b = Serial.read();
+    if (rxPos == 0 && b != FRAME_SYNC) {
+      continue;
     }
-  } else {
-    // Камера выключена - выключаем все светодиоды
-    for(int i = 0; i < LED_COUNT; i++) {
-      ledRing.setPixelColor(i, ledRing.Color(0, 0, 0)); // Выключено (R=0, G=0, B=0)
+    rxFrame[rxPos++] = b;
+    if (rxPos == FRAME_SIZE) {
+      rxPos = 0;
+      if (crc8(rxFrame + 1, FRAME_SIZE - 2) == rxFrame[8]) {
+        handleCommand(rxFrame[1], rxFrame[2], rxFrame[3]);
+      }
     }
   }
+}
+
+void handleCommand(byte type, byte seq, byte arg) {
+  switch (type) {
+    case CMD_SET_BRIGHTNESS:
+      ledBrightness = arg;
+      break;
+    case CMD_SET_PATTERN:
+      ledPattern = arg;
+      break;
+    case CMD_FLASH:
+      flashing = true;
+      flashUntil = millis() + arg * 10UL;
+      break;
+    default:
+      return;  // Неизвестная команда - без подтверждения
+  }
+  hostControl = true;
+  applyLedRing();
+  
+  unsigned long state = ledBrightness | ((unsigned long)ledPattern << 8) | ((unsigned long)flashing << 16);
+  sendFrame(EVENT_ACK, seq, state);
+}
+
+void updateLedRing() {
+  // Камера включена - кольцо БЕЛОЕ, выключена - светодиоды погашены
+  ledPattern = cameraActive ? LED_PATTERN_WHITE : LED_PATTERN_OFF;
+  applyLedRing();
+}
+
+void applyLedRing() {
+  uint32_t color = ledRing.Color(0, 0, 0);                        // Выключено
+  if (ledPattern == LED_PATTERN_WHITE) {
+    color = ledRing.Color(255, 255, 255);                         // Белый
+  } else if (ledPattern == LED_PATTERN_WARM) {
+    color = ledRing.Color(255, 190, 120);                         // Теплый белый
+  }
+  // Вспышка зажигает кольцо, даже если подсветка выключена
+  if (flashing && ledPattern == LED_PATTERN_OFF) {
+    color = ledRing.Color(255, 255, 255);
+  }
+  ledRing.setBrightness(flashing ? FLASH_BRIGHTNESS : ledBrightness);
+  for(int i = 0; i < LED_COUNT; i++) {
+    ledRing.setPixelColor(i, color);
+  }
   ledRing.show(); // Применяем изменения
 }
@@ -0,0 +1,259 @@
+"""Замеры производительности конвейера захвата без камеры и Arduino.
+
+Синтетическая камера (main.SyntheticFrameSource) и имитация скетча
+(main.FakeArduino) прогоняют те же классы, что и программа: поток захвата,
+подготовку превью, запись снимков и разбор событий кнопки. Каждое разрешение
+замеряется в отдельном процессе, чтобы пиковая память не смешивалась.
+
+    python benchmark.py
+    python benchmark.py --resolutions 640x480,1920x1080 --seconds 3 --mjpeg
+    python benchmark.py --json results.json
+    python benchmark.py --baseline results.json --tolerance 0.2
+
+Время запуска (startup_ms) - от старта процесса main.py без интерфейса до
+первого кадра; кнопка в имитации скетча нажимается сразу после ARDUINO_READY.
+"""
+import argparse
+import json
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import main
+
+DEFAULT_RESOLUTIONS = "640x480,1280x720,1920x1080,2592x1944,3840x2160"
+# Период нажатий LONG_PRESS в сценарии имитации скетча, с
+PRESS_INTERVAL_S = 0.5
+
+# Показатели для сравнения с эталоном: True - чем больше, тем лучше
+COMPARED_METRICS = {
+    "preview_fps": True,
+    "render_p95_ms": False,
+    "encode_p95_ms": False,
+    "write_p95_ms": False,
+    "latency_p95_ms": False,
+    "burst_merge_ms": False,
+    "startup_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+def peak_rss_mb():
+    """Пиковый объем резидентной памяти процесса, МБ"""
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def ms_percentiles(values, prefix):
+    return {f"{prefix}_p{q}_ms": round(main.percentile(values, q) * 1000, 2) for q in (50, 95, 99)}
+
+
+def run_case(width, height, mjpeg, seconds, fps):
+    """Один замер: превью, снимки по нажатиям и задержка нажатие->файл"""
+    folder = tempfile.mkdtemp(prefix="camera_bench_")
+    source = main.SyntheticFrameSource(width, height, fps, mjpeg=mjpeg)
+    buffer_size = max(main.FRAME_BUFFER_SIZE, int(fps * main.ZSL_WINDOW_MS / 1000) + 2)
+    engine = main.CaptureEngine(source, buffer_size)
+    renderer = main.PreviewRenderer(None)
+    writer = main.PhotoWriter()
+    
+    presses = [(0.5 + i * PRESS_INTERVAL_S, main.EVENT_LONG_PRESS)
+               for i in range(int((seconds - 0.5) / PRESS_INTERVAL_S))]
+    arduino = main.FakeArduino(presses)
+    # Очередь событий - как очередь потока GUI в программе
+    events = queue.Queue()
+    transport = main.SerialTransport(arduino, on_message=events.put)
+    
+    render_times, jobs, latencies = [], [], []
+    
+    def on_saved(job):
+        latencies.append(time.perf_counter() - arduino.sent_times[job.trigger.seq])
+        jobs.append(job)
+        
+    engine.start()
+    transport.start()
+    start = time.perf_counter()
+    preview_seq, preview_frame = 0, None
+    try:
+        # Цикл "потока GUI": события кнопки и отрисовка превью
+        while time.perf_counter() - start < seconds:
+            while not events.empty():
+                message = events.get_nowait()
+                if message.type != main.EVENT_LONG_PRESS:
+                    continue
+                frames = engine.recent_frames(main.ZSL_WINDOW_MS / 1000, pin=True)
+                if frames:
+                    path = os.path.join(folder, f"bench_{message.seq}.jpg")
+                    writer.submit(main.PhotoJob(path, frames, callback=on_saved, trigger=message,
+                                                release=engine.release_frames))
+                    
+            seq, preview_frame = engine.latest_frame(preview_frame)
+            if preview_frame is not None and seq != preview_seq:
+                preview_seq = seq
+                engine.mark_shown(seq)
+                render_start = time.perf_counter()
+                renderer.prepare(preview_frame)
+                render_times.append(renderer.record_time(time.perf_counter() - render_start))
+            time.sleep(renderer.next_interval_ms(1 / fps) / 1000)
+        elapsed = time.perf_counter() - start
+        # Слияние серии из последних кадров буфера (в процессе замера, без пула)
+        burst = engine.recent_frames(float("inf"), count=main.BURST_FRAMES)
+        burst_time = main.merge_burst([frame for _, _, frame in burst])[1]["elapsed"] if len(burst) > 1 else 0.0
+    finally:
+        transport.close()
+        engine.stop()
+        writer.stop(wait=True)
+        shutil.rmtree(folder, ignore_errors=True)
+        
+    result = {
+        "resolution": f"{width}x{height}",
+        "mode": "mjpeg" if mjpeg else "bgr",
+        "seconds": round(elapsed, 2),
+        "capture_fps": round(engine.frames_grabbed / elapsed, 1),
+        "preview_fps": round(engine.frames_shown / elapsed, 1),
+        "frames_dropped": engine.frames_dropped,
+        "captures": len(jobs),
+        "capture_errors": sum(1 for job in jobs if job.error),
+        "serial_lost": transport.messages_lost,
+        "burst_frames": len(burst),
+        "burst_merge_ms": round(burst_time * 1000, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    result.update(ms_percentiles(render_times, "render"))
+    result.update(ms_percentiles([job.encode_time for job in jobs], "encode"))
+    result.update(ms_percentiles([job.write_time for job in jobs], "write"))
+    result.update(ms_percentiles(latencies, "latency"))
+    # Время стадий конвейера из общего реестра замеров, мс
+    result["stages"] = {stage: {f"p{q}": round(value * 1000, 2) for q, value in quantiles.items()}
+                        for stage, (count, total, quantiles) in main.pipeline_metrics.snapshot().items()}
+    return result
+
+
+def run_isolated(resolution, mjpeg, seconds, fps):
+    """Замер в отдельном процессе (чистая пиковая память)"""
+    command = [sys.executable, os.path.abspath(__file__), "--case", resolution,
+               "--seconds", str(seconds), "--fps", str(fps)]
+    if mjpeg:
+        command.append("--mjpeg")
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    # Результат - последняя строка вывода (до нее может быть отладочная печать)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_startup(resolution, mjpeg, fps):
+    """Запуск main.py без интерфейса до первого кадра, мс (по строке [STARTUP])"""
+    folder = tempfile.mkdtemp(prefix="camera_startup_")
+    source = f"synthetic{'-mjpeg' if mjpeg else ''}:{resolution}@{fps}"
+    command = [sys.executable, "-u", os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+               "--headless", "--host", "127.0.0.1", "--port", "0", "--patient", "benchmark",
+               "--images-dir", folder, "--source", source, "--serial", "fake:short@0"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+                               encoding="utf-8", env={**os.environ, "PYTHONIOENCODING": "utf-8"})
+    try:
+        for line in process.stdout:
+            match = re.match(r"\[STARTUP\] .*?(\d+) мс", line)
+            if match:
+                return int(match.group(1))
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def print_table(results):
+    columns = [("resolution", "Разрешение"), ("mode", "Режим"), ("capture_fps", "Захват fps"),
+               ("preview_fps", "Превью fps"), ("frames_dropped", "Пропущено"),
+               ("render_p95_ms", "Превью p95"), ("encode_p95_ms", "Сжатие p95"),
+               ("write_p95_ms", "Запись p95"), ("latency_p50_ms", "Нажатие p50"),
+               ("latency_p95_ms", "Нажатие p95"), ("latency_p99_ms", "Нажатие p99"),
+               ("burst_merge_ms", "Серия мс"), ("startup_ms", "Запуск мс"),
+               ("peak_rss_mb", "Память МБ")]
+    widths = [max(len(title), *(len(str(r[key])) for r in results)) for key, title in columns]
+    print("  ".join(title.rjust(width) for (_, title), width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[key]).rjust(width) for (key, _), width in zip(columns, widths)))
+        
+        
+def compare(results, baseline, tolerance):
+    """Сравнение с эталонным прогоном; возвращает список регрессий"""
+    reference = {(r["resolution"], r["mode"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get((result["resolution"], result["mode"]))
+        if not base:
+            continue
+        for key, higher_is_better in COMPARED_METRICS.items():
+            old, new = base.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{result['resolution']} {result['mode']}: {key} {old} -> {new} "
+                                   f"({change:+.0%})")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры конвейера захвата без оборудования")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS,
+                        help="список разрешений через запятую")
+    parser.add_argument("--seconds", type=float, default=5.0, help="длительность замера на разрешение")
+    parser.add_argument("--fps", type=int, default=main.CAMERA_FPS, help="частота синтетической камеры")
+    parser.add_argument("--mjpeg", action="store_true", help="камера отдает сжатые кадры MJPEG")
+    parser.add_argument("--json", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON эталонного прогона для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое ухудшение (доля)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    if args.case:
+        width, height = map(int, args.case.split("x"))
+        print(json.dumps(run_case(width, height, args.mjpeg, args.seconds, args.fps)))
+        return 0
+        
+    results = []
+    for resolution in filter(None, args.resolutions.split(",")):
+        print(f"[BENCH] {resolution} ({'mjpeg' if args.mjpeg else 'bgr'})...", flush=True)
+        result = run_isolated(resolution.strip(), args.mjpeg, args.seconds, args.fps)
+        result["startup_ms"] = measure_startup(resolution.strip(), args.mjpeg, args.fps)
+        results.append(result)
+    print()
+    print_table(results)
+    
+    print("\nСтадии конвейера, p95 мс:")
+    for result in results:
+        stages = ", ".join(f"{stage} {values['p95']}" for stage, values in sorted(result["stages"].items()))
+        print(f"  {result['resolution']} {result['mode']}: {stages}")
+        
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+            
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nРегрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
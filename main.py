@@ -1,66 +1,4379 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import cv2
-from PIL import Image, ImageTk
-import os
-import serial
-import serial.tools.list_ports
 import time
+# Момент запуска: от него отсчитываются этапы старта ([STARTUP])
+LAUNCH_TIME = time.perf_counter()
+import os
+import importlib
 from datetime import datetime
 import threading
+import queue
+import argparse
+import base64
+import signal
+import urllib.parse
+import ipaddress
+import glob
+import struct
+import re
+import io
+import sqlite3
+import hashlib
+import json
+import zipfile
+import shutil
+import tempfile
+from collections import deque
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к атрибуту.
+
+    После загрузки глобальное имя заменяется самим модулем, так что
+    дальнейшие обращения идут напрямую, без посредника.
+    """
+    def __init__(self, name, alias=None, submodules=()):
+        self.name = name
+        self.alias = alias or name
+        self.submodules = submodules
+        self.module = None
+        
+    def load(self):
+        if self.module is None:
+            module = importlib.import_module(self.name)
+            for submodule in self.submodules:
+                importlib.import_module(submodule)
+            self.module = module
+            if globals().get(self.alias) is self:
+                globals()[self.alias] = module
+        return self.module
+        
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+# Тяжелые модули (сотни мс на импорт) не задерживают появление окна:
+# они загружаются в фоне (preload_modules) или при первом обращении
+cv2 = LazyModule("cv2")
+Image = LazyModule("PIL.Image", "Image")
+ImageTk = LazyModule("PIL.ImageTk", "ImageTk")
+# Tk нужен только окну (CameraWindow): без интерфейса программа работает и там, где его нет
+tk = LazyModule("tkinter", "tk")
+ttk = LazyModule("tkinter.ttk", "ttk")
+messagebox = LazyModule("tkinter.messagebox", "messagebox")
+simpledialog = LazyModule("tkinter.simpledialog", "simpledialog")
+filedialog = LazyModule("tkinter.filedialog", "filedialog")
+serial = LazyModule("serial", submodules=("serial.tools.list_ports",))
+# Загружаются в фоне при любом запуске; ImageTk добавляет окно (CameraWindow.PRELOAD_MODULES)
+LAZY_MODULES = (cv2, Image, serial)
+# Нужен только режиму без интерфейса
+asyncio = LazyModule("asyncio")
+
+
+def preload_modules(modules=LAZY_MODULES, on_loaded=None):
+    """Фоновый импорт тяжелых модулей, пока оператор вводит фамилию"""
+    def preload():
+        for module in modules:
+            module.load()
+        if on_loaded:
+            on_loaded()
+    threading.Thread(target=preload, name="preload", daemon=True).start()
+
+# Количество кадров в кольцевом буфере захвата
+FRAME_BUFFER_SIZE = 4
+
+# Режим нулевой задержки затвора: снимок выбирается из кадров,
+# полученных за последние ZSL_WINDOW_MS миллисекунд до нажатия
+ZSL_ENABLED = True
+ZSL_WINDOW_MS = 400
+ZSL_MAX_FPS = 60
+
+# Ширина уменьшенной копии кадра для оценки резкости
+FOCUS_SCORE_WIDTH = 320
+
+# Поиск камер: сколько индексов проверять
+CAMERA_MAX_INDEX = 5
+# Камера открывается заранее, пока вводится фамилия: первое включение не ждет драйвер
+CAMERA_PREOPEN = True
+# Теплый резерв: при выключении камера не освобождается, а только ставится на паузу
+CAMERA_WARM_STANDBY = True
+# Через сколько секунд простоя камера в резерве все-таки освобождается
+CAMERA_STANDBY_TIMEOUT_S = 300
+
+# Параметры видеопотока камеры (MJPG позволяет полное разрешение на полной частоте)
+CAMERA_FOURCC = "MJPG"
+CAMERA_WIDTH = 1920
+CAMERA_HEIGHT = 1080
+CAMERA_FPS = 30
+# Сохранять JPEG-кадры камеры как есть, без декодирования и повторного сжатия
+MJPEG_PASSTHROUGH = True
+
+# Превью: максимальный размер и границы адаптивного интервала обновления
+PREVIEW_MAX_WIDTH = 800
+PREVIEW_MAX_HEIGHT = 600
+PREVIEW_MIN_INTERVAL_MS = 5
+PREVIEW_MAX_INTERVAL_MS = 100
+# Доля времени потока GUI, которую может занимать отрисовка превью
+PREVIEW_LOAD_FACTOR = 0.5
+PHOTO_PREVIEW_SIZE = 300
+
+# Обмен с Arduino: скорость порта и формат кадра
+# Кадр: 0xA5 | тип | номер | аргумент | время устройства (мс, uint32 LE) | CRC-8
+SERIAL_BAUDRATE = 115200
+# Плата перезагружается при открытии порта; готовность - строка из setup() скетча.
+# Если строки нет за это время (плата не перезагружалась), работаем без нее
+ARDUINO_READY_LINE = "ARDUINO_READY"
+ARDUINO_READY_TIMEOUT_S = 4.0
+FRAME_SYNC = 0xA5
+FRAME_FORMAT = "<BBBBIB"
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+EVENT_SHORT_PRESS = 0x01
+EVENT_LONG_PRESS = 0x02
+# Команды светодиодному кольцу и подтверждение от скетча.
+# В кадре ACK аргумент - номер команды, а вместо времени передается
+# состояние кольца: яркость | узор << 8 | вспышка << 16
+CMD_SET_BRIGHTNESS = 0x10
+CMD_SET_PATTERN = 0x11
+CMD_FLASH = 0x12
+EVENT_ACK = 0x20
+EVENT_NAMES = {EVENT_SHORT_PRESS: "SHORT_PRESS", EVENT_LONG_PRESS: "LONG_PRESS", EVENT_ACK: "ACK"}
+LED_PATTERN_OFF = 0
+LED_PATTERN_WHITE = 1
+LED_PATTERN_WARM = 2
+LED_PATTERN_NAMES = {LED_PATTERN_OFF: "ВЫКЛ", LED_PATTERN_WHITE: "белый", LED_PATTERN_WARM: "теплый"}
+LED_BRIGHTNESS = 10
+# Ожидание подтверждения команды и число повторов
+LED_ACK_TIMEOUT_S = 0.3
+LED_MAX_ATTEMPTS = 3
+# Снимок со вспышкой: длительность вспышки, время установки экспозиции
+# после подтверждения и окно кадров, из которых выбирается снимок.
+# Выключено по умолчанию: со вспышкой кадр берется не из буфера до нажатия (ZSL),
+# а через ~0.3-0.5 с после него (ACK + FLASH_SETTLE_MS + FLASH_CAPTURE_WINDOW_MS) -
+# снимок ярче, но камера за это время может сместиться
+FLASH_CAPTURE = False
+FLASH_DURATION_MS = 400
+FLASH_SETTLE_MS = 120
+FLASH_CAPTURE_WINDOW_MS = 200
+# Сколько последних замеров задержки нажатие->снимок хранить
+LATENCY_HISTORY = 200
+# Период обработки очереди событий в потоке GUI
+GUI_QUEUE_INTERVAL_MS = 15
+
+# Замеры стадий конвейера: сколько последних значений хранить для перцентилей,
+# куда и как часто выгружать метрики (текстовый формат Prometheus).
+# Выгрузка выключена (None); включается путем к файлу или ключом --metrics
+METRICS_WINDOW = 1000
+METRICS_EXPORT_PATH = None
+METRICS_EXPORT_INTERVAL_S = 10
+STATS_REFRESH_MS = 1000
+
+# Серия снимков: K кадров подряд выравниваются и усредняются в один снимок с меньшим шумом
+BURST_FRAMES = 8
+BURST_MERGE = "mean"  # "mean" или "median"
+BURST_ALIGN_WIDTH = 320
+# Кадры со слабым откликом фазовой корреляции (смаз, сильное движение) не усредняются
+BURST_MIN_RESPONSE = 0.1
+# Действие длинного нажатия: "photo" - снимок, "burst" - серия
+LONG_PRESS_ACTION = "photo"
+# Процессы для тяжелой обработки снимков (вне потока GUI и без GIL)
+PROCESS_POOL_WORKERS = 2
+
+# Улучшение снимков перед записью (в пуле процессов). Исходный кадр
+# сохраняется рядом для аудита: <папка пациента>/originals/<то же имя>.jpg
+ENHANCE_ENABLED = False
+# Баланс белого: "gray_world" - по среднему кадра, "led" - калибровка кольца, None - выкл.
+ENHANCE_WHITE_BALANCE = "gray_world"
+# Коэффициенты B, G, R для режима "led" (снимок серой карты при белом узоре кольца)
+LED_WHITE_GAINS = (1.0, 1.0, 1.0)
+# Пределы коэффициентов серого мира: кадр одного цвета (десна) не должен "перекрашиваться"
+WHITE_BALANCE_MAX_GAIN = 1.6
+# CLAHE по каналу яркости L (Lab); 0 - выкл.
+ENHANCE_CLAHE_CLIP = 2.0
+ENHANCE_CLAHE_GRID = 8
+# Подавление бликов кольца на влажной эмали: почти белые пиксели восстанавливаются по соседям
+ENHANCE_GLARE = True
+GLARE_THRESHOLD = 245
+GLARE_INPAINT_RADIUS = 3
+# Если "бликов" больше этой доли кадра - это пересвет, а не блики; не трогаем
+GLARE_MAX_FRACTION = 0.03
+ORIGINALS_DIR_NAME = "originals"
+
+# Запись видео сеанса: файлы-сегменты по RECORD_SEGMENT_S секунд
+# (при сбое теряется не больше одного сегмента)
+RECORD_SEGMENT_S = 60
+# Очередь кадров к кодировщику; при переполнении кадр пропускается, а не ждет
+RECORD_QUEUE_SIZE = 16
+RECORD_FOURCC = "mp4v"
+RECORD_EXTENSION = ".mp4"
+# Два коротких нажатия в пределах этого интервала - старт/стоп записи
+DOUBLE_PRESS_MS = 400
+
+# Автоснимок: снимок делается сам, когда изображение неподвижно и резко
+# в течение AUTO_CAPTURE_HOLD_MS. Анализ идет по миниатюре кадра превью
+AUTO_CAPTURE_HOLD_MS = 600
+AUTO_CAPTURE_THUMB_SIZE = (160, 90)
+# Среднее изменение яркости миниатюры между кадрами (0-255), при котором кадр неподвижен
+AUTO_CAPTURE_MOTION_MAX = 3.0
+# Следующий автоснимок - только после заметного движения (переход к другому зубу)
+AUTO_CAPTURE_REARM_MOTION = 10.0
+# Резкость: не ниже абсолютного минимума и доли от лучшей за последние секунды
+AUTO_CAPTURE_FOCUS_MIN = 20.0
+AUTO_CAPTURE_FOCUS_RATIO = 0.8
+AUTO_CAPTURE_FOCUS_DECAY = 0.99
+
+# Фоновая запись снимков: размер очереди и число потоков
+PHOTO_QUEUE_SIZE = 8
+PHOTO_WRITER_WORKERS = 2
+JPEG_QUALITY = 95
+# Суффикс временного файла (переименовывается после полной записи)
+PARTIAL_SUFFIX = ".part"
+
+# Библиотека снимков: индекс SQLite и кэш миниатюр в папке снимков
+IMAGES_DIR = "medical_images"
+LIBRARY_DB_NAME = "library.sqlite3"
+THUMBNAIL_DIR_NAME = ".thumbnails"
+THUMBNAIL_SIZE = 160
+THUMBNAIL_CACHE_MAX_MB = 200
+LIBRARY_SCAN_WORKERS = 8
+# Этапы запуска для замера "запуск -> первый кадр" (в порядке вывода)
+STARTUP_STAGES = (
+    ("window", "окно"),
+    ("modules", "модули"),
+    ("camera_ready", "камера открыта"),
+    ("arduino_ready", "Arduino готов"),
+    ("patient", "пациент выбран"),
+    ("camera_start", "включение камеры"),
+    ("first_frame", "первый кадр"),
+)
+
+# Режим без интерфейса (--headless): локальный HTTP/WebSocket API управления.
+# API без авторизации, поэтому по умолчанию доступен только с этого компьютера;
+# доступ из сети - явно: --host 0.0.0.0
+API_HOST = "127.0.0.1"
+API_PORT = 8080
+# Превью для браузеров (MJPEG): кадр уменьшается и сжимается один раз для всех клиентов
+STREAM_MAX_WIDTH = 640
+STREAM_MAX_HEIGHT = 480
+STREAM_FPS = 15
+STREAM_JPEG_QUALITY = 70
+# Без новых кадров (камера выключена) отключение клиента превью проверяется с этим периодом
+STREAM_IDLE_CHECK_S = 1.0
+# Очередь событий одного клиента WebSocket; у медленного клиента старые события отбрасываются
+WS_QUEUE_SIZE = 64
+WS_MAX_MESSAGE = 64 * 1024
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# Экспорт снимков в ZIP: чтение и хеширование в EXPORT_WORKERS потоках,
+# одновременно в памяти не больше EXPORT_IN_FLIGHT файлов
+EXPORT_WORKERS = 4
+EXPORT_IN_FLIGHT = 8
+# Уменьшенные копии для просмотра (по длинной стороне)
+EXPORT_REVIEW_SIZE = 1280
+EXPORT_REVIEW_QUALITY = 80
+EXPORT_MANIFEST_NAME = "manifest.json"
+# Почти одинаковые снимки: перцептивный хеш dHash (64 бита), похожими
+# считаются снимки с расстоянием Хэмминга между хешами не больше этого
+DUPLICATE_MAX_DISTANCE = 6
+# Имя снимка: Фамилия_ГГГГ-ММ-ДД_ЧЧ-ММ-СС[_N].jpg
+PHOTO_NAME_RE = re.compile(r"^(?P<surname>.+)_(?P<date>\d{4}-\d{2}-\d{2})_(?P<time>\d{2}-\d{2}-\d{2})(?:_\d+)?\.jpe?g$",
+                           re.IGNORECASE)
+
+
+def is_jpeg_buffer(frame):
+    """Кадр - это сжатые байты JPEG (режим MJPEG без декодирования)"""
+    return (frame.dtype == np.uint8 and (frame.ndim == 1 or (frame.ndim == 2 and frame.shape[0] == 1))
+            and frame.size > 4 and frame.flat[0] == 0xFF and frame.flat[1] == 0xD8)
+
+
+def decode_reduced(data, max_width, max_height, grayscale=False):
+    """Декодирование JPEG сразу в уменьшенном виде (1/2, 1/4, 1/8) не меньше заданного"""
+    flags = ((cv2.IMREAD_GRAYSCALE, cv2.IMREAD_REDUCED_GRAYSCALE_2, cv2.IMREAD_REDUCED_GRAYSCALE_4,
+              cv2.IMREAD_REDUCED_GRAYSCALE_8) if grayscale else
+             (cv2.IMREAD_COLOR, cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_COLOR_4,
+              cv2.IMREAD_REDUCED_COLOR_8))
+    width, height = jpeg_size(data)
+    factor = 0
+    if width and height:
+        # Масштаб вписывания в max_width x max_height; уменьшаем, пока его хватает
+        scale = min(max_width / width, max_height / height)
+        while factor < 3 and 1 / (2 << factor) >= scale:
+            factor += 1
+    return cv2.imdecode(data, flags[factor])
+
+
+def jpeg_size(data):
+    """Размер изображения из заголовка JPEG (маркер SOF) без декодирования"""
+    buf = data.reshape(-1)
+    pos, end = 2, buf.size - 9
+    while pos < end:
+        if buf[pos] != 0xFF:
+            pos += 1
+            continue
+        marker = buf[pos + 1]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return int(buf[pos + 7]) << 8 | int(buf[pos + 8]), int(buf[pos + 5]) << 8 | int(buf[pos + 6])
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            pos += 2 if marker != 0xFF else 1
+            continue
+        pos += 2 + (int(buf[pos + 2]) << 8 | int(buf[pos + 3]))
+    return 0, 0
+
+
+_standard_dht = None
+
+
+def standard_huffman_tables():
+    """Стандартные таблицы Хаффмана (сегменты DHT) из JPEG, сжатого libjpeg"""
+    global _standard_dht
+    if _standard_dht is None:
+        ok, encoded = cv2.imencode(".jpg", np.zeros((8, 8, 3), np.uint8))
+        data = encoded.tobytes()
+        segments, pos = [], 2
+        while pos < len(data) - 4 and data[pos + 1] != 0xDA:
+            length = int.from_bytes(data[pos + 2:pos + 4], "big")
+            if data[pos + 1] == 0xC4:
+                segments.append(data[pos:pos + 2 + length])
+            pos += 2 + length
+        _standard_dht = b"".join(segments)
+    return _standard_dht
+
+
+def complete_mjpeg_frame(data):
+    """Кадр MJPEG как полноценный JPEG-файл.
+
+    Многие UVC-камеры не передают таблицы Хаффмана (подразумеваются стандартные),
+    без них часть программ просмотра не откроет файл - вставляем их перед SOS.
+    """
+    data = data.tobytes()
+    pos = 2
+    while pos < len(data) - 4:
+        marker = data[pos + 1]
+        if marker == 0xC4:
+            return data
+        if marker == 0xDA:
+            return data[:pos] + standard_huffman_tables() + data[pos:]
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+    return data
+
+
+def focus_score(frame, width=FOCUS_SCORE_WIDTH):
+    """Оценка резкости кадра: дисперсия лапласиана уменьшенной серой копии"""
+    if is_jpeg_buffer(frame):
+        frame = decode_reduced(frame, width, width, grayscale=True)
+    h, w = frame.shape[:2]
+    if w > width:
+        frame = cv2.resize(frame, (width, max(1, int(h * width / w))), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+    return float(std[0][0] ** 2)
+
+
+def select_sharpest(frames):
+    """Выбор самого резкого кадра из списка (seq, timestamp, frame)"""
+    best, best_score = None, -1.0
+    for item in frames:
+        score = focus_score(item[2])
+        if score > best_score:
+            best, best_score = item, score
+    return best, best_score
+
+
+class StageMetrics:
+    """Скользящие гистограммы времени стадий конвейера (p50/p95/p99) и счетчики"""
+    QUANTILES = (50, 95, 99)
+    
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.samples = {}  # стадия -> deque последних значений, с
+        self.totals = {}  # стадия -> [количество, сумма]
+        self.gauges = {}  # имя -> значение
+        self.lock = threading.Lock()
+        
+    def observe(self, stage, seconds):
+        """Учет одного замера стадии"""
+        with self.lock:
+            samples = self.samples.get(stage)
+            if samples is None:
+                samples = self.samples[stage] = deque(maxlen=self.window)
+                self.totals[stage] = [0, 0.0]
+            samples.append(seconds)
+            totals = self.totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+            
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+            
+    def snapshot(self):
+        """Состояние по стадиям: {стадия: (количество, сумма, {перцентиль: значение})}"""
+        with self.lock:
+            data = {stage: (list(samples), *self.totals[stage]) for stage, samples in self.samples.items()}
+        result = {}
+        for stage, (samples, count, total) in data.items():
+            samples.sort()
+            last = len(samples) - 1
+            result[stage] = (count, total, {q: samples[int(round(q / 100 * last))] for q in self.QUANTILES})
+        return result
+        
+    def to_prometheus(self):
+        """Метрики в текстовом формате Prometheus"""
+        lines = ["# HELP camera_stage_seconds Время стадии конвейера камеры",
+                 "# TYPE camera_stage_seconds summary"]
+        for stage, (count, total, quantiles) in sorted(self.snapshot().items()):
+            for q, value in quantiles.items():
+                lines.append(f'camera_stage_seconds{{stage="{stage}",quantile="{q / 100}"}} {value:.6f}')
+            lines.append(f'camera_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'camera_stage_seconds_count{{stage="{stage}"}} {count}')
+        with self.lock:
+            gauges = sorted(self.gauges.items())
+        for name, value in gauges:
+            lines.append(f"# TYPE camera_{name} gauge")
+            lines.append(f"camera_{name} {value}")
+        return "\n".join(lines) + "\n"
+        
+    def reset(self):
+        with self.lock:
+            self.samples.clear()
+            self.totals.clear()
+            self.gauges.clear()
+
+
+# Общий реестр замеров: в него пишут все стадии конвейера
+pipeline_metrics = StageMetrics()
+
+
+class MetricsExporter:
+    """Периодическая выгрузка метрик в файл (атомарно, для сборщика мониторинга)"""
+    def __init__(self, metrics, path, interval=METRICS_EXPORT_INTERVAL_S, collect=None):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        # Функция, обновляющая счетчики перед выгрузкой
+        self.collect = collect
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-export", daemon=True)
+        
+    def start(self):
+        self.thread.start()
+        
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.export()
+            
+    def export(self):
+        try:
+            if self.collect:
+                self.collect()
+            text = self.metrics.to_prometheus().encode("utf-8")
+            PhotoWriter.write_atomic(self.path, lambda f: f.write(text))
+        except Exception as e:
+            print(f"[METRICS] Ошибка выгрузки метрик: {e}")
+            
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+        self.export()
+
+
+def estimate_shift(reference, image):
+    """Глобальный сдвиг image относительно reference (фазовая корреляция) и уверенность"""
+    (dx, dy), response = cv2.phaseCorrelate(reference, image)
+    return dx, dy, response
+    
+    
+def merge_burst(frames, method=BURST_MERGE, align_width=BURST_ALIGN_WIDTH):
+    """Слияние серии кадров: выравнивание по глобальному сдвигу и усреднение.
+
+    Сдвиг оценивается на уменьшенных серых копиях, опорный кадр - средний
+    в серии. Возвращает (кадр BGR, сведения о слиянии). Выполняется в процессе-обработчике.
+    """
+    start = time.perf_counter()
+    frames = [cv2.imdecode(frame, cv2.IMREAD_COLOR) if is_jpeg_buffer(frame) else frame for frame in frames]
+    h, w = frames[0].shape[:2]
+    scale = min(1.0, align_width / w)
+    small_size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    
+    def small_gray(frame):
+        small = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32)
+        
+    reference_index = len(frames) // 2
+    reference = small_gray(frames[reference_index])
+    window = cv2.createHanningWindow(small_size, cv2.CV_32F)
+    reference *= window
+    
+    aligned, shifts = [], []
+    for index, frame in enumerate(frames):
+        if index == reference_index:
+            aligned.append(frame)
+            shifts.append((0.0, 0.0))
+            continue
+        dx, dy, response = estimate_shift(reference, small_gray(frame) * window)
+        if response < BURST_MIN_RESPONSE:
+            continue
+        dx, dy = dx / scale, dy / scale
+        # Сдвигаем кадр обратно к опорному
+        matrix = np.float32([[1, 0, -dx], [0, 1, -dy]])
+        aligned.append(cv2.warpAffine(frame, matrix, (w, h), flags=cv2.INTER_LINEAR,
+                                      borderMode=cv2.BORDER_REFLECT))
+        shifts.append((round(dx, 1), round(dy, 1)))
+        
+    if method == "median":
+        merged = np.median(np.stack(aligned), axis=0).astype(np.uint8)
+    else:
+        accumulator = np.zeros((h, w, 3), np.float32)
+        for frame in aligned:
+            np.add(accumulator, frame, out=accumulator)
+        accumulator *= 1.0 / len(aligned)
+        merged = np.empty((h, w, 3), np.uint8)
+        np.rint(accumulator, out=accumulator)
+        np.copyto(merged, accumulator, casting="unsafe")
+    info = {"frames": len(frames), "used": len(aligned), "shifts": shifts,
+            "elapsed": time.perf_counter() - start}
+    return merged, info
+
+
+def merge_burst_shared(source, target, method=BURST_MERGE):
+    """Слияние серии из разделяемой памяти: source - стопка кадров (K, H, W, 3), target - результат"""
+    stack, result = SharedFrame.attach(source), SharedFrame.attach(target)
+    try:
+        merged, info = merge_burst(list(stack.array), method)
+        np.copyto(result.array, merged)
+        del merged
+        return info
+    finally:
+        stack.close()
+        result.close()
+
+
+def white_balance_gains(frame, mode):
+    """Коэффициенты B, G, R баланса белого или None"""
+    if mode == "led":
+        return LED_WHITE_GAINS
+    if mode == "gray_world":
+        means = np.array(cv2.mean(frame)[:3])
+        gains = means.mean() / np.maximum(means, 1.0)
+        return tuple(np.clip(gains, 1 / WHITE_BALANCE_MAX_GAIN, WHITE_BALANCE_MAX_GAIN))
+    return None
+
+
+def enhance_frame(frame, white_balance=ENHANCE_WHITE_BALANCE, clahe_clip=ENHANCE_CLAHE_CLIP,
+                  glare=ENHANCE_GLARE):
+    """Баланс белого, подавление бликов и CLAHE по яркости. Возвращает (кадр BGR, сведения)"""
+    start = time.perf_counter()
+    info = {"gains": None, "glare": 0.0}
+    image = frame
+    
+    gains = white_balance_gains(image, white_balance)
+    if gains is not None:
+        # Диагональная матрица: умножение каналов с насыщением uint8 за один проход
+        image = cv2.transform(image, np.diag(np.array(gains, np.float32)))
+        info["gains"] = tuple(round(float(g), 3) for g in gains)
+        
+    if glare:
+        mask = cv2.inRange(image, (GLARE_THRESHOLD,) * 3, (255, 255, 255))
+        fraction = cv2.countNonZero(mask) / mask.size
+        info["glare"] = round(fraction, 4)
+        if 0 < fraction <= GLARE_MAX_FRACTION:
+            # Ореол вокруг блика тоже пересвечен - расширяем маску
+            mask = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+            image = cv2.inpaint(image, mask, GLARE_INPAINT_RADIUS, cv2.INPAINT_TELEA)
+            
+    if clahe_clip:
+        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+        lightness = cv2.extractChannel(lab, 0)
+        clahe = cv2.createCLAHE(clipLimit=clahe_clip, tileGridSize=(ENHANCE_CLAHE_GRID, ENHANCE_CLAHE_GRID))
+        lab = cv2.insertChannel(clahe.apply(lightness), lab, 0)
+        image = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        
+    info["elapsed"] = time.perf_counter() - start
+    return image, info
+
+
+def enhance_shared(source, target, settings):
+    """Улучшение кадра из разделяемой памяти (выполняется в процессе-обработчике)"""
+    frame, result = SharedFrame.attach(source), SharedFrame.attach(target)
+    try:
+        enhanced, info = enhance_frame(frame.array, **settings)
+        np.copyto(result.array, enhanced)
+        # Без этого close() не освободит блок, если кадр не менялся (enhanced - вид на него)
+        del enhanced
+        return info
+    finally:
+        frame.close()
+        result.close()
+
+
+def enhance_settings():
+    """Параметры улучшения для процесса-обработчика"""
+    return {"white_balance": ENHANCE_WHITE_BALANCE, "clahe_clip": ENHANCE_CLAHE_CLIP,
+            "glare": ENHANCE_GLARE}
+
+
+def enhance_in_pool(frame):
+    """Улучшение кадра в пуле процессов; кадр передается через разделяемую память"""
+    source = SharedFrame.from_array(frame)
+    target = SharedFrame(frame.shape, frame.dtype)
+    try:
+        info = get_process_pool().submit(enhance_shared, source.descriptor(), target.descriptor(),
+                                         enhance_settings()).result()
+        return target.array.copy(), info
+    finally:
+        source.close()
+        target.close()
+
+
+class SharedFrame:
+    """Массив кадров в разделяемой памяти: процессу-обработчику передается только имя блока"""
+    def __init__(self, shape, dtype=np.uint8, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            # Обработчики (spawn) используют трекер ресурсов главного процесса,
+            # поэтому блок удаляет только владелец - в close()
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+        
+    @classmethod
+    def from_array(cls, array):
+        shared = cls(array.shape, array.dtype)
+        np.copyto(shared.array, array)
+        return shared
+        
+    @classmethod
+    def from_frames(cls, frames):
+        """Стопка одинаковых кадров (K, H, W, C)"""
+        shared = cls((len(frames),) + frames[0].shape, frames[0].dtype)
+        for index, frame in enumerate(frames):
+            np.copyto(shared.array[index], frame)
+        return shared
+        
+    @classmethod
+    def attach(cls, descriptor):
+        name, shape, dtype = descriptor
+        return cls(shape, dtype, name)
+        
+    def descriptor(self):
+        """Имя блока, форма и тип - все, что нужно другому процессу"""
+        return self.shm.name, self.shape, self.dtype.str
+        
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Общий пул процессов для обработки снимков (создается при первом обращении, из любого потока)"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn: дочерний процесс не наследует потоки и блокировки GUI
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+class CameraDevice:
+    """Описание найденной камеры"""
+    def __init__(self, index, name, backend, width, height):
+        self.index = index
+        self.name = name
+        self.backend = backend
+        self.width = width
+        self.height = height
+        
+    @property
+    def identity(self):
+        """Идентификатор устройства, не зависящий от номера индекса"""
+        return f"{self.name}|{self.backend}|{self.width}x{self.height}"
+        
+    def __repr__(self):
+        return f"#{self.index} {self.name} ({self.backend}, {self.width}x{self.height})"
+
+
+class CameraRegistry:
+    """Кэш доступных камер: параллельный опрос один раз и при подключении устройств"""
+    def __init__(self, max_index=CAMERA_MAX_INDEX):
+        self.max_index = max_index
+        self.devices = []
+        self.selected_identity = None
+        self.signature = None
+        self.lock = threading.Lock()
+        self.probe_thread = None
+        self.probed = threading.Event()
+        
+    def probe_async(self):
+        """Опрос камер в фоне (при запуске программы)"""
+        self.probed.clear()
+        self.probe_thread = threading.Thread(target=self.probe, name="camera-probe", daemon=True)
+        self.probe_thread.start()
+        
+    def probe(self):
+        """Параллельная проверка индексов 0..max_index-1"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_index) as pool:
+            results = list(pool.map(self.probe_index, range(self.max_index)))
+        devices = [device for device in results if device]
+        with self.lock:
+            self.devices = devices
+            self.signature = self.device_signature()
+        self.probed.set()
+        print(f"[CAMERA] Найдено камер: {len(devices)} за {(time.perf_counter() - start) * 1000:.0f} мс: {devices}")
+        return devices
+        
+    @staticmethod
+    def probe_index(index):
+        """Проверка одного индекса камеры"""
+        cap = cv2.VideoCapture(index)
+        try:
+            if not cap.isOpened():
+                return None
+            return CameraDevice(index, CameraRegistry.device_name(index), cap.getBackendName(),
+                                int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        except Exception as e:
+            print(f"[CAMERA] Ошибка опроса камеры {index}: {e}")
+            return None
+        finally:
+            cap.release()
+            
+    @staticmethod
+    def device_name(index):
+        """Имя устройства (Linux: из sysfs), иначе номер индекса"""
+        sysfs = f"/sys/class/video4linux/video{index}"
+        try:
+            with open(os.path.join(sysfs, "name"), encoding="utf-8") as f:
+                name = f.read().strip()
+            # Путь USB-порта различает одинаковые камеры
+            return f"{name}@{os.path.basename(os.path.realpath(os.path.join(sysfs, 'device')))}"
+        except OSError:
+            return f"camera{index}"
+            
+    @staticmethod
+    def device_signature():
+        """Дешевый признак изменения набора устройств (Linux: список /dev/video*)"""
+        nodes = glob.glob("/dev/video*")
+        return tuple(sorted(nodes)) if nodes else None
+        
+    def refresh_if_changed(self):
+        """Повторный опрос, если устройства подключили или отключили"""
+        signature = self.device_signature()
+        if signature is not None and signature != self.signature:
+            print("[CAMERA] Изменился набор устройств - повторный опрос")
+            self.probe()
+            
+    def available(self, timeout=None):
+        """Список камер (ждет завершения фонового опроса)"""
+        if not self.probed.wait(timeout):
+            return []
+        with self.lock:
+            return list(self.devices)
+            
+    def preferred(self, timeout=None):
+        """Камера для работы: ранее выбранная, иначе с наибольшим индексом"""
+        devices = self.available(timeout)
+        if not devices:
+            return None
+        for device in devices:
+            if device.identity == self.selected_identity:
+                return device
+        return max(devices, key=lambda device: device.index)
+        
+    def select(self, device):
+        self.selected_identity = device.identity
+
+
+class SyntheticFrameSource:
+    """Синтетическая камера с интерфейсом cv2.VideoCapture (для тестов и замеров без оборудования).
+
+    Отдает сдвигающуюся текстуру с заданной частотой кадров; в режиме mjpeg -
+    заранее сжатые JPEG-кадры, как камера в режиме MJPEG без декодирования.
+    """
+    MJPEG_FRAMES = 16
+    
+    def __init__(self, width=1280, height=720, fps=30, mjpeg=False):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.mjpeg = mjpeg
+        self.index = 0
+        self.next_time = time.monotonic()
+        self.opened = True
+        
+        # Текстура вдвое шире кадра: кадр - окно, сдвигающееся по ней
+        rng = np.random.default_rng(0)
+        noise = rng.integers(0, 256, (height // 8 + 1, width // 4 + 1, 3), dtype=np.uint8)
+        texture = cv2.resize(noise, (width * 2, height), interpolation=cv2.INTER_CUBIC)
+        cv2.putText(texture, "SYNTHETIC", (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    height / 200, (255, 255, 255), max(1, height // 120))
+        self.texture = texture
+        self.encoded = []
+        if mjpeg:
+            for i in range(self.MJPEG_FRAMES):
+                ok, data = cv2.imencode(".jpg", self.window(i), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+                self.encoded.append(data.reshape(1, -1))
+                
+    def window(self, index, out=None):
+        shift = (index * 8) % self.width
+        frame = self.texture[:, shift:shift + self.width]
+        if out is None:
+            return frame.copy()
+        np.copyto(out, frame)
+        return out
+        
+    def isOpened(self):
+        return self.opened
+        
+    def getBackendName(self):
+        return "SYNTHETIC"
+        
+    def wait_next(self):
+        """Выдержка темпа кадров, как у настоящей камеры"""
+        if self.fps <= 0:
+            return
+        self.next_time += 1 / self.fps
+        delay = self.next_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_time = time.monotonic()
+            
+    def grab(self):
+        self.wait_next()
+        self.index += 1
+        return self.opened
+        
+    def retrieve(self, image=None):
+        if self.mjpeg:
+            return True, self.encoded[self.index % len(self.encoded)]
+        if image is not None and image.shape != (self.height, self.width, 3):
+            image = None
+        return True, self.window(self.index, image)
+        
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+        
+    def get(self, prop):
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.width, cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+                cv2.CAP_PROP_FPS: self.fps,
+                cv2.CAP_PROP_FOURCC: cv2.VideoWriter_fourcc(*"MJPG") if self.mjpeg else 0}.get(prop, 0)
+                
+    def set(self, prop, value):
+        return False
+        
+    def release(self):
+        self.opened = False
+
+
+class VideoFileFrameSource:
+    """Видеофайл в роли камеры: воспроизведение по кругу в темпе файла"""
+    def __init__(self, path, loop=True, realtime=True):
+        self.path = path
+        self.loop = loop
+        # cv2.VideoCapture не открывает пути с кириллицей в Windows: такой файл
+        # открывается через ссылку (или копию) с ASCII-именем во временной папке
+        self.temp_path = None
+        if not path.isascii() and os.path.isfile(path):
+            extension = os.path.splitext(path)[1]
+            self.temp_path = os.path.join(tempfile.gettempdir(), f"camera_source_{os.getpid()}_{id(self):x}"
+                                          f"{extension if extension.isascii() else ''}")
+            try:
+                os.link(path, self.temp_path)
+            except OSError:
+                shutil.copyfile(path, self.temp_path)
+        self.capture = cv2.VideoCapture(self.temp_path or path)
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 30
+        self.realtime = realtime
+        self.next_time = time.monotonic()
+        
+    def isOpened(self):
+        return self.capture.isOpened()
+        
+    def getBackendName(self):
+        return "FILE"
+        
+    def read(self, image=None):
+        if self.realtime:
+            self.next_time += 1 / self.fps
+            delay = self.next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.next_time = time.monotonic()
+        ret, frame = self.capture.read(image)
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read(image)
+        return ret, frame
+        
+    def grab(self):
+        return self.capture.grab()
+        
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return self.capture.get(prop)
+        
+    def set(self, prop, value):
+        return False
+        
+    def release(self):
+        self.capture.release()
+        if self.temp_path:
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
+            self.temp_path = None
+
+
+def open_frame_source(spec):
+    """Источник кадров по описанию: synthetic[-mjpeg][:ШxВ[@fps]] или путь к видеофайлу"""
+    match = re.match(r"^synthetic(?P<mjpeg>-mjpeg)?(?::(?P<w>\d+)x(?P<h>\d+)(?:@(?P<fps>\d+))?)?$", spec)
+    if match:
+        return SyntheticFrameSource(int(match["w"] or 1280), int(match["h"] or 720),
+                                    int(match["fps"] or CAMERA_FPS), mjpeg=bool(match["mjpeg"]))
+    return VideoFileFrameSource(spec)
+
+
+def crc8(data):
+    """CRC-8 (полином 0x07) - такой же считает скетч Arduino"""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def encode_frame(msg_type, seq, arg=0, device_ms=0):
+    """Сборка кадра протокола"""
+    body = struct.pack(FRAME_FORMAT[:-1], FRAME_SYNC, msg_type, seq & 0xFF, arg & 0xFF,
+                       device_ms & 0xFFFFFFFF)
+    return body + bytes([crc8(body[1:])])
+
+
+def percentile(values, q):
+    """Перцентиль q (0..100) по списку значений"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+class DeviceMessage:
+    """Сообщение от Arduino"""
+    def __init__(self, msg_type, seq, arg, device_ms, received=None):
+        self.type = msg_type
+        self.seq = seq
+        self.arg = arg
+        self.device_ms = device_ms
+        # Момент приема на ПК (time.perf_counter)
+        self.received = time.perf_counter() if received is None else received
+        
+    @property
+    def name(self):
+        return EVENT_NAMES.get(self.type, f"0x{self.type:02X}")
+        
+    def __repr__(self):
+        return f"{self.name} #{self.seq} @ {self.device_ms} мс"
+
+
+class FrameParser:
+    """Разбор потока байтов: кадры протокола и текстовые строки между ними"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.line = bytearray()
+        self.crc_errors = 0
+        
+    def feed(self, data):
+        """Добавление байтов; возвращает (сообщения, строки)"""
+        self.buffer += data
+        messages, lines = [], []
+        while self.buffer:
+            sync = self.buffer.find(FRAME_SYNC)
+            if sync != 0:
+                # Текст вне кадров (например, ARDUINO_READY)
+                text = self.buffer if sync < 0 else self.buffer[:sync]
+                self.collect_text(bytes(text), lines)
+                del self.buffer[:len(text)]
+                continue
+            if len(self.buffer) < FRAME_SIZE:
+                break
+            frame = bytes(self.buffer[:FRAME_SIZE])
+            if crc8(frame[1:-1]) != frame[-1]:
+                # Ложный байт синхронизации или поврежденный кадр - сдвигаемся на байт
+                self.crc_errors += 1
+                del self.buffer[0]
+                continue
+            _, msg_type, seq, arg, device_ms, _ = struct.unpack(FRAME_FORMAT, frame)
+            messages.append(DeviceMessage(msg_type, seq, arg, device_ms))
+            del self.buffer[:FRAME_SIZE]
+        return messages, lines
+        
+    def collect_text(self, text, lines):
+        for byte in text:
+            if byte == 0x0A:
+                line = self.line.decode("utf-8", errors="replace").strip()
+                if line:
+                    lines.append(line)
+                self.line.clear()
+            elif len(self.line) < 256:
+                self.line.append(byte)
+
+
+class SerialTransport:
+    """Событийное чтение порта Arduino в отдельном потоке.
+
+    Поток блокируется в read() до прихода данных (без опроса in_waiting),
+    кадры разбираются FrameParser и передаются в on_message из потока чтения.
+    Подходит любой объект с интерфейсом pyserial, в том числе
+    serial.serial_for_url("loop://") и псевдотерминал.
+    """
+    def __init__(self, port, on_message=None, on_line=None, on_error=None):
+        self.port = port
+        self.on_message = on_message
+        self.on_line = on_line
+        self.on_error = on_error
+        self.parser = FrameParser()
+        self.running = False
+        self.thread = None
+        self.write_lock = threading.Lock()
+        # Получена строка ARDUINO_READY (скетч закончил setup())
+        self.ready = threading.Event()
+        
+        # Статистика
+        self.messages_received = 0
+        self.messages_lost = 0
+        self.duplicates = 0
+        self.last_seq = None
+        # Минимальная разница часов ПК и устройства - оценка задержки передачи
+        self.min_clock_offset = None
+        
+    @classmethod
+    def open(cls, url, baudrate=SERIAL_BAUDRATE, **callbacks):
+        """Открытие порта по имени или URL pyserial (COM3, /dev/ttyUSB0, loop://)"""
+        port = serial.serial_for_url(url, baudrate=baudrate, timeout=0.5)
+        return cls(port, **callbacks)
+        
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.read_loop, name="serial-reader", daemon=True)
+        self.thread.start()
+        
+    def read_loop(self):
+        while self.running:
+            try:
+                # Блокирующее чтение: ждем хотя бы один байт (до таймаута порта)
+                data = self.port.read(max(1, self.port.in_waiting))
+            except Exception as e:
+                if self.running:
+                    self.running = False
+                    if self.on_error:
+                        self.on_error(e)
+                break
+            if data:
+                self.handle_data(data)
+                
+    def handle_data(self, data):
+        messages, lines = self.parser.feed(data)
+        for line in lines:
+            if line == ARDUINO_READY_LINE:
+                self.ready.set()
+            if self.on_line:
+                self.on_line(line)
+        for message in messages:
+            if not self.check_sequence(message):
+                continue
+            self.messages_received += 1
+            if message.type != EVENT_ACK:
+                offset = message.received - message.device_ms / 1000
+                if self.min_clock_offset is None or offset < self.min_clock_offset:
+                    self.min_clock_offset = offset
+            if self.on_message:
+                self.on_message(message)
+                
+    def check_sequence(self, message):
+        """Учет пропущенных и повторных кадров по номеру"""
+        if self.last_seq is not None:
+            gap = (message.seq - self.last_seq) & 0xFF
+            if gap == 0:
+                self.duplicates += 1
+                return False
+            self.messages_lost += gap - 1
+        self.last_seq = message.seq
+        return True
+        
+    def transport_delay(self, message):
+        """Оценка задержки доставки сообщения относительно самого быстрого"""
+        if self.min_clock_offset is None:
+            return 0.0
+        return max(0.0, message.received - message.device_ms / 1000 - self.min_clock_offset)
+        
+    def write(self, data):
+        with self.write_lock:
+            self.port.write(data)
+            
+    def close(self):
+        self.running = False
+        try:
+            self.port.close()
+        except Exception:
+            pass
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+
+
+class FakeArduino:
+    """Имитация скетча с интерфейсом pyserial.
+
+    Отдает ARDUINO_READY и события кнопки по сценарию [(секунды от старта, событие), ...]
+    кадрами протокола, отвечает ACK на команды кольцу. Время отправки каждого
+    события сохраняется в sent_times (номер кадра -> time.perf_counter()).
+    """
+    def __init__(self, script=(), ready_delay=0.0):
+        self.script = sorted(script, key=lambda item: item[0])
+        self.output = bytearray()
+        self.cond = threading.Condition()
+        self.start = time.perf_counter()
+        self.seq = 0
+        self.sent_times = {}
+        self.state = {"brightness": LED_BRIGHTNESS, "pattern": LED_PATTERN_OFF, "flash": False}
+        self.input = FrameParser()
+        self.is_open = True
+        self.timeout = 0.5
+        self.ready_at = self.start + ready_delay
+        self.ready_sent = False
+        
+    @staticmethod
+    def parse_script(text):
+        """Сценарий из строки вида "short@1,long@3.5,long@5"""
+        names = {"short": EVENT_SHORT_PRESS, "long": EVENT_LONG_PRESS}
+        script = []
+        for item in filter(None, text.split(",")):
+            name, at = item.split("@")
+            script.append((float(at), names[name.strip().lower()]))
+        return script
+        
+    def emit(self, data):
+        with self.cond:
+            self.output += data
+            self.cond.notify_all()
+            
+    def send_frame(self, msg_type, arg, value):
+        seq = self.seq
+        self.seq = (self.seq + 1) & 0xFF
+        self.sent_times[seq] = time.perf_counter()
+        self.emit(encode_frame(msg_type, seq, arg, value))
+        
+    def pump(self):
+        """Выдача событий, время которых наступило"""
+        now = time.perf_counter()
+        if not self.ready_sent and now >= self.ready_at:
+            self.ready_sent = True
+            self.emit(b"ARDUINO_READY\r\n")
+        while self.ready_sent and self.script and self.start + self.script[0][0] <= now:
+            _, event = self.script.pop(0)
+            self.send_frame(event, 0, int((now - self.start) * 1000))
+            
+    def next_event_delay(self):
+        if not self.ready_sent:
+            return max(0.0, self.ready_at - time.perf_counter())
+        if not self.script:
+            return None
+        return max(0.0, self.start + self.script[0][0] - time.perf_counter())
+        
+    @property
+    def in_waiting(self):
+        self.pump()
+        with self.cond:
+            return len(self.output)
+            
+    def read(self, size=1):
+        deadline = time.perf_counter() + (self.timeout if self.timeout is not None else 1e9)
+        while self.is_open:
+            self.pump()
+            with self.cond:
+                if self.output:
+                    data = bytes(self.output[:size])
+                    del self.output[:size]
+                    return data
+                delay = self.next_event_delay()
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return b""
+                self.cond.wait(min(remaining, delay) if delay is not None else remaining)
+        return b""
+        
+    def readline(self):
+        line = bytearray()
+        while not line.endswith(b"\n"):
+            data = self.read(1)
+            if not data:
+                break
+            line += data
+        return bytes(line)
+        
+    def write(self, data):
+        messages, _ = self.input.feed(data)
+        for message in messages:
+            if message.type == CMD_SET_BRIGHTNESS:
+                self.state["brightness"] = message.arg
+            elif message.type == CMD_SET_PATTERN:
+                self.state["pattern"] = message.arg
+            elif message.type == CMD_FLASH:
+                self.state["flash"] = True
+            else:
+                continue
+            value = (self.state["brightness"] | self.state["pattern"] << 8 | int(self.state["flash"]) << 16)
+            self.send_frame(EVENT_ACK, message.seq, value)
+        return len(data)
+        
+    def reset_input_buffer(self):
+        with self.cond:
+            self.output.clear()
+            
+    def close(self):
+        self.is_open = False
+        with self.cond:
+            self.cond.notify_all()
+
+
+class LedController:
+    """Команды светодиодному кольцу: очередь, объединение, пакетная отправка и подтверждения.
+
+    Из нескольких команд одного типа, поставленных до отправки, уходит только
+    последняя (например, при движении ползунка яркости). Все накопленные
+    команды записываются в порт одним пакетом; неподтвержденные повторяются.
+    """
+    def __init__(self, transport, on_state=None):
+        self.transport = transport
+        self.on_state = on_state
+        self.pending = {}  # тип команды -> аргумент
+        self.pending_callbacks = {}  # тип команды -> [функции при подтверждении]
+        self.in_flight = {}  # номер -> (тип, аргумент, время отправки, попытка, функции)
+        self.outgoing = []  # кадры следующего пакета
+        self.seq = 0
+        self.cond = threading.Condition()
+        # Подтвержденное скетчем состояние: {"brightness", "pattern", "flash"}
+        self.state = None
+        
+        # Статистика
+        self.commands_sent = 0
+        self.batches_sent = 0
+        self.commands_coalesced = 0
+        self.commands_failed = 0
+        
+        self.running = True
+        self.thread = threading.Thread(target=self.send_loop, name="led-commands", daemon=True)
+        self.thread.start()
+        
+    def set_brightness(self, value):
+        self.enqueue(CMD_SET_BRIGHTNESS, max(0, min(255, int(value))))
+        
+    def set_pattern(self, pattern):
+        self.enqueue(CMD_SET_PATTERN, pattern)
+        
+    def flash(self, duration_ms=FLASH_DURATION_MS, on_ack=None):
+        """Вспышка на duration_ms; on_ack(state) вызывается при подтверждении (None - не подтверждена)"""
+        self.enqueue(CMD_FLASH, min(255, duration_ms // 10), on_ack)
+        
+    def enqueue(self, command, arg, callback=None):
+        with self.cond:
+            if command in self.pending:
+                self.commands_coalesced += 1
+            self.pending[command] = arg
+            if callback:
+                self.pending_callbacks.setdefault(command, []).append(callback)
+            self.cond.notify()
+            
+    def send_loop(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or not self.running, self.next_timeout())
+                if not self.running:
+                    break
+                failed = self.collect_timeouts()
+                frames = self.build_batch()
+            for callback in failed:
+                callback(None)
+            if frames:
+                try:
+                    self.transport.write(b"".join(frames))
+                    self.batches_sent += 1
+                    self.commands_sent += len(frames)
+                except Exception as e:
+                    print(f"[LED] Ошибка отправки команд: {e}")
+                    
+    def next_timeout(self):
+        """Время до ближайшего истечения ожидания подтверждения"""
+        if not self.in_flight:
+            return None
+        oldest = min(entry[2] for entry in self.in_flight.values())
+        return max(0.0, oldest + LED_ACK_TIMEOUT_S - time.perf_counter())
+        
+    def collect_timeouts(self):
+        """Повтор неподтвержденных команд; возвращает функции для отказавших"""
+        failed = []
+        now = time.perf_counter()
+        for seq, (command, arg, sent, attempt, callbacks) in list(self.in_flight.items()):
+            if now - sent < LED_ACK_TIMEOUT_S:
+                continue
+            del self.in_flight[seq]
+            if command in self.pending:
+                # Уже есть более новое значение - повторять старое не нужно
+                self.pending_callbacks.setdefault(command, []).extend(callbacks)
+            elif attempt < LED_MAX_ATTEMPTS:
+                self.send_frame(command, arg, attempt + 1, callbacks)
+            else:
+                self.commands_failed += 1
+                failed.extend(callbacks)
+        return failed
+        
+    def build_batch(self):
+        """Кадры пакета: повторы и все накопленные команды"""
+        for command, arg in self.pending.items():
+            self.send_frame(command, arg, 1, self.pending_callbacks.pop(command, []))
+        self.pending.clear()
+        frames, self.outgoing = self.outgoing, []
+        return frames
+        
+    def send_frame(self, command, arg, attempt, callbacks):
+        self.seq = (self.seq + 1) & 0xFF
+        self.in_flight[self.seq] = (command, arg, time.perf_counter(), attempt, callbacks)
+        self.outgoing.append(encode_frame(command, self.seq, arg))
+        
+    def on_ack(self, message):
+        """Подтверждение от скетча (вызывается в потоке чтения порта)"""
+        with self.cond:
+            entry = self.in_flight.pop(message.arg, None)
+        if entry is None:
+            return
+        value = message.device_ms
+        self.state = {"brightness": value & 0xFF, "pattern": (value >> 8) & 0xFF,
+                      "flash": bool((value >> 16) & 0x01)}
+        if self.on_state:
+            self.on_state(dict(self.state))
+        for callback in entry[4]:
+            callback(dict(self.state))
+            
+    @property
+    def waiting(self):
+        """Есть неподтвержденные команды"""
+        with self.cond:
+            return bool(self.pending or self.in_flight)
+            
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join(timeout=1)
+
+
+class FrameRingBuffer:
+    """Кольцевой буфер последних кадров с заранее выделенной памятью.
+
+    Кадры для снимка можно не копировать, а закрепить (recent(..., pin=True)):
+    закрепленный слот не перезаписывается - следующий кадр для него пишется
+    в запасной буфер, а слот возвращается в запас после release().
+    """
+    def __init__(self, capacity=FRAME_BUFFER_SIZE):
+        self.capacity = max(2, capacity)
+        self.slots = []
+        self.seqs = [0] * self.capacity
+        self.timestamps = [0.0] * self.capacity
+        self.write_seq = 0
+        self.writing_index = None
+        self.pins = {}  # id(кадр) -> [кадр, число закреплений]
+        self.spare = []
+        self.lock = threading.Lock()
+        self.new_frame = threading.Condition(self.lock)
+        
+    def allocate(self, shape, dtype):
+        """Выделение памяти под кадры заданного размера"""
+        with self.lock:
+            self.slots = [np.empty(shape, dtype) for _ in range(self.capacity)]
+            self.seqs = [0] * self.capacity
+            self.writing_index = None
+            self.spare = []
+            
+    def matches(self, frame):
+        """Проверка, что кадр помещается в уже выделенные слоты"""
+        return bool(self.slots) and self.slots[0] is not None and self.slots[0].shape == frame.shape and self.slots[0].dtype == frame.dtype
+        
+    def begin_write(self):
+        """Получение слота для записи следующего кадра"""
+        with self.lock:
+            index = self.write_seq % self.capacity
+            self.writing_index = index
+            slot = self.slots[index]
+            if id(slot) in self.pins:
+                # Слот удерживает снимок в очереди записи - пишем в запасной буфер
+                slot = self.spare.pop() if self.spare else np.empty_like(slot)
+                self.slots[index] = slot
+            return slot
+            
+    def commit(self, timestamp):
+        """Публикация записанного кадра"""
+        with self.lock:
+            index = self.write_seq % self.capacity
+            self.write_seq += 1
+            self.seqs[index] = self.write_seq
+            self.timestamps[index] = timestamp
+            self.writing_index = None
+            self.new_frame.notify_all()
+            return self.write_seq
+            
+    def publish(self, frame, timestamp):
+        """Публикация кадра переменного размера (сжатый MJPEG) без копирования"""
+        with self.lock:
+            if len(self.slots) != self.capacity:
+                self.slots = [None] * self.capacity
+            index = self.write_seq % self.capacity
+            self.slots[index] = frame
+            self.write_seq += 1
+            self.seqs[index] = self.write_seq
+            self.timestamps[index] = timestamp
+            self.new_frame.notify_all()
+            return self.write_seq
+            
+    def abort_write(self):
+        """Отмена записи кадра (ошибка чтения)"""
+        with self.lock:
+            self.writing_index = None
+            
+    def latest(self, out=None):
+        """Копия последнего кадра: (номер кадра, кадр) или (0, None)"""
+        with self.lock:
+            if self.write_seq == 0 or not self.slots:
+                return 0, None
+            index = (self.write_seq - 1) % self.capacity
+            src = self.slots[index]
+            if out is None or out.shape != src.shape or out.dtype != src.dtype:
+                out = np.empty_like(src)
+            np.copyto(out, src)
+            return self.seqs[index], out
+            
+    def recent(self, window_s, now=None, count=None, pin=False):
+        """Кадры за последние window_s секунд (не больше count последних): список (seq, timestamp, frame).
+
+        pin=False - копии кадров; pin=True - сами слоты без копирования,
+        закрепленные до release() (копирование под блокировкой задержало бы
+        и поток GUI, и поток захвата).
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.write_seq == 0 or not self.slots:
+                return []
+            indices = [index for index in range(self.capacity)
+                       if self.seqs[index] and index != self.writing_index
+                       and now - self.timestamps[index] <= window_s]
+            indices.sort(key=lambda index: self.seqs[index])
+            if count is not None:
+                indices = indices[-count:] if count > 0 else []
+            frames = []
+            for index in indices:
+                frame = self.slots[index]
+                if pin:
+                    entry = self.pins.setdefault(id(frame), [frame, 0])
+                    entry[1] += 1
+                else:
+                    frame = frame.copy()
+                frames.append((self.seqs[index], self.timestamps[index], frame))
+        return frames
+        
+    def release(self, frames):
+        """Снятие закрепления с кадров, полученных через recent(..., pin=True)"""
+        with self.lock:
+            for frame in frames:
+                entry = self.pins.get(id(frame))
+                if entry is None or entry[0] is not frame:
+                    continue
+                entry[1] -= 1
+                if entry[1] > 0:
+                    continue
+                del self.pins[id(frame)]
+                # Вытесненный из кольца слот становится запасным буфером
+                if (not any(slot is frame for slot in self.slots) and self.slots and self.slots[0] is not None
+                        and frame.shape == self.slots[0].shape and frame.dtype == self.slots[0].dtype
+                        and len(self.spare) < self.capacity):
+                    self.spare.append(frame)
+        
+    def wait_for_frame(self, after_seq, timeout=1.0):
+        """Ожидание кадра с номером больше after_seq"""
+        with self.lock:
+            self.new_frame.wait_for(lambda: self.write_seq > after_seq, timeout)
+            return self.write_seq
+            
+    def clear(self):
+        """Сброс буфера"""
+        with self.lock:
+            self.write_seq = 0
+            self.seqs = [0] * self.capacity
+            self.writing_index = None
+
+
+class CaptureEngine:
+    """Фоновый поток захвата: владеет cv2.VideoCapture и наполняет кольцевой буфер"""
+    def __init__(self, camera, buffer_size=FRAME_BUFFER_SIZE):
+        self.camera = camera
+        self.buffer = FrameRingBuffer(buffer_size)
+        self.running = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.active = threading.Event()
+        self.active.set()
+        self.skip_frames = 0
+        # Камера отдает сжатые кадры MJPEG (режим без перекодирования)
+        self.compressed = False
+        # Запись видео: получает каждый кадр без ожидания (VideoRecorder.offer)
+        self.recorder = None
+        
+        # Счетчики кадров
+        self.frames_grabbed = 0
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.read_errors = 0
+        self.last_shown_seq = 0
+        
+    def start(self):
+        """Запуск потока захвата"""
+        if self.running:
+            return
+        self.stop_event.clear()
+        self.running = True
+        self.thread = threading.Thread(target=self.capture_loop, name="capture", daemon=True)
+        self.thread.start()
+        
+    def stop(self, release=True):
+        """Остановка потока захвата (и освобождение камеры)"""
+        self.running = False
+        self.stop_event.set()
+        self.active.set()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=2)
+        self.thread = None
+        if release and self.camera:
+            self.camera.release()
+            self.camera = None
+            
+    @property
+    def paused(self):
+        return self.running and not self.active.is_set()
+        
+    def pause(self):
+        """Пауза захвата без освобождения устройства (теплый резерв)"""
+        self.active.clear()
+        
+    def resume(self):
+        """Возобновление захвата: старые кадры из буфера отбрасываются"""
+        self.buffer.clear()
+        self.last_shown_seq = 0
+        # В драйвере могли остаться кадры, снятые до паузы
+        self.skip_frames = FRAME_BUFFER_SIZE
+        self.active.set()
+        
+    def capture_loop(self):
+        """Цикл захвата кадров с максимальной скоростью устройства"""
+        while not self.stop_event.is_set():
+            if not self.active.is_set():
+                self.active.wait(0.2)
+                continue
+            try:
+                if self.skip_frames > 0:
+                    self.skip_frames -= 1
+                    self.camera.grab()
+                    continue
+                    
+                if self.compressed or not self.buffer.slots:
+                    # Первый кадр или сжатый MJPEG - размер заранее неизвестен
+                    start = time.perf_counter()
+                    ret, frame = self.camera.read()
+                    pipeline_metrics.observe("grab", time.perf_counter() - start)
+                    if not ret:
+                        self.read_errors += 1
+                        time.sleep(0.01)
+                        continue
+                    timestamp = time.monotonic()
+                    if is_jpeg_buffer(frame):
+                        # Байты JPEG от камеры храним как есть, без декодирования
+                        self.compressed = True
+                        self.buffer.publish(frame, timestamp)
+                    else:
+                        self.compressed = False
+                        self.buffer.allocate(frame.shape, frame.dtype)
+                        np.copyto(self.buffer.begin_write(), frame)
+                        self.buffer.commit(timestamp)
+                    self.frames_grabbed += 1
+                    self.record(frame, timestamp)
+                    continue
+                    
+                # Читаем прямо в заранее выделенный слот буфера
+                slot = self.buffer.begin_write()
+                start = time.perf_counter()
+                ret, frame = self.camera.read(slot)
+                pipeline_metrics.observe("grab", time.perf_counter() - start)
+                if not ret:
+                    self.buffer.abort_write()
+                    self.read_errors += 1
+                    time.sleep(0.01)
+                    continue
+                    
+                if frame is not slot:
+                    # Камера сменила разрешение - перераспределяем буфер
+                    self.buffer.abort_write()
+                    if not self.buffer.matches(frame):
+                        self.buffer.allocate(frame.shape, frame.dtype)
+                    np.copyto(self.buffer.begin_write(), frame)
+                    
+                timestamp = time.monotonic()
+                self.buffer.commit(timestamp)
+                self.frames_grabbed += 1
+                self.record(frame, timestamp)
+                
+            except Exception as e:
+                self.buffer.abort_write()
+                self.read_errors += 1
+                print(f"[CAPTURE] Ошибка захвата: {e}")
+                time.sleep(0.1)
+                
+    def record(self, frame, timestamp):
+        """Передача кадра записи видео (если она идет)"""
+        recorder = self.recorder
+        if recorder:
+            recorder.offer(frame, timestamp)
+            
+    def latest_frame(self, out=None):
+        """Последний кадр из буфера без обращения к устройству"""
+        return self.buffer.latest(out)
+        
+    def recent_frames(self, window_s, count=None, pin=False):
+        """Кадры из буфера за последние window_s секунд (pin=True - без копирования, см. release_frames)"""
+        return self.buffer.recent(window_s, count=count, pin=pin)
+        
+    def release_frames(self, frames):
+        """Возврат закрепленных кадров в буфер: список кадров"""
+        self.buffer.release(frames)
+        
+    def mark_shown(self, seq):
+        """Учет показанного кадра и пропущенных перед ним"""
+        if seq <= self.last_shown_seq:
+            return
+        if self.last_shown_seq:
+            self.frames_dropped += seq - self.last_shown_seq - 1
+        self.last_shown_seq = seq
+        self.frames_shown += 1
+        
+    def stats_text(self):
+        """Строка со счетчиками кадров"""
+        return (f"Кадры: получено {self.frames_grabbed}, показано {self.frames_shown}, "
+                f"пропущено {self.frames_dropped}")
+
+
+class PhotoJob:
+    """Задание на сохранение снимка и его результат"""
+    def __init__(self, filepath, frames, callback=None, trigger=None, release=None):
+        self.filepath = filepath
+        self.frames = frames  # список (seq, timestamp, frame)
+        # Кадры закреплены в буфере захвата: release(список кадров) возвращает их
+        self.release = release
+        self.callback = callback
+        self.created = time.perf_counter()
+        # Событие кнопки, вызвавшее снимок (для замера задержки)
+        self.trigger = trigger
+        
+        # Заполняется после записи
+        self.frame = None
+        self.seq = None
+        self.score = None
+        self.candidates = len(frames)
+        self.width = 0
+        self.height = 0
+        self.file_size = 0
+        self.encode_time = 0.0
+        self.write_time = 0.0
+        self.elapsed = 0.0
+        self.error = None
+        # Улучшение: сведения из обработчика и путь к исходному кадру
+        self.enhance = None
+        self.original_path = None
+        # Перцептивный хеш сохраненного кадра (поиск почти одинаковых снимков)
+        self.dhash = None
+        
+    @property
+    def filename(self):
+        return os.path.basename(self.filepath)
+        
+    def release_frames(self):
+        """Кадры-кандидаты больше не нужны (закрепленные возвращаются в буфер захвата)"""
+        if self.frames and self.release:
+            self.release([frame for _, _, frame in self.frames])
+        self.frames = None
+
+
+def patient_folder_path(images_dir, surname):
+    """Папка пациента внутри images_dir или None, если фамилия недопустима как имя папки"""
+    if (not surname or surname in (".", "..") or ".." in surname
+            or any(sep and sep in surname for sep in ("/", "\\", os.sep, os.altsep))):
+        return None
+    root = os.path.realpath(images_dir)
+    folder = os.path.realpath(os.path.join(root, surname))
+    if os.path.dirname(folder) != root:
+        return None
+    return os.path.join(images_dir, surname)
+
+
+def original_path(filepath):
+    """Путь к исходному кадру улучшенного снимка: <папка>/originals/<имя>"""
+    folder, name = os.path.split(filepath)
+    return os.path.join(folder, ORIGINALS_DIR_NAME, name)
+
+
+class PhotoWriter:
+    """Фоновое кодирование JPEG и запись на диск через ограниченную очередь"""
+    def __init__(self, workers=PHOTO_WRITER_WORKERS, queue_size=PHOTO_QUEUE_SIZE, enhance=ENHANCE_ENABLED):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        # Улучшение снимков перед записью (можно переключать на ходу)
+        self.enhance = enhance
+        self.pending_paths = set()
+        self.lock = threading.Lock()
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.worker_loop, name=f"photo-writer-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            
+    def submit(self, job):
+        """Постановка снимка в очередь; False если очередь переполнена"""
+        with self.lock:
+            self.pending_paths.add(job.filepath)
+        try:
+            self.jobs.put_nowait(job)
+            return True
+        except queue.Full:
+            with self.lock:
+                self.pending_paths.discard(job.filepath)
+            job.release_frames()
+            return False
+            
+    def is_pending(self, filepath):
+        """Файл уже стоит в очереди на запись"""
+        with self.lock:
+            return filepath in self.pending_paths
+            
+    def pending_count(self):
+        return self.jobs.qsize()
+        
+    def worker_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            try:
+                self.process(job)
+            except Exception as e:
+                job.error = e
+            finally:
+                job.release_frames()
+                job.elapsed = time.perf_counter() - job.created
+                with self.lock:
+                    self.pending_paths.discard(job.filepath)
+                self.jobs.task_done()
+            if job.callback:
+                job.callback(job)
+                
+    def process(self, job):
+        """Выбор кадра, кодирование и атомарная запись"""
+        if len(job.frames) > 1:
+            start = time.perf_counter()
+            (job.seq, _, job.frame), job.score = select_sharpest(job.frames)
+            pipeline_metrics.observe("select", time.perf_counter() - start)
+        else:
+            job.seq, _, job.frame = job.frames[0]
+            job.score = focus_score(job.frame)
+        if job.release and not is_jpeg_buffer(job.frame):
+            # Закрепленный слот буфера: копия выбранного кадра - здесь, в потоке записи
+            job.frame = job.frame.copy()
+        job.release_frames()
+        
+        if self.enhance:
+            self.enhance_job(job)
+            
+        start = time.perf_counter()
+        job.dhash = dhash(job.frame)
+        pipeline_metrics.observe("dhash", time.perf_counter() - start)
+        
+        start = time.perf_counter()
+        data, job.width, job.height = self.encode(job.frame)
+        job.encode_time = time.perf_counter() - start
+        pipeline_metrics.observe("encode", job.encode_time)
+        
+        start = time.perf_counter()
+        self.write_atomic(job.filepath, lambda f: f.write(data))
+        job.write_time = time.perf_counter() - start
+        pipeline_metrics.observe("write", job.write_time)
+        job.file_size = len(data)
+        
+    def enhance_job(self, job):
+        """Запись исходного кадра в originals и замена кадра задания улучшенным"""
+        original = job.frame
+        # Исходник пишется первым: улучшенный снимок без исходника не появится
+        data, _, _ = self.encode(original)
+        job.original_path = original_path(job.filepath)
+        os.makedirs(os.path.dirname(job.original_path), exist_ok=True)
+        self.write_atomic(job.original_path, lambda f: f.write(data))
+        
+        start = time.perf_counter()
+        try:
+            frame = cv2.imdecode(original, cv2.IMREAD_COLOR) if is_jpeg_buffer(original) else original
+            job.frame, job.enhance = enhance_in_pool(frame)
+        except Exception as e:
+            # Снимок важнее улучшения: сохраняем исходный кадр
+            print(f"[ENHANCE] Ошибка улучшения снимка {job.filename}: {e}")
+            return
+        pipeline_metrics.observe("enhance", time.perf_counter() - start)
+        
+    @staticmethod
+    def encode(frame):
+        """JPEG для записи: (данные, ширина, высота)"""
+        if is_jpeg_buffer(frame):
+            # Режим MJPEG: пишем байты камеры как есть, без перекодирования
+            width, height = jpeg_size(frame)
+            return complete_mjpeg_frame(frame), width, height
+        height, width = frame.shape[:2]
+        # Конвертируем BGR (OpenCV) в RGB (PIL)
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        encoded = io.BytesIO()
+        Image.fromarray(frame_rgb).save(encoded, 'JPEG', quality=JPEG_QUALITY)
+        return encoded.getbuffer(), width, height
+        
+    @staticmethod
+    def write_atomic(filepath, write):
+        """Запись во временный файл и переименование - без недописанных JPEG"""
+        tmp_path = filepath + PARTIAL_SUFFIX
+        try:
+            with open(tmp_path, 'wb') as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+            
+    def stop(self, wait=True):
+        """Остановка потоков после записи всех заданий из очереди"""
+        for _ in self.threads:
+            self.jobs.put(None)
+        if wait:
+            for thread in self.threads:
+                thread.join(timeout=10)
+        self.threads = []
+        
+    @staticmethod
+    def cleanup_partial(folder):
+        """Удаление временных файлов, оставшихся после аварийного завершения"""
+        removed = 0
+        for path in (folder, os.path.join(folder, ORIGINALS_DIR_NAME)):
+            if not os.path.isdir(path):
+                continue
+            for name in os.listdir(path):
+                if name.endswith(PARTIAL_SUFFIX):
+                    os.remove(os.path.join(path, name))
+                    removed += 1
+        return removed
+
+
+class VideoRecorder:
+    """Запись видео сеанса в фоновом потоке.
+
+    Поток захвата только копирует кадр в свободный буфер и кладет его
+    в ограниченную очередь; при переполнении кадр пропускается и
+    учитывается в frames_dropped. Файлы делятся на сегменты по времени.
+    """
+    def __init__(self, folder, prefix, fps, segment_s=RECORD_SEGMENT_S, queue_size=RECORD_QUEUE_SIZE,
+                 on_error=None):
+        self.folder = folder
+        self.prefix = prefix
+        self.fps = fps
+        # Вызывается из потока записи один раз, при первой ошибке кодировщика
+        self.on_error = on_error
+        self.segment_s = segment_s
+        self.frames = queue.Queue(maxsize=queue_size)
+        # Буферы несжатых кадров используются повторно - без выделений памяти в потоке захвата
+        self.spare = queue.SimpleQueue()
+        self.running = False
+        self.thread = None
+        self.writer = None
+        self.segment_path = None
+        # Файл, в который пишет кодировщик (ASCII-имя во временной папке)
+        self.segment_temp = None
+        self.segment_start = 0.0
+        self.segment_frames = 0
+        self.segment_size = None
+        self.segments = []
+        self.started = 0.0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.frames_repeated = 0
+        self.error = None
+        
+    def start(self):
+        self.running = True
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.write_loop, name="video-recorder", daemon=True)
+        self.thread.start()
+        
+    def offer(self, frame, timestamp):
+        """Кадр от потока захвата; никогда не ждет - при заполненной очереди кадр пропускается"""
+        if not self.running:
+            return False
+        if self.frames.full():
+            self.frames_dropped += 1
+            return False
+        if not is_jpeg_buffer(frame):
+            # Слот кольцевого буфера скоро будет перезаписан - копируем
+            try:
+                buffer = self.spare.get_nowait()
+            except queue.Empty:
+                buffer = None
+            buffer = reuse_buffer(buffer, frame.shape, frame.dtype)
+            np.copyto(buffer, frame)
+            frame = buffer
+        try:
+            self.frames.put_nowait((frame, timestamp))
+            return True
+        except queue.Full:
+            self.frames_dropped += 1
+            return False
+            
+    def write_loop(self):
+        while True:
+            if not self.running and self.frames.empty():
+                # Остановка при полной очереди: метка None не поместилась, очередь уже дописана
+                break
+            item = self.frames.get()
+            if item is None:
+                break
+            frame, timestamp = item
+            # После ошибки кодировщика оставшиеся в очереди кадры только возвращаются в запас
+            if self.error is None:
+                try:
+                    start = time.perf_counter()
+                    self.write(frame, timestamp)
+                    pipeline_metrics.observe("record_write", time.perf_counter() - start)
+                except Exception as e:
+                    # Ошибка кодировщика: дальнейшие кадры не пишем, запись остановится
+                    print(f"[RECORD] Ошибка записи видео: {e}")
+                    self.error = e
+                    self.running = False
+                    if self.on_error:
+                        self.on_error(e)
+            if not is_jpeg_buffer(frame):
+                self.spare.put(frame)
+        self.close_segment()
+        
+    def write(self, frame, timestamp):
+        image = cv2.imdecode(frame, cv2.IMREAD_COLOR) if is_jpeg_buffer(frame) else frame
+        size = (image.shape[1], image.shape[0])
+        if (self.writer is None or size != self.segment_size
+                or timestamp - self.segment_start >= self.segment_s):
+            self.open_segment(size, timestamp)
+        # Частота файла постоянна: пропущенные кадры заменяются повтором,
+        # чтобы длительность видео совпадала с реальной
+        due = int((timestamp - self.segment_start) * self.fps) + 1
+        repeats = max(1, due - self.segment_frames)
+        for _ in range(repeats):
+            self.writer.write(image)
+        self.segment_frames += repeats
+        self.frames_repeated += repeats - 1
+        self.frames_written += 1
+        
+    def open_segment(self, size, timestamp):
+        """Закрытие текущего сегмента и начало нового файла"""
+        self.close_segment()
+        stamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        path = os.path.join(self.folder, f"{self.prefix}_{stamp}{RECORD_EXTENSION}")
+        n = 2
+        while os.path.exists(path):
+            path = os.path.join(self.folder, f"{self.prefix}_{stamp}_{n}{RECORD_EXTENSION}")
+            n += 1
+        # cv2.VideoWriter не открывает пути с кириллицей в Windows (папка названа по фамилии):
+        # сегмент пишется под ASCII-именем и переносится в папку пациента при закрытии
+        temp = os.path.join(tempfile.gettempdir(),
+                            f"camera_record_{os.getpid()}_{id(self):x}_{len(self.segments)}{RECORD_EXTENSION}")
+        writer = cv2.VideoWriter(temp, cv2.VideoWriter_fourcc(*RECORD_FOURCC), self.fps, size)
+        if not writer.isOpened():
+            raise RuntimeError(f"Не удалось открыть файл видео {temp}")
+        self.writer = writer
+        self.segment_temp = temp
+        self.segment_path = path
+        self.segment_size = size
+        self.segment_start = timestamp
+        self.segment_frames = 0
+        print(f"[RECORD] Новый сегмент: {path}")
+        
+    def close_segment(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+            self.segments.append(self.segment_path)
+            try:
+                # Временная папка может быть на другом диске - тогда копирование
+                shutil.move(self.segment_temp, self.segment_path)
+            except OSError as e:
+                print(f"[RECORD] Не удалось перенести сегмент {self.segment_temp} -> {self.segment_path}: {e}")
+                
+    def stop(self, wait=True):
+        """Остановка: кадры из очереди дописываются, сегмент закрывается (без ожидания места в очереди)"""
+        self.running = False
+        if self.thread:
+            try:
+                self.frames.put_nowait(None)
+            except queue.Full:
+                # Очередь полна - поток записи закончит сам, когда ее опустошит
+                pass
+            if wait:
+                self.thread.join(timeout=10)
+                
+    def stats_text(self):
+        duration = int(time.monotonic() - self.started)
+        return (f"Запись {duration // 60:02d}:{duration % 60:02d}, сегментов {len(self.segments) + 1}, "
+                f"кадров {self.frames_written}, пропущено {self.frames_dropped}")
+
+
+class PreviewRenderer:
+    """Отрисовка кадров в Label без лишних выделений памяти.
+
+    Буферы уменьшенного и RGB-кадра и PhotoImage создаются один раз
+    и пересоздаются только при изменении размера виджета.
+    """
+    def __init__(self, label, max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT):
+        self.label = label
+        self.max_width = max_width
+        self.max_height = max_height
+        self.photo = None
+        self.resized = None
+        self.rgb = None
+        self.render_time = 0.0  # скользящее среднее, с
+        
+    def target_size(self, w, h):
+        """Размер кадра, вписанного в виджет (с сохранением пропорций)"""
+        area_w, area_h = (self.label.winfo_width(), self.label.winfo_height()) if self.label else (0, 0)
+        # До первой отрисовки виджет имеет размер 1x1
+        area_w = min(area_w - 4, self.max_width) if area_w > 1 else self.max_width
+        area_h = min(area_h - 4, self.max_height) if area_h > 1 else self.max_height
+        scale = min(area_w / w, area_h / h)
+        return max(1, int(w * scale)), max(1, int(h * scale))
+        
+    def render(self, frame):
+        """Отрисовка кадра BGR (или сжатого MJPEG)"""
+        start = time.perf_counter()
+        rgb = self.prepare(frame)
+        new_h, new_w = rgb.shape[:2]
+        
+        photo_start = time.perf_counter()
+        image = Image.frombuffer("RGB", (new_w, new_h), rgb, "raw", "RGB", 0, 1)
+        if self.photo is None or (self.photo.width(), self.photo.height()) != (new_w, new_h):
+            self.photo = ImageTk.PhotoImage(image)
+            self.label.configure(image=self.photo, text="")
+            self.label.image = self.photo
+        else:
+            self.photo.paste(image)
+        end = time.perf_counter()
+        pipeline_metrics.observe("photoimage", end - photo_start)
+            
+        return self.record_time(end - start)
+        
+    def record_time(self, elapsed):
+        """Учет времени отрисовки в скользящем среднем"""
+        self.render_time = elapsed if not self.render_time else 0.8 * self.render_time + 0.2 * elapsed
+        return elapsed
+        
+    def prepare(self, frame):
+        """Декодирование, уменьшение и перевод в RGB во внутренние буферы (без Tk)"""
+        start = time.perf_counter()
+        if is_jpeg_buffer(frame):
+            # Режим MJPEG: декодируем сразу уменьшенную копию
+            w, h = jpeg_size(frame)
+            frame = decode_reduced(frame, *self.target_size(w, h))
+            now = time.perf_counter()
+            pipeline_metrics.observe("decode", now - start)
+            start = now
+        h, w = frame.shape[:2]
+        new_w, new_h = self.target_size(w, h)
+        
+        if (new_w, new_h) != (w, h):
+            self.resized = reuse_buffer(self.resized, (new_h, new_w, 3))
+            interpolation = cv2.INTER_AREA if new_w < w else cv2.INTER_LINEAR
+            cv2.resize(frame, (new_w, new_h), dst=self.resized, interpolation=interpolation)
+            frame = self.resized
+            now = time.perf_counter()
+            pipeline_metrics.observe("resize", now - start)
+            start = now
+        self.rgb = reuse_buffer(self.rgb, (new_h, new_w, 3))
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+        pipeline_metrics.observe("convert", time.perf_counter() - start)
+        return self.rgb
+        
+    def next_interval_ms(self, frame_interval):
+        """Интервал до следующей отрисовки по измеренному времени отрисовки.
+
+        Если отрисовка не успевает, интервал растет и часть кадров пропускается
+        (в буфере всегда берется последний).
+        """
+        interval = max(self.render_time / PREVIEW_LOAD_FACTOR, frame_interval / 2)
+        return int(min(max(interval * 1000, PREVIEW_MIN_INTERVAL_MS), PREVIEW_MAX_INTERVAL_MS))
+        
+    def reset(self):
+        """Сброс замеров (например, при повторном включении камеры)"""
+        self.render_time = 0.0
+
+
+class StabilityDetector:
+    """Дешевая оценка движения и резкости кадра превью для автоснимка.
+
+    Кадр уменьшается до миниатюры в серых тонах (буферы переиспользуются):
+    движение - средняя разность с предыдущей миниатюрой, резкость -
+    дисперсия лапласиана. Время анализа - доли миллисекунды.
+    """
+    def __init__(self, hold_ms=AUTO_CAPTURE_HOLD_MS, thumb_size=AUTO_CAPTURE_THUMB_SIZE):
+        self.hold = hold_ms / 1000
+        self.thumb_size = thumb_size
+        self.thumb = None
+        self.gray = None
+        self.previous = None
+        self.laplacian = None
+        self.reset()
+        
+    def reset(self, moved=True):
+        """Сброс состояния (включение режима, новая камера; после автоснимка - moved=False)"""
+        self.has_previous = False
+        self.stable_since = None
+        self.peak_focus = 0.0
+        self.motion = 0.0
+        self.focus = 0.0
+        # До первого снимка движение не требуется
+        self.moved = moved
+        
+    def measure(self, frame_rgb):
+        """Движение относительно предыдущего кадра и резкость: (motion, focus)"""
+        w, h = self.thumb_size
+        self.thumb = reuse_buffer(self.thumb, (h, w, 3))
+        self.gray = reuse_buffer(self.gray, (h, w))
+        self.laplacian = reuse_buffer(self.laplacian, (h, w), np.int16)
+        # INTER_LINEAR: превью уже сглажено при уменьшении, а INTER_AREA
+        # с дробным коэффициентом в разы медленнее
+        cv2.resize(frame_rgb, (w, h), dst=self.thumb, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(self.thumb, cv2.COLOR_RGB2GRAY, dst=self.gray)
+        
+        motion = cv2.norm(self.gray, self.previous, cv2.NORM_L1) / self.gray.size if self.has_previous else 0.0
+        cv2.Laplacian(self.gray, cv2.CV_16S, dst=self.laplacian)
+        _, stddev = cv2.meanStdDev(self.laplacian)
+        focus = float(stddev[0, 0]) ** 2
+        
+        self.previous, self.gray = self.gray, self.previous
+        self.has_previous = True
+        return motion, focus
+        
+    def update(self, frame_rgb, now):
+        """Анализ кадра превью; True - изображение стабильно и резко, пора снимать"""
+        start = time.perf_counter()
+        self.motion, self.focus = self.measure(frame_rgb)
+        pipeline_metrics.observe("stability", time.perf_counter() - start)
+        
+        self.peak_focus = max(self.focus, self.peak_focus * AUTO_CAPTURE_FOCUS_DECAY)
+        if self.motion >= AUTO_CAPTURE_REARM_MOTION:
+            self.moved = True
+        sharp = self.focus >= max(AUTO_CAPTURE_FOCUS_MIN, AUTO_CAPTURE_FOCUS_RATIO * self.peak_focus)
+        if self.motion > AUTO_CAPTURE_MOTION_MAX or not sharp:
+            self.stable_since = None
+            return False
+        if self.stable_since is None:
+            self.stable_since = now
+        if self.moved and now - self.stable_since >= self.hold:
+            self.moved = False
+            self.stable_since = None
+            return True
+        return False
+
+
+def reuse_buffer(buffer, shape, dtype=np.uint8):
+    """Повторное использование буфера, если он подходит по размеру"""
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        return np.empty(shape, dtype)
+    return buffer
+
+
+def parse_photo_name(filename):
+    """Фамилия и время снимка из имени файла (None, если имя другого формата)"""
+    match = PHOTO_NAME_RE.match(filename)
+    if not match:
+        return None, None
+    try:
+        taken_at = datetime.strptime(f"{match['date']} {match['time']}", "%Y-%m-%d %H-%M-%S")
+    except ValueError:
+        return match["surname"], None
+    return match["surname"], taken_at
+
+
+def dhash(frame):
+    """Разностный перцептивный хеш dHash: 64 бита как знаковое целое (тип INTEGER SQLite).
+
+    Кадр (BGR, серый или сжатый JPEG) уменьшается до 9x8, каждый бит -
+    ярче ли пиксель соседа справа. Пережатие, шум и мелкие сдвиги хеш почти не меняют.
+    """
+    if is_jpeg_buffer(frame):
+        frame = decode_reduced(frame, 72, 64, grayscale=True)
+    if frame.shape[1] > 288:
+        # INTER_AREA с большого кадра сразу до 9x8 медленный (~10 мс на 1080p);
+        # сначала быстрое уменьшение, усреднение - на втором шаге
+        frame = cv2.resize(frame, (288, 256), interpolation=cv2.INTER_LINEAR)
+    small = cv2.resize(frame, (9, 8), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = small[:, 1:] > small[:, :-1]
+    return int(np.packbits(bits).view(">i8")[0])
+
+
+def hamming(a, b):
+    """Число различающихся бит двух 64-битных хешей"""
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+# Число единичных бит в каждом байте (для подсчета расстояний массивом)
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def group_hashes(hashes, radius=DUPLICATE_MAX_DISTANCE, block=512):
+    """Группы индексов хешей, связанных цепочками расстояний не больше radius.
+
+    Хеш делится на radius + 1 частей: у хешей с расстоянием <= radius хотя бы
+    одна часть совпадает (принцип Дирихле). Попарно сравниваются только хеши
+    с общей частью - массивами numpy, без перебора всех пар.
+    """
+    # Одинаковые хеши (повторные кадры, однотонные снимки) сравниваются один раз
+    values, inverse = np.unique(np.asarray(hashes, dtype=np.int64).view(np.uint64), return_inverse=True)
+    parent = list(range(len(values)))
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+        
+    bounds = np.linspace(0, 64, radius + 2).astype(int)
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        keys = (values >> np.uint64(low)) & np.uint64((1 << int(high - low)) - 1)
+        order = np.argsort(keys, kind="stable")
+        splits = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order, splits):
+            if len(bucket) < 2:
+                continue
+            bucket_values = values[bucket]
+            # Крупные корзины (например, однотонные кадры) - по блокам строк, без матрицы N x N
+            for start in range(0, len(bucket), block):
+                rows = bucket_values[start:start + block]
+                xor = rows[:, None] ^ bucket_values[None, :]
+                distances = POPCOUNT_TABLE[xor.view(np.uint8)].reshape(xor.shape + (8,)).sum(axis=2)
+                # Каждая пара - один раз (j > i)
+                upper = np.arange(len(bucket)) > np.arange(start, start + len(rows))[:, None]
+                matches = (distances <= radius) & upper
+                for i, j in zip(*np.nonzero(matches)):
+                    a, b = find(int(bucket[start + i])), find(int(bucket[j]))
+                    if a != b:
+                        parent[a] = b
+                        
+    groups = {}
+    for index, unique_index in enumerate(inverse):
+        groups.setdefault(find(int(unique_index)), []).append(index)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+class BKTree:
+    """Дерево Буркхарда-Келлера по расстоянию Хэмминга: поиск похожих хешей без полного перебора"""
+    def __init__(self):
+        self.root = None  # [хеш, элементы, {расстояние: потомок}]
+        self.size = 0
+        self.items = set()
+        
+    def add(self, value, item):
+        """Добавление элемента; уже добавленный элемент повторно не вставляется"""
+        if item in self.items:
+            return
+        self.items.add(item)
+        self.size += 1
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+            
+    def search(self, value, radius):
+        """Элементы с хешем не дальше radius: список (расстояние, элемент), ближние первыми"""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            # По неравенству треугольника искомое может быть только в этих ветвях
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda entry: entry[0])
+        return found
+
+
+class LibraryImage:
+    """Запись индекса снимков"""
+    def __init__(self, path, patient, taken_at, size, mtime, width, height, sharpness, dhash=None):
+        self.path = path  # относительно папки снимков
+        self.patient = patient
+        self.taken_at = taken_at
+        self.size = size
+        self.mtime = mtime
+        self.width = width
+        self.height = height
+        self.sharpness = sharpness
+        self.dhash = dhash
+        
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+
+class ImageLibrary:
+    """Индекс снимков в SQLite: пациент, время, размер, разрешение, резкость.
+
+    Полное сканирование сравнивает размер и время изменения файлов с индексом
+    и читает только новые и измененные файлы (параллельно). Для поиска почти
+    одинаковых снимков у каждого снимка хранится dHash, а для пациентов
+    держатся BK-деревья хешей (в потоке индекса).
+    """
+    # Повторная запись строки не стирает известные значения: для того же файла
+    # (размер и время изменения не менялись) пустые поля берутся из индекса -
+    # так перечитывание ради хеша сохраняет резкость, записанную при съемке
+    UPSERT = """
+        INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (path) DO UPDATE SET
+            patient = excluded.patient,
+            taken_at = excluded.taken_at,
+            size = excluded.size,
+            mtime = excluded.mtime,
+            width = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+                         THEN COALESCE(excluded.width, width) ELSE excluded.width END,
+            height = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+                          THEN COALESCE(excluded.height, height) ELSE excluded.height END,
+            sharpness = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+                             THEN COALESCE(excluded.sharpness, sharpness) ELSE excluded.sharpness END,
+            dhash = CASE WHEN size = excluded.size AND mtime = excluded.mtime
+                         THEN COALESCE(excluded.dhash, dhash) ELSE excluded.dhash END
+    """
+    
+    def __init__(self, images_dir, db_path=None):
+        self.images_dir = images_dir
+        self.db_path = db_path or os.path.join(images_dir, LIBRARY_DB_NAME)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                patient TEXT NOT NULL,
+                taken_at TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                sharpness REAL,
+                dhash INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS images_patient ON images (patient, taken_at);
+        """)
+        # Индекс прежней версии - без столбца хеша; хеши заполнит сканирование
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(images)")]
+        if "dhash" not in columns:
+            self.db.execute("ALTER TABLE images ADD COLUMN dhash INTEGER")
+        self.db.commit()
+        self.trees = {}  # пациент -> BKTree (путь снимка по хешу)
+        # Запись в индекс идет в одном фоновом потоке
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="library")
+        
+    def relative(self, path):
+        return os.path.relpath(path, self.images_dir).replace(os.sep, "/")
+        
+    def absolute(self, path):
+        return os.path.join(self.images_dir, *path.split("/"))
+        
+    def rescan(self):
+        """Инкрементальное сканирование папки снимков; возвращает (добавлено, удалено)"""
+        start = time.perf_counter()
+        with self.lock:
+            # Снимки без хеша перечитываются, как измененные
+            known = {path: (size, mtime) if hashed else None for path, size, mtime, hashed in
+                     self.db.execute("SELECT path, size, mtime, dhash IS NOT NULL FROM images")}
+            
+        found, changed = set(), []
+        for patient_entry in os.scandir(self.images_dir):
+            if not patient_entry.is_dir() or patient_entry.name.startswith("."):
+                continue
+            for entry in os.scandir(patient_entry.path):
+                if not entry.is_file() or not entry.name.lower().endswith((".jpg", ".jpeg")):
+                    continue
+                path = f"{patient_entry.name}/{entry.name}"
+                found.add(path)
+                stat = entry.stat()
+                if known.get(path) != (stat.st_size, stat.st_mtime):
+                    changed.append((path, patient_entry.name, stat))
+                    
+        # Новые файлы читаем параллельно (для хеша - декодирование в 1/8 размера)
+        with ThreadPoolExecutor(max_workers=LIBRARY_SCAN_WORKERS) as pool:
+            rows = list(pool.map(lambda item: self.make_row(*item), changed))
+        removed = [(path,) for path in known if path not in found]
+        
+        with self.lock:
+            self.db.executemany(self.UPSERT, rows)
+            self.db.executemany("DELETE FROM images WHERE path = ?", removed)
+            self.db.commit()
+        if rows or removed:
+            self.trees.clear()
+        print(f"[LIBRARY] Сканирование: {len(found)} файлов, обновлено {len(rows)}, удалено {len(removed)} "
+              f"за {time.perf_counter() - start:.2f} с")
+        return len(rows), len(removed)
+        
+    def make_row(self, path, patient, stat):
+        width = height = hash_value = None
+        try:
+            with Image.open(self.absolute(path)) as image:
+                width, height = image.size
+                # Для хеша хватает декодирования JPEG в уменьшенном масштабе
+                image.draft("L", (72, 64))
+                hash_value = dhash(np.asarray(image.convert("L")))
+        except Exception as e:
+            print(f"[LIBRARY] Не удалось прочитать {path}: {e}")
+        _, taken_at = parse_photo_name(os.path.basename(path))
+        taken_at = taken_at or datetime.fromtimestamp(stat.st_mtime)
+        return (path, patient, taken_at.isoformat(" "), stat.st_size, stat.st_mtime, width, height, None,
+                hash_value)
+        
+    def rescan_async(self, callback=None):
+        """Сканирование в фоне; callback(добавлено, удалено)"""
+        future = self.executor.submit(self.rescan)
+        if callback:
+            future.add_done_callback(lambda f: callback(*f.result()) if not f.exception() else
+                                     print(f"[LIBRARY] Ошибка сканирования: {f.exception()}"))
+        return future
+        
+    def add(self, filepath, width=None, height=None, sharpness=None, dhash=None):
+        """Добавление только что сохраненного снимка; возвращает похожие: [(расстояние, путь)]"""
+        stat = os.stat(filepath)
+        path = self.relative(filepath)
+        patient = path.split("/")[0]
+        _, taken_at = parse_photo_name(os.path.basename(path))
+        taken_at = taken_at or datetime.fromtimestamp(stat.st_mtime)
+        similar = []
+        if dhash is not None:
+            # Снимок мог уже попасть в индекс при сканировании - тогда он есть и в дереве
+            tree = self.tree(patient)
+            similar = [(distance, other) for distance, other in tree.search(dhash, DUPLICATE_MAX_DISTANCE)
+                       if other != path]
+            tree.add(dhash, path)
+        with self.lock:
+            self.db.execute(self.UPSERT,
+                            (path, patient, taken_at.isoformat(" "), stat.st_size, stat.st_mtime,
+                             width, height, sharpness, dhash))
+            self.db.commit()
+        return similar
+        
+    def add_async(self, filepath, width=None, height=None, sharpness=None, dhash=None):
+        return self.executor.submit(self.add, filepath, width, height, sharpness, dhash)
+        
+    def tree(self, patient):
+        """BK-дерево хешей снимков пациента (строится из индекса при первом обращении)"""
+        tree = self.trees.get(patient)
+        if tree is None:
+            tree = BKTree()
+            with self.lock:
+                rows = self.db.execute("SELECT path, dhash FROM images WHERE patient = ? AND dhash IS NOT NULL",
+                                       (patient,)).fetchall()
+            for path, value in rows:
+                tree.add(value, path)
+            self.trees[patient] = tree
+        return tree
+        
+    def duplicate_groups(self, patient=None, radius=DUPLICATE_MAX_DISTANCE):
+        """Группы почти одинаковых снимков (внутри пациента), по времени съемки"""
+        groups = []
+        for name in ([patient] if patient is not None else self.patients()):
+            images = [image for image in self.images(name) if image.dhash is not None]
+            for members in group_hashes([image.dhash for image in images], radius):
+                groups.append(sorted((images[i] for i in members), key=lambda image: image.taken_at))
+        groups.sort(key=lambda group: (group[0].patient, group[0].taken_at))
+        return groups
+        
+    def duplicate_groups_async(self, patient=None, callback=None):
+        """Поиск групп в потоке индекса; callback(группы)"""
+        future = self.executor.submit(self.duplicate_groups, patient)
+        if callback:
+            future.add_done_callback(lambda f: callback(f.result()) if not f.exception() else
+                                     print(f"[LIBRARY] Ошибка поиска дубликатов: {f.exception()}"))
+        return future
+        
+    def set_sharpness(self, path, sharpness):
+        with self.lock:
+            self.db.execute("UPDATE images SET sharpness = ? WHERE path = ?", (sharpness, path))
+            self.db.commit()
+            
+    def patients(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT DISTINCT patient FROM images ORDER BY patient")]
+            
+    def images(self, patient=None):
+        """Снимки пациента (или все), новые первыми"""
+        query = "SELECT * FROM images"
+        params = ()
+        if patient is not None:
+            query += " WHERE patient = ?"
+            params = (patient,)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY taken_at DESC, path DESC", params).fetchall()
+        return [LibraryImage(*row) for row in rows]
+        
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.db.close()
+
+
+class SessionExporter:
+    """Экспорт снимков пациента за период в один ZIP без временных копий файлов.
+
+    Файлы читаются, хешируются (SHA-256) и уменьшаются для просмотра
+    параллельно, но в работе одновременно не больше in_flight файлов - память
+    не зависит от размера сеанса. JPEG уже сжаты, поэтому архив без сжатия.
+    """
+    def __init__(self, images_dir, library=None, review=False, workers=EXPORT_WORKERS,
+                 in_flight=EXPORT_IN_FLIGHT, progress=None):
+        self.images_dir = images_dir
+        self.library = library
+        self.review = review
+        self.workers = workers
+        self.in_flight = in_flight
+        # progress(готово, всего) - из потока экспорта
+        self.progress = progress
+        
+    def select(self, patient, date_from=None, date_to=None):
+        """Снимки пациента за период (даты включительно, по имени файла): [(время, имя)]"""
+        selected = []
+        for entry in os.scandir(os.path.join(self.images_dir, patient)):
+            if not entry.is_file():
+                continue
+            _, taken_at = parse_photo_name(entry.name)
+            if taken_at is None:
+                continue
+            if (date_from and taken_at.date() < date_from) or (date_to and taken_at.date() > date_to):
+                continue
+            selected.append((taken_at, entry.name))
+        selected.sort()
+        return selected
+        
+    def export(self, patient, archive_path, date_from=None, date_to=None):
+        """Запись архива (атомарно); возвращает сводку экспорта"""
+        start = time.perf_counter()
+        items = self.select(patient, date_from, date_to)
+        metadata = {image.filename: image for image in self.library.images(patient)} if self.library else {}
+        folder = os.path.join(self.images_dir, patient)
+        entries = []
+        total_bytes = 0
+        
+        tmp_path = archive_path + PARTIAL_SUFFIX
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as archive, \
+                    ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export") as pool:
+                pending = deque()
+                for taken_at, name in items:
+                    pending.append(pool.submit(self.prepare, folder, name, taken_at))
+                    # Записываем по порядку, как только в работе слишком много файлов
+                    if len(pending) >= self.in_flight:
+                        total_bytes += self.write_entry(archive, patient, pending.popleft().result(),
+                                                        metadata, entries, len(items))
+                while pending:
+                    total_bytes += self.write_entry(archive, patient, pending.popleft().result(),
+                                                    metadata, entries, len(items))
+                    
+                manifest = {
+                    "patient": patient,
+                    "exported_at": datetime.now().isoformat(" ", "seconds"),
+                    "date_from": date_from.isoformat() if date_from else None,
+                    "date_to": date_to.isoformat() if date_to else None,
+                    "images": entries,
+                }
+                archive.writestr(EXPORT_MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+            os.replace(tmp_path, archive_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+            
+        elapsed = time.perf_counter() - start
+        print(f"[EXPORT] {archive_path}: {len(entries)} снимков, {total_bytes / 1024 / 1024:.1f} МБ "
+              f"за {elapsed:.2f} с")
+        return {"images": len(entries), "bytes": total_bytes, "elapsed": elapsed, "path": archive_path}
+        
+    def prepare(self, folder, name, taken_at):
+        """Чтение снимка, исходника (если есть) и уменьшенной копии (в потоке пула)"""
+        files = {"image": self.read(os.path.join(folder, name))}
+        original = os.path.join(folder, ORIGINALS_DIR_NAME, name)
+        if os.path.exists(original):
+            files["original"] = self.read(original)
+        if self.review:
+            files["review"] = self.make_review(files["image"][0])
+        return name, taken_at, files
+        
+    @staticmethod
+    def read(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        return data, hashlib.sha256(data).hexdigest()
+        
+    @staticmethod
+    def make_review(data):
+        """Уменьшенная копия для просмотра: JPEG декодируется сразу в уменьшенном масштабе"""
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("RGB", (EXPORT_REVIEW_SIZE, EXPORT_REVIEW_SIZE))
+            image = image.convert("RGB")
+            # BICUBIC заметно быстрее LANCZOS, для копии просмотра разницы не видно
+            image.thumbnail((EXPORT_REVIEW_SIZE, EXPORT_REVIEW_SIZE), Image.BICUBIC)
+            encoded = io.BytesIO()
+            image.save(encoded, "JPEG", quality=EXPORT_REVIEW_QUALITY)
+        review = encoded.getvalue()
+        return review, hashlib.sha256(review).hexdigest()
+        
+    def write_entry(self, archive, patient, prepared, metadata, entries, total):
+        """Запись файлов снимка в архив и строки манифеста; возвращает число байт"""
+        name, taken_at, files = prepared
+        folders = {"image": "", "original": ORIGINALS_DIR_NAME + "/", "review": "review/"}
+        entry = {"file": f"{patient}/{name}", "taken_at": taken_at.isoformat(" ")}
+        written = 0
+        for kind, (data, digest) in files.items():
+            arcname = f"{patient}/{folders[kind]}{name}"
+            info = zipfile.ZipInfo(arcname, date_time=taken_at.timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            archive.writestr(info, data)
+            written += len(data)
+            if kind == "image":
+                entry.update(size=len(data), sha256=digest)
+            else:
+                entry[kind] = {"file": arcname, "size": len(data), "sha256": digest}
+                
+        image = metadata.get(name)
+        if image:
+            entry.update(width=image.width, height=image.height, sharpness=image.sharpness,
+                         dhash=f"{image.dhash & 0xFFFFFFFFFFFFFFFF:016x}" if image.dhash is not None else None)
+        entries.append(entry)
+        if self.progress:
+            self.progress(len(entries), total)
+        return written
+
+
+class ThumbnailCache:
+    """Кэш миниатюр на диске с вытеснением давно не использованных по общему размеру"""
+    def __init__(self, cache_dir, max_bytes=THUMBNAIL_CACHE_MAX_MB * 1024 * 1024, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size = size
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+        
+    def key_path(self, path, mtime):
+        key = hashlib.sha1(f"{path}|{mtime}|{self.size}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key + ".jpg")
+        
+    def get(self, source_path, mtime):
+        """Путь к миниатюре и резкость (None, если миниатюра уже была в кэше)"""
+        thumb_path = self.key_path(source_path, mtime)
+        if os.path.exists(thumb_path):
+            # Время изменения служит отметкой последнего использования
+            os.utime(thumb_path)
+            return thumb_path, None
+            
+        with Image.open(source_path) as image:
+            # Декодирование JPEG сразу в уменьшенном масштабе (1/2..1/8)
+            image.draft("RGB", (FOCUS_SCORE_WIDTH, FOCUS_SCORE_WIDTH))
+            image = image.convert("RGB")
+            sharpness = focus_score(cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR))
+            image.thumbnail((self.size, self.size), Image.LANCZOS)
+            PhotoWriter.write_atomic(thumb_path, lambda f: image.save(f, "JPEG", quality=80))
+            
+        with self.lock:
+            self.total_bytes += os.path.getsize(thumb_path)
+            over_limit = self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+        return thumb_path, sharpness
+        
+    def evict(self):
+        """Удаление давно не использованных миниатюр до 90% лимита"""
+        with self.lock:
+            entries = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                             for entry in os.scandir(self.cache_dir) if entry.is_file())
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self.total_bytes = total
+
+
+class GalleryWindow:
+    """Галерея снимков пациента с виртуальной прокруткой.
+
+    На холсте рисуются только видимые ячейки; миниатюры для них готовятся
+    в фоновых потоках, изображения ушедших из вида ячеек освобождаются.
+    """
+    CELL_PADDING = 8
+    LABEL_HEIGHT = 18
+    
+    def __init__(self, controller, patient):
+        self.controller = controller
+        self.library = controller.image_library
+        self.thumbnails = controller.get_thumbnail_cache()
+        self.items = []
+        self.groups = {}  # путь -> номер группы дубликатов (в режиме дубликатов)
+        self.photos = {}  # индекс -> PhotoImage видимых ячеек
+        self.requested = set()
+        self.pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbnails")
+        self.generation = 0
+        
+        self.window = tk.Toplevel(controller.root)
+        self.window.title("Галерея снимков")
+        self.window.geometry("900x600")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+        
+        top = ttk.Frame(self.window)
+        top.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Label(top, text="Пациент:").pack(side=tk.LEFT)
+        self.patient_var = tk.StringVar(value=patient)
+        self.patient_box = ttk.Combobox(top, textvariable=self.patient_var, state="readonly",
+                                        values=self.library.patients() or [patient])
+        self.patient_box.pack(side=tk.LEFT, padx=5)
+        self.patient_box.bind("<<ComboboxSelected>>", lambda e: self.load())
+        ttk.Button(top, text="Обновить", command=self.rescan).pack(side=tk.LEFT, padx=5)
+        ttk.Button(top, text="Дубликаты", command=self.find_duplicates).pack(side=tk.LEFT, padx=5)
+        self.info_label = ttk.Label(top, text="", foreground="gray")
+        self.info_label.pack(side=tk.LEFT, padx=10)
+        
+        body = ttk.Frame(self.window)
+        body.pack(fill=tk.BOTH, expand=True)
+        self.canvas = tk.Canvas(body, background="white", highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self.on_scrollbar)
+        self.canvas.configure(yscrollcommand=self.on_canvas_scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.bind("<Configure>", lambda e: self.layout())
+        self.canvas.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.canvas.bind("<Button-4>", lambda e: self.scroll(-1))
+        self.canvas.bind("<Button-5>", lambda e: self.scroll(1))
+        self.canvas.bind("<Button-1>", self.on_click)
+        
+        self.load()
+        
+    @property
+    def cell(self):
+        return self.thumbnails.size + 2 * self.CELL_PADDING
+        
+    def load(self):
+        """Загрузка списка снимков выбранного пациента из индекса"""
+        self.show(self.library.images(self.patient_var.get()))
+        self.info_label.config(text=f"Снимков: {len(self.items)}")
+        
+    def show(self, items, groups=None):
+        self.items = items
+        self.groups = groups or {}
+        self.canvas.yview_moveto(0)
+        self.layout()
+        
+    def find_duplicates(self):
+        """Показ только групп почти одинаковых снимков пациента"""
+        self.info_label.config(text="Поиск дубликатов...")
+        self.library.duplicate_groups_async(self.patient_var.get(),
+                                            lambda groups: self.controller.post_to_gui(self.on_duplicates, groups))
+        
+    def on_duplicates(self, groups):
+        if not self.window.winfo_exists():
+            return
+        self.show([image for group in groups for image in group],
+                  {image.path: number for number, group in enumerate(groups, 1) for image in group})
+        extra = sum(len(group) - 1 for group in groups)
+        self.info_label.config(text=f"Групп дубликатов: {len(groups)}, лишних снимков: {extra}")
+        
+    def rescan(self):
+        self.info_label.config(text="Сканирование...")
+        self.library.rescan_async(lambda added, removed: self.controller.post_to_gui(self.after_rescan))
+        
+    def after_rescan(self):
+        if self.window.winfo_exists():
+            self.patient_box.config(values=self.library.patients())
+            self.load()
+            
+    def columns(self):
+        return max(1, self.canvas.winfo_width() // self.cell)
+        
+    def layout(self):
+        """Пересчет области прокрутки и перерисовка видимых ячеек"""
+        rows = (len(self.items) + self.columns() - 1) // self.columns()
+        self.canvas.configure(scrollregion=(0, 0, self.columns() * self.cell,
+                                            rows * (self.cell + self.LABEL_HEIGHT)))
+        self.generation += 1
+        self.photos.clear()
+        self.requested.clear()
+        self.redraw()
+        
+    def visible_range(self):
+        row_height = self.cell + self.LABEL_HEIGHT
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // row_height))
+        last_row = int((top + self.canvas.winfo_height()) // row_height) + 1
+        columns = self.columns()
+        return first_row * columns, min(len(self.items), (last_row + 1) * columns)
+        
+    def redraw(self):
+        """Отрисовка только видимых ячеек"""
+        self.canvas.delete("cell")
+        first, last = self.visible_range()
+        # Освобождаем изображения ячеек, ушедших из вида
+        for index in [index for index in self.photos if not first <= index < last]:
+            del self.photos[index]
+        self.requested &= set(range(first, last))
+        
+        columns = self.columns()
+        row_height = self.cell + self.LABEL_HEIGHT
+        for index in range(first, last):
+            item = self.items[index]
+            x = (index % columns) * self.cell + self.CELL_PADDING
+            y = (index // columns) * row_height + self.CELL_PADDING
+            photo = self.photos.get(index)
+            if photo is not None:
+                self.canvas.create_image(x, y, image=photo, anchor=tk.NW, tags=("cell",))
+            else:
+                self.canvas.create_rectangle(x, y, x + self.thumbnails.size, y + self.thumbnails.size,
+                                             fill="lightgray", outline="", tags=("cell",))
+                self.request_thumbnail(index, item)
+            group = self.groups.get(item.path)
+            self.canvas.create_text(x, y + self.thumbnails.size + 2, anchor=tk.NW, tags=("cell",),
+                                    text=(f"#{group} " if group else "") + item.taken_at[5:16],
+                                    fill="red" if group else "black", font=("Arial", 8))
+                                    
+    def request_thumbnail(self, index, item):
+        if index in self.requested:
+            return
+        self.requested.add(index)
+        generation = self.generation
+        
+        def work():
+            try:
+                path, sharpness = self.thumbnails.get(self.library.absolute(item.path), item.mtime)
+                if sharpness is not None and item.sharpness is None:
+                    item.sharpness = sharpness
+                    self.library.executor.submit(self.library.set_sharpness, item.path, sharpness)
+                image = Image.open(path)
+                image.load()
+                self.controller.post_to_gui(self.on_thumbnail, generation, index, image)
+            except Exception as e:
+                print(f"[GALLERY] Ошибка миниатюры {item.path}: {e}")
+                
+        self.pool.submit(work)
+        
+    def on_thumbnail(self, generation, index, image):
+        if generation != self.generation or not self.window.winfo_exists():
+            return
+        first, last = self.visible_range()
+        if first <= index < last:
+            self.photos[index] = ImageTk.PhotoImage(image)
+            self.redraw()
+        else:
+            self.requested.discard(index)
+            
+    def on_scrollbar(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+        
+    def on_canvas_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        
+    def scroll(self, units):
+        self.canvas.yview_scroll(units, "units")
+        self.redraw()
+        
+    def on_click(self, event):
+        """Выбор снимка: показ в превью последнего снимка"""
+        columns = self.columns()
+        column = int(self.canvas.canvasx(event.x) // self.cell)
+        row = int(self.canvas.canvasy(event.y) // (self.cell + self.LABEL_HEIGHT))
+        index = row * columns + column
+        if column >= columns or index >= len(self.items):
+            return
+        item = self.items[index]
+        # cv2.imread не открывает пути с кириллицей в Windows (папки названы по фамилии) -
+        # файл читается средствами Python, декодируется сразу в уменьшенном виде
+        try:
+            data = np.fromfile(self.library.absolute(item.path), np.uint8)
+            frame = decode_reduced(data, PHOTO_PREVIEW_SIZE, PHOTO_PREVIEW_SIZE) if data.size else None
+        except OSError:
+            frame = None
+        if frame is not None:
+            self.controller.update_photo_preview(frame)
+        sharpness = f"{item.sharpness:.1f}" if item.sharpness is not None else "-"
+        self.controller.update_debug(f"{item.filename}: {item.width}x{item.height}, "
+                                     f"{item.size // 1024} КБ, резкость {sharpness}")
+        
+    def close(self):
+        self.generation += 1
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.photos.clear()
+        self.window.destroy()
+        self.controller.gallery = None
+
+
+class HeadlessRoot:
+    """Замена корневого окна Tk без дисплея: root.after и mainloop работают на цикле asyncio.
+
+    Как и у Tk, все вызовы - из одного потока (потока цикла); из других
+    потоков контроллер передает работу через post_to_gui.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        
+    def after(self, ms, callback, *args):
+        return self.loop.call_later(ms / 1000, callback, *args)
+        
+    def after_cancel(self, handle):
+        handle.cancel()
+        
+    def title(self, text=None):
+        pass
+        
+    def install_signal_handlers(self, callback):
+        """Ctrl+C и SIGTERM - штатное завершение (callback), а не обрыв цикла"""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, callback)
+            except (NotImplementedError, RuntimeError):
+                # Windows: обработчики сигналов в цикле asyncio не поддерживаются
+                pass
+                
+    def mainloop(self):
+        self.loop.run_forever()
+        
+    def destroy(self):
+        self.loop.stop()
+
+
+class PreviewStreamer:
+    """Превью MJPEG для браузеров: один кодировщик на всех клиентов.
+
+    Пока подключен хотя бы один клиент, последний кадр из буфера захвата
+    уменьшается и сжимается в JPEG не чаще STREAM_FPS раз в секунду (в пуле
+    потоков цикла). Все клиенты получают одни и те же байты; медленный
+    клиент просто пропускает кадры.
+    """
+    def __init__(self, controller, fps=STREAM_FPS):
+        self.controller = controller
+        self.renderer = PreviewRenderer(None, STREAM_MAX_WIDTH, STREAM_MAX_HEIGHT)
+        self.interval = 1 / fps
+        self.clients = 0
+        self.jpeg = None
+        self.seq = 0
+        self.frame = None
+        self.frame_seq = 0
+        self.condition = asyncio.Condition()
+        self.task = None
+        
+    def subscribe(self):
+        self.clients += 1
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+            
+    def unsubscribe(self):
+        self.clients -= 1
+        
+    async def next_frame(self, seen, timeout=None):
+        """Ожидание кадра новее seen: (номер, JPEG); None - нового кадра не было за timeout"""
+        async with self.condition:
+            try:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self.seq != seen), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self.seq, self.jpeg
+            
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.clients > 0:
+                start = loop.time()
+                jpeg = await loop.run_in_executor(None, self.encode)
+                if jpeg is not None:
+                    async with self.condition:
+                        self.jpeg = jpeg
+                        self.seq += 1
+                        self.condition.notify_all()
+                await asyncio.sleep(max(0.0, self.interval - (loop.time() - start)))
+        finally:
+            self.task = None
+            
+    def encode(self):
+        """Сжатие последнего кадра камеры (None, если нового кадра нет)"""
+        engine = self.controller.capture_engine
+        if not self.controller.camera_active or not engine:
+            return None
+        seq, self.frame = engine.latest_frame(self.frame)
+        if self.frame is None or seq == self.frame_seq:
+            return None
+        self.frame_seq = seq
+        engine.mark_shown(seq)
+        start = time.perf_counter()
+        rgb = self.renderer.prepare(self.frame)
+        encoded = io.BytesIO()
+        Image.fromarray(rgb).save(encoded, "JPEG", quality=STREAM_JPEG_QUALITY)
+        pipeline_metrics.observe("stream_encode", time.perf_counter() - start)
+        return encoded.getvalue()
+
+
+CONTROL_PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Medical Camera Controller</title></head>
+<body style="font-family: sans-serif">
+<img src="/preview.mjpg" style="max-width: 100%; background: black"><br>
+<input id="surname" placeholder="Фамилия пациента"> <button onclick="send('patient')">Выбрать пациента</button>
+<button onclick="send('camera/start')">Включить камеру</button>
+<button onclick="send('camera/stop')">Выключить камеру</button>
+<button onclick="send('capture')">Сделать снимок</button>
+<button onclick="send('record/start')">Начать запись</button>
+<button onclick="send('record/stop')">Остановить запись</button>
+<pre id="log"></pre>
+<script>
+function send(action) {
+  fetch('/' + action, {method: 'POST', headers: {'Content-Type': 'application/json'},
+                       body: JSON.stringify({surname: document.getElementById('surname').value})});
+}
+const ws = new WebSocket('ws://' + location.host + '/ws');
+ws.onmessage = e => { const log = document.getElementById('log');
+                      log.textContent = e.data + '\\n' + log.textContent.slice(0, 5000); };
+</script></body></html>
+"""
+
+
+class ControlServer:
+    """Локальный API управления на asyncio (HTTP/1.1 и WebSocket без сторонних библиотек).
+
+        GET  /                 страница с превью и кнопками
+        GET  /status           состояние (JSON)
+        POST /patient          {"surname": "..."} - выбор пациента
+        POST /camera/start     включить камеру
+        POST /camera/stop      выключить камеру
+        POST /capture          сделать снимок
+        POST /record/start     начать запись видео
+        POST /record/stop      остановить запись видео
+        GET  /preview.mjpg     превью MJPEG (multipart/x-mixed-replace)
+        GET  /ws               WebSocket: события (state, status, photo, button)
+                               и те же команды: {"action": "capture"}
+
+    Команды - только POST с Content-Type: application/json: такой запрос чужая
+    страница в браузере не отправит без разрешения CORS. Запросы с чужим Origin
+    или с Host-именем вместо адреса (DNS rebinding) отклоняются.
+    Обработчики команд выполняются в потоке цикла - том же, что и root.after.
+    """
+    STATUS_TEXT = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+                   405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large",
+                   415: "Unsupported Media Type", 500: "Internal Server Error"}
+    COMMANDS = ("patient", "camera/start", "camera/stop", "capture", "record/start", "record/stop")
+    
+    def __init__(self, controller, host=API_HOST, port=API_PORT):
+        self.controller = controller
+        self.host = host
+        self.port = port
+        self.server = None
+        self.streamer = PreviewStreamer(controller)
+        self.subscribers = set()
+        
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        print(f"[API] Управление: http://{self.host}:{self.port}/")
+        
+    def close(self):
+        if self.server:
+            self.server.close()
+            
+    def run_command(self, action, params):
+        """Команда API; непредвиденная ошибка (например, нет доступа к папке) - ответ 500"""
+        try:
+            return self.command(action, params)
+        except Exception as e:
+            print(f"[API] Ошибка команды {action}: {e!r}")
+            return 500, {"error": f"Ошибка выполнения команды: {e}"}
+            
+    def command(self, action, params):
+        """Выполнение команды API: (код HTTP, ответ)"""
+        controller = self.controller
+        if action == "status":
+            return 200, controller.state()
+        if action == "patient":
+            surname = str(params.get("surname") or "").strip()
+            if not surname:
+                return 400, {"error": "Не указана фамилия пациента"}
+            if not controller.select_patient(surname):
+                return 400, {"error": "Фамилия не должна содержать символы / \\ и '..'"}
+        elif action == "camera/start":
+            if not controller.camera_active:
+                controller.start_camera()
+            if not controller.camera_active:
+                return 409, {"error": "Не удалось включить камеру"}
+        elif action == "camera/stop":
+            if controller.camera_active:
+                controller.stop_camera()
+        elif action == "capture":
+            if not controller.patient_folder:
+                return 409, {"error": "Пациент не выбран"}
+            if not controller.camera_active:
+                return 409, {"error": "Камера не активна"}
+            if not controller.take_photo():
+                return 409, {"error": "Снимок не сделан: нет кадров с камеры или очередь записи переполнена"}
+        elif action == "record/start":
+            if not controller.patient_folder:
+                return 409, {"error": "Пациент не выбран"}
+            if not controller.video_recorder:
+                controller.start_recording()
+            if not controller.video_recorder:
+                return 409, {"error": "Камера не активна"}
+        elif action == "record/stop":
+            controller.stop_recording()
+        else:
+            return 404, {"error": f"Неизвестная команда: {action}"}
+        return 200, controller.state()
+        
+    @staticmethod
+    def trusted(headers):
+        """Запрос со страницы самого сервера: Host - адрес или localhost, Origin (если есть) - тот же"""
+        host = headers.get("host", "")
+        try:
+            name = urllib.parse.urlsplit("//" + host).hostname or ""
+            if name != "localhost":
+                ipaddress.ip_address(name)
+        except ValueError:
+            return False
+        origin = headers.get("origin")
+        return origin is None or origin.lower() == f"http://{host}".lower()
+        
+    def broadcast(self, event):
+        """Событие всем клиентам WebSocket (без ожидания)"""
+        for events in self.subscribers:
+            self.enqueue(events, event)
+            
+    async def handle(self, reader, writer):
+        """Один запрос на соединение (Connection: close)"""
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if not 0 <= length <= WS_MAX_MESSAGE:
+                await self.respond_json(writer, 413 if length > 0 else 400,
+                                        {"error": f"Размер тела запроса: 0..{WS_MAX_MESSAGE} байт"})
+                return
+            body = await reader.readexactly(length)
+            
+            path = target.partition("?")[0]
+            action = path.strip("/")
+            if not self.trusted(headers):
+                await self.respond_json(writer, 403, {"error": "Запрос с чужой страницы или по имени хоста"})
+            elif path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                await self.websocket(reader, writer, headers)
+            elif method == "GET" and path == "/preview.mjpg":
+                await self.stream(reader, writer)
+            elif method == "GET" and path == "/":
+                await self.respond(writer, 200, CONTROL_PAGE.encode("utf-8"), "text/html; charset=utf-8")
+            elif method == "GET" and action == "status":
+                await self.respond_json(writer, *self.run_command(action, {}))
+            elif method != "POST":
+                status = 405 if action in self.COMMANDS else 404
+                await self.respond_json(writer, status, {"error": f"Метод не поддерживается: {method} {path}"},
+                                        "Allow: POST\r\n" if status == 405 else "")
+            elif headers.get("content-type", "").partition(";")[0].strip().lower() != "application/json":
+                await self.respond_json(writer, 415, {"error": "Ожидается Content-Type: application/json"})
+            else:
+                try:
+                    params = json.loads(body) if body else {}
+                except ValueError:
+                    params = None
+                if not isinstance(params, dict):
+                    await self.respond_json(writer, 400, {"error": "Ожидается JSON-объект"})
+                    return
+                await self.respond_json(writer, *self.run_command(action, params))
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except Exception as e:
+            print(f"[API] Ошибка обработки запроса: {e!r}")
+        finally:
+            writer.close()
+            
+    async def respond(self, writer, status, payload, content_type, extra_headers=""):
+        writer.write((f"HTTP/1.1 {status} {self.STATUS_TEXT.get(status, '')}\r\n"
+                      f"Content-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n{extra_headers}"
+                      "Cache-Control: no-cache\r\nConnection: close\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+        
+    async def respond_json(self, writer, status, result, extra_headers=""):
+        await self.respond(writer, status, json.dumps(result, ensure_ascii=False).encode("utf-8"),
+                           "application/json; charset=utf-8", extra_headers)
+        
+    async def stream(self, reader, writer):
+        """Превью MJPEG: кадры общего кодировщика, пока клиент не отключится"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        self.streamer.subscribe()
+        try:
+            seen = 0
+            # Пока кадров нет, запись в сокет не обнаружит отключение - проверяем его сами
+            while not writer.is_closing() and not reader.at_eof():
+                frame = await self.streamer.next_frame(seen, STREAM_IDLE_CHECK_S)
+                if frame is None:
+                    continue
+                seen, jpeg = frame
+                writer.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+                             + jpeg + b"\r\n")
+                await writer.drain()
+        finally:
+            self.streamer.unsubscribe()
+            
+    async def websocket(self, reader, writer, headers):
+        """Канал событий и команд (RFC 6455: текстовые кадры, без фрагментации)"""
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest()).decode("ascii")
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("ascii"))
+        events = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        events.put_nowait({"type": "state", **self.controller.state()})
+        self.subscribers.add(events)
+        # Пишет в сокет только эта задача - кадры ответов и событий не перемешиваются
+        sender = asyncio.ensure_future(self.ws_sender(writer, events))
+        try:
+            while True:
+                opcode, payload = await self.ws_read(reader)
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    self.enqueue(events, self.ws_frame(payload, 0xA))
+                elif opcode == 0x1:
+                    try:
+                        message = json.loads(payload)
+                        status, result = self.run_command(str(message.get("action", "")), message)
+                    except (ValueError, AttributeError):
+                        status, result = 400, {"error": "Ожидается JSON: {\"action\": ...}"}
+                    self.enqueue(events, {"type": "reply", "status": status, **result})
+        finally:
+            self.subscribers.discard(events)
+            sender.cancel()
+            
+    @staticmethod
+    def enqueue(events, event):
+        """Очередь клиента полна - отбрасываем самое старое событие"""
+        if events.full():
+            events.get_nowait()
+        events.put_nowait(event)
+        
+    async def ws_sender(self, writer, events):
+        try:
+            while True:
+                event = await events.get()
+                # bytes - готовый служебный кадр (pong)
+                if not isinstance(event, bytes):
+                    event = self.ws_frame(json.dumps(event, ensure_ascii=False, default=str).encode("utf-8"))
+                writer.write(event)
+                await writer.drain()
+        except ConnectionError:
+            pass
+            
+    @staticmethod
+    async def ws_read(reader):
+        """Кадр клиента: (код операции, данные)"""
+        header = await reader.readexactly(2)
+        opcode, masked, length = header[0] & 0x0F, header[1] & 0x80, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", await reader.readexactly(8))[0]
+        if length > WS_MAX_MESSAGE:
+            raise ConnectionError("Слишком большое сообщение WebSocket")
+        mask = await reader.readexactly(4) if masked else None
+        payload = await reader.readexactly(length)
+        if mask:
+            payload = (np.frombuffer(payload, np.uint8) ^ np.resize(np.frombuffer(mask, np.uint8), length)).tobytes()
+        return opcode, payload
+        
+    @staticmethod
+    def ws_frame(data, opcode=0x1):
+        """Кадр сервера (без маски, FIN)"""
+        length = len(data)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+        return header + data
+
+
+class MedicalCameraController:
+    """Камера, Arduino, снимки и запись видео - без привязки к интерфейсу.
+
+    root - планировщик потока управления (after, after_cancel, destroy): окно Tk
+    в CameraWindow или цикл asyncio (HeadlessRoot) в HeadlessController.
+    Интерфейс подключается переопределением setup_interface и методов show_*/update_*.
+    """
+    PRELOAD_MODULES = LAZY_MODULES
+        
+    def __init__(self, root, frame_source=None, serial_port=None, images_dir=IMAGES_DIR,
+                 metrics_path=METRICS_EXPORT_PATH):
+        self.root = root
+        self.patient_surname = ""
+        self.images_dir = images_dir
+        # Файл выгрузки метрик (None - без выгрузки)
+        self.metrics_path = metrics_path
+        # Источник кадров вместо камеры (synthetic:1280x720@30 или видеофайл)
+        self.frame_source = frame_source
+        # Порт Arduino вместо автопоиска (COM3, /dev/ttyUSB0, loop://, fake:long@2,...)
+        self.serial_port = serial_port
+        
+        self.setup_variables()
+        # Пока вводится фамилия, в фоне идут импорт модулей, опрос и открытие камеры,
+        # поиск порта и ожидание готовности Arduino
+        preload_modules(self.PRELOAD_MODULES, on_loaded=lambda: self.mark_startup("modules"))
+        if not self.frame_source:
+            self.camera_registry.probe_async()
+        self.preopen_camera()
+        self.setup_arduino()
+        self.setup_library()
+        self.setup_interface()
+        self.mark_startup("window")
+        self.process_gui_queue()
+        if self.metrics_exporter:
+            self.metrics_exporter.start()
+        
+    def setup_interface(self):
+        """Интерфейс управления: окно (CameraWindow) или API (HeadlessController)"""
+        
+    def select_patient(self, surname):
+        """Выбор пациента: папка для снимков создается при необходимости (False - недопустимая фамилия)"""
+        # Создаем основную папку если ее нет
+        os.makedirs(self.images_dir, exist_ok=True)
+        # Фамилия становится именем папки - она не должна выводить за пределы images_dir
+        folder = patient_folder_path(self.images_dir, surname)
+        if folder is None:
+            self.update_status(f"Недопустимая фамилия пациента: {surname!r}")
+            return False
+        # Видео пишется в папку прежнего пациента - останавливаем
+        self.stop_recording()
+        self.patient_surname = surname
+        # Создаем папку для пациента
+        self.patient_folder = folder
+        os.makedirs(self.patient_folder, exist_ok=True)
+        print(f"[INIT] Папка пациента создана: {self.patient_folder}")
+        if PhotoWriter.cleanup_partial(self.patient_folder):
+            print("[INIT] Удалены недописанные файлы после прошлого запуска")
+        self.mark_startup("patient")
+        self.show_patient()
+        self.emit("state", **self.state())
+        return True
+        
+    def setup_library(self):
+        """Индекс снимков (обновляется в фоне)"""
+        os.makedirs(self.images_dir, exist_ok=True)
+        self.image_library = ImageLibrary(self.images_dir)
+        self.image_library.rescan_async(
+            lambda added, removed: self.update_debug(f"Индекс снимков обновлен: +{added}, -{removed}"))
+        
+    def setup_variables(self):
+        """Инициализация всех переменных состояния"""
+        self.camera_active = False
+        self.patient_folder = None
+        self.camera = None
+        self.capture_engine = None
+        self.arduino = None
+        self.arduino_connected = False
+        self.serial_transport = None
+        self.led_controller = None
+        # Замер запуска: этап -> секунды от LAUNCH_TIME
+        self.startup_times = {}
+        self.startup_reported = False
+        # Камера, открытая заранее (future -> (камера, устройство) или None)
+        self.preopen_future = None
+        self.led_state = None
+        self.led_brightness = LED_BRIGHTNESS
+        self.led_pattern = LED_PATTERN_OFF
+        self.gui_queue = queue.Queue()
+        self.gui_thread = threading.current_thread()
+        self.press_latencies = deque(maxlen=LATENCY_HISTORY)
+        self.last_photo_path = None
+        self.photo_writer = PhotoWriter()
+        self.camera_registry = CameraRegistry()
+        self.standby_release_job = None
+        self.video_recorder = None
+        # Отложенное переключение камеры (ожидание второго короткого нажатия)
+        self.short_press_job = None
+        # До этого момента (monotonic) идет снимок со вспышкой: кадры не для автоснимка
+        self.flash_until = 0.0
+        self.image_library = None
+        self.metrics_exporter = None
+        if self.metrics_path:
+            self.metrics_exporter = MetricsExporter(pipeline_metrics, self.metrics_path, collect=self.collect_metrics)
+        
+    def setup_arduino(self):
+        """Настройка подключения к Arduino"""
+        def connect_arduino():
+            try:
+                if self.serial_port:
+                    self.arduino = self.open_serial_port(self.serial_port)
+                    self.arduino_connected = True
+                    self.post_to_gui(self.update_gui_status)
+                    self.update_status(f"Подключено к {self.serial_port}")
+                    self.start_button_monitoring()
+                    return
+                    
+                ports = serial.tools.list_ports.comports()
+                arduino_port = None
+                
+                self.update_debug("Поиск Arduino...")
+                
+                for port in ports:
+                    port_description = port.description.lower()
+                    if any(keyword in port_description for keyword in 
+                          ['arduino', 'ch340', 'cp210', 'usb serial']):
+                        arduino_port = port.device
+                        self.update_debug(f"Arduino найден: {arduino_port}")
+                        break
+                
+                if not arduino_port:
+                    self.update_status("Arduino не найден!")
+                    return
+                
+                self.arduino = serial.Serial(arduino_port, SERIAL_BAUDRATE, timeout=0.5)
+                
+                self.arduino_connected = True
+                self.post_to_gui(self.update_gui_status)
+                self.update_status(f"Подключено к Arduino")
+                
+                # Запускаем мониторинг кнопки
+                self.start_button_monitoring()
+                
+            except Exception as e:
+                self.update_status(f"Ошибка подключения Arduino: {str(e)}")
+        
+        arduino_thread = threading.Thread(target=connect_arduino, daemon=True)
+        arduino_thread.start()
+        
+    @staticmethod
+        
+    def open_serial_port(spec):
+        """Порт по имени/URL pyserial или имитация скетча (fake[:сценарий])"""
+        if spec == "fake" or spec.startswith("fake:"):
+            return FakeArduino(FakeArduino.parse_script(spec[5:]))
+        return serial.serial_for_url(spec, baudrate=SERIAL_BAUDRATE, timeout=0.5)
+        
+    def start_button_monitoring(self):
+        """Запуск мониторинга кнопки Arduino"""
+        self.serial_transport = SerialTransport(self.arduino,
+                                                on_message=self.on_device_message,
+                                                on_line=lambda line: self.update_debug(f"Получено: '{line}'"),
+                                                on_error=self.on_serial_error)
+        self.serial_transport.start()
+        self.update_debug("Мониторинг кнопки запущен - ожидание SHORT_PRESS или LONG_PRESS")
+        
+        # Вместо фиксированной паузы ждем строку готовности; входной буфер не сбрасываем -
+        # нажатия сразу после старта скетча не теряются
+        if self.serial_transport.ready.wait(ARDUINO_READY_TIMEOUT_S):
+            self.mark_startup("arduino_ready")
+        else:
+            self.update_debug(f"{ARDUINO_READY_LINE} не получен за {ARDUINO_READY_TIMEOUT_S:.0f} с - "
+                              "плата не перезагружалась, продолжаем без него")
+        
+        # Кольцом управляет ПК: передаем текущее состояние
+        self.led_controller = LedController(self.serial_transport,
+                                            on_state=lambda state: self.post_to_gui(self.on_led_state, state))
+        self.led_controller.set_brightness(self.led_brightness)
+        self.led_controller.set_pattern(self.led_pattern)
+        
+    def on_device_message(self, message):
+        """Сообщение от Arduino (вызывается в потоке чтения порта)"""
+        if message.type == EVENT_ACK:
+            if self.led_controller:
+                self.led_controller.on_ack(message)
+            return
+        self.update_debug(f"Получено: {message}")
+        if message.type == EVENT_SHORT_PRESS:
+            self.post_to_gui(self.handle_short_press, message)
+        elif message.type == EVENT_LONG_PRESS:
+            self.post_to_gui(self.handle_long_press, message)
+        
+    def on_serial_error(self, error):
+        """Потеря связи с Arduino (вызывается в потоке чтения порта)"""
+        self.arduino_connected = False
+        self.led_state = None
+        self.post_to_gui(self.update_gui_status)
+        self.update_status(f"Связь с Arduino потеряна: {error}")
+        
+    def set_led_brightness(self, value):
+        """Яркость подсветки 0..255 (при частых изменениях отправляется только последняя)"""
+        self.led_brightness = int(float(value))
+        if self.led_controller:
+            self.led_controller.set_brightness(self.led_brightness)
+        
+    def set_led_pattern(self, pattern):
+        """Узор подсветки (LED_PATTERN_*)"""
+        self.led_pattern = pattern
+        if self.led_controller:
+            self.led_controller.set_pattern(pattern)
+        
+    def flash_leds(self, duration_ms=FLASH_DURATION_MS, on_ack=None):
+        """Кратковременная вспышка подсветки"""
+        if self.led_controller:
+            self.led_controller.flash(duration_ms, on_ack)
+        
+    def on_led_state(self, state):
+        """Подтвержденное скетчем состояние кольца (в потоке GUI)"""
+        self.led_state = state
+        self.update_gui_status()
+        
+    def post_to_gui(self, callback, *args):
+        """Передача вызова в поток GUI через очередь"""
+        self.gui_queue.put((callback, args))
+        
+    def process_gui_queue(self):
+        """Выполнение вызовов из фоновых потоков в потоке GUI"""
+        try:
+            while True:
+                callback, args = self.gui_queue.get_nowait()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Ошибка обработки события: {e}")
+        except queue.Empty:
+            pass
+        self.root.after(GUI_QUEUE_INTERVAL_MS, self.process_gui_queue)
+        
+    def on_gui_thread(self):
+        return threading.current_thread() is self.gui_thread
+        
+    def observe_dispatch(self, message):
+        """Время от приема события из порта до обработки в потоке GUI"""
+        if message is not None:
+            pipeline_metrics.observe("serial_dispatch", time.perf_counter() - message.received)
+        
+    def handle_short_press(self, message=None):
+        """Обработка КОРОТКОГО нажатия - переключение камеры (двойное - запись видео)"""
+        self.observe_dispatch(message)
+        if self.short_press_job:
+            # Второе нажатие в пределах DOUBLE_PRESS_MS - переключение записи
+            self.root.after_cancel(self.short_press_job)
+            self.short_press_job = None
+            self.update_button_status("Двойное нажатие - Запись видео")
+            self.toggle_recording()
+        elif self.camera_active:
+            # Выключение откладывается: возможно, это первое из двух нажатий
+            self.short_press_job = self.root.after(DOUBLE_PRESS_MS, self.on_single_short_press)
+        else:
+            self.update_button_status("Короткое нажатие - Переключение камеры")
+            self.toggle_camera()
+        
+    def on_single_short_press(self):
+        """Второго нажатия не было - обычное переключение камеры"""
+        self.short_press_job = None
+        self.update_button_status("Короткое нажатие - Переключение камеры")
+        self.toggle_camera()
+        
+    def handle_long_press(self, message=None):
+        """Обработка ДЛИННОГО нажатия - создание снимка"""
+        self.observe_dispatch(message)
+        if LONG_PRESS_ACTION == "burst":
+            self.update_button_status("Длинное нажатие - Серия снимков")
+            self.take_burst_action(trigger=message)
+        else:
+            self.update_button_status("Длинное нажатие - Создание снимка")
+            self.take_photo_action(trigger=message)
+        
+    def toggle_camera(self):
+        """Включение/выключение камеры"""
+        if not self.camera_active:
+            self.start_camera()
+        else:
+            self.stop_camera()
+        
+    def start_camera(self):
+        """Запуск камеры"""
+        try:
+            if self.capture_engine and self.capture_engine.paused:
+                # Камера в теплом резерве - только возобновляем захват
+                self.cancel_standby_release()
+                self.capture_engine.resume()
+            else:
+                self.mark_startup("camera_start")
+                if not self.open_camera():
+                    return
+                    
+                # Захват кадров идет в отдельном потоке, GUI читает из буфера
+                self.capture_engine = CaptureEngine(self.camera, self.get_buffer_size())
+                self.capture_engine.start()
+            
+            self.camera_active = True
+            self.set_led_pattern(LED_PATTERN_WHITE)
+            self.update_gui_status()
+            self.update_status(f"Камера включена")
+            self.update_button_states()
+            self.show_camera(True)
+            
+        except Exception as e:
+            self.update_status(f"Ошибка запуска камеры: {str(e)}")
+        
+    def preopen_camera(self):
+        """Открытие камеры в фоне при запуске: первое включение не ждет драйвер"""
+        if not CAMERA_PREOPEN:
+            return
+            
+        def preopen():
+            if self.frame_source:
+                camera, device = open_frame_source(self.frame_source), None
+            else:
+                device = self.camera_registry.preferred()
+                if device is None:
+                    return None
+                camera = self.create_capture(device.index)
+            if not camera.isOpened():
+                camera.release()
+                return None
+            self.mark_startup("camera_ready")
+            return camera, device
+            
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camera-preopen")
+        self.preopen_future = executor.submit(preopen)
+        executor.shutdown(wait=False)
+        
+    def take_preopened_camera(self):
+        """Заранее открытая камера (ждет завершения открытия) или None"""
+        future, self.preopen_future = self.preopen_future, None
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"[CAMERA] Ошибка предварительного открытия камеры: {e}")
+            return None
+        
+    def open_camera(self):
+        """Открытие камеры из кэша устройств (с повторным опросом при неудаче)"""
+        preopened = self.take_preopened_camera()
+        if preopened:
+            self.camera, device = preopened
+            if device:
+                self.camera_registry.select(device)
+                self.update_debug(f"Открыта камера {device} (заранее), режим: {self.describe_camera_mode()}")
+            else:
+                self.update_debug(f"Источник кадров: {self.frame_source} (открыт заранее)")
+            return True
+            
+        if self.frame_source:
+            self.camera = open_frame_source(self.frame_source)
+            if not self.camera.isOpened():
+                self.update_status(f"Не удалось открыть источник кадров {self.frame_source}")
+                self.camera = None
+                return False
+            self.update_debug(f"Источник кадров: {self.frame_source}")
+            return True
+            
+        self.camera_registry.refresh_if_changed()
+        device = self.camera_registry.preferred()
+        
+        if device is None:
+            self.update_status("Камеры не найдены!")
+            return False
+            
+        self.camera = self.create_capture(device.index)
+        
+        if not self.camera.isOpened():
+            # Устройство могло быть отключено или сменить индекс
+            self.camera.release()
+            self.camera_registry.probe()
+            device = self.camera_registry.preferred()
+            self.camera = self.create_capture(device.index) if device else None
+            if not self.camera or not self.camera.isOpened():
+                self.update_status("Не удалось открыть камеру")
+                self.camera = None
+                return False
+                
+        self.camera_registry.select(device)
+        self.update_debug(f"Открыта камера {device}, режим: {self.describe_camera_mode()}")
+        return True
+        
+    def create_capture(self, index):
+        """Открытие камеры с явными форматом, разрешением и частотой кадров"""
+        camera = cv2.VideoCapture(index)
+        if not camera.isOpened():
+            return camera
+        camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*CAMERA_FOURCC))
+        camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
+        camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
+        camera.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
+        # Камера могла не согласиться на MJPG (или на MJPG в этом разрешении):
+        # без конвертации драйвер тогда отдал бы сырые YUYV-кадры (h, w, 2)
+        if MJPEG_PASSTHROUGH and CAMERA_FOURCC == "MJPG" and self.camera_fourcc(camera) == "MJPG":
+            # Без конвертации драйвер отдает сжатые байты кадра;
+            # если бэкенд это не поддерживает, придут обычные BGR-кадры
+            camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        return camera
+        
+    @staticmethod
+        
+    def camera_fourcc(camera):
+        """Фактически согласованный формат кадров камеры ("MJPG", "YUYV", ...)"""
+        fourcc = int(camera.get(cv2.CAP_PROP_FOURCC))
+        return "".join(chr((fourcc >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00") or "?"
+        
+    def describe_camera_mode(self):
+        """Фактически согласованные параметры видеопотока"""
+        fourcc_str = self.camera_fourcc(self.camera)
+        return (f"{fourcc_str} {int(self.camera.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
+                f"{int(self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT))} @ {self.camera.get(cv2.CAP_PROP_FPS):.0f} fps")
+        
+    def stop_camera(self, release=not CAMERA_WARM_STANDBY):
+        """Остановка камеры (в теплом резерве - только пауза захвата)"""
+        self.cancel_standby_release()
+        self.stop_recording()
+        if self.capture_engine and not release:
+            self.capture_engine.pause()
+            self.standby_release_job = self.root.after(CAMERA_STANDBY_TIMEOUT_S * 1000,
+                                                       self.release_standby_camera)
+        elif self.capture_engine:
+            self.capture_engine.stop()
+            self.capture_engine = None
+            self.camera = None
+        elif self.camera:
+            self.camera.release()
+            self.camera = None
+            
+        self.camera_active = False
+        self.set_led_pattern(LED_PATTERN_OFF)
+        self.update_gui_status()
+        self.update_status("Камера выключена")
+        self.update_button_states()
+        self.show_camera(False)
+        
+    def get_buffer_size(self):
+        """Размер буфера кадров с учетом окна нулевой задержки затвора"""
+        if not ZSL_ENABLED:
+            return FRAME_BUFFER_SIZE
+        fps = self.camera.get(cv2.CAP_PROP_FPS) if self.camera else 0
+        fps = min(fps, ZSL_MAX_FPS) if fps and fps > 0 else 30
+        # +2 слота: записываемый сейчас кадр и запас на время копирования
+        return max(FRAME_BUFFER_SIZE, int(fps * ZSL_WINDOW_MS / 1000) + 2, BURST_FRAMES + 2)
+        
+    def grab_photo_frames(self):
+        """Кадры-кандидаты для снимка: окно ZSL (закрепленные слоты буфера) или последний кадр"""
+        if ZSL_ENABLED:
+            start = time.perf_counter()
+            frames = self.capture_engine.recent_frames(ZSL_WINDOW_MS / 1000, pin=True)
+            pipeline_metrics.observe("zsl_grab", time.perf_counter() - start)
+            if frames:
+                return frames
+        seq, frame = self.capture_engine.latest_frame()
+        return [(seq, time.monotonic(), frame)] if frame is not None else []
+        
+    def make_photo_path(self, timestamp):
+        """Путь для нового снимка: Фамилия_ГГГГ-ММ-ДД_ЧЧ-ММ-СС.jpg (+ _N при совпадении)"""
+        date_str = timestamp.strftime("%Y-%m-%d")
+        time_str = timestamp.strftime("%H-%M-%S")
+        base = f"{self.patient_surname}_{date_str}_{time_str}"
+        filepath = os.path.join(self.patient_folder, f"{base}.jpg")
+        n = 2
+        while os.path.exists(filepath) or self.photo_writer.is_pending(filepath):
+            filepath = os.path.join(self.patient_folder, f"{base}_{n}.jpg")
+            n += 1
+        return filepath
+        
+    def cancel_standby_release(self):
+        if self.standby_release_job:
+            self.root.after_cancel(self.standby_release_job)
+            self.standby_release_job = None
+        
+    def release_standby_camera(self):
+        """Освобождение камеры после долгого простоя в резерве"""
+        self.standby_release_job = None
+        if self.capture_engine and self.capture_engine.paused:
+            self.capture_engine.stop()
+            self.capture_engine = None
+            self.camera = None
+            self.update_debug("Камера освобождена после простоя")
+        
+    def toggle_recording(self):
+        """Старт/стоп записи видео сеанса"""
+        if self.video_recorder:
+            self.stop_recording()
+        else:
+            self.start_recording()
+        
+    def start_recording(self):
+        """Запись кадров камеры в сегменты видео в папке пациента"""
+        if not self.camera_active or not self.capture_engine:
+            self.update_status("Камера не активна! Невозможно начать запись.")
+            return
+        if not self.patient_folder:
+            self.update_status("Пациент не выбран - запись не начата")
+            return
+        fps = self.camera.get(cv2.CAP_PROP_FPS) if self.camera else 0
+        fps = fps if fps and fps > 0 else CAMERA_FPS
+        recorder = VideoRecorder(self.patient_folder, self.patient_surname, fps,
+                                 on_error=lambda error: self.post_to_gui(self.on_recording_error, recorder, error))
+        self.video_recorder = recorder
+        self.video_recorder.start()
+        self.capture_engine.recorder = self.video_recorder
+        self.update_status("Запись видео начата")
+        self.update_debug(f"Запись видео: сегменты по {RECORD_SEGMENT_S} с, {fps:.0f} fps")
+        self.update_button_states()
+        
+    def stop_recording(self, wait=False):
+        """Остановка записи; кодировщик дописывает очередь в фоне"""
+        recorder = self.video_recorder
+        if not recorder:
+            return
+        self.video_recorder = None
+        if self.capture_engine:
+            self.capture_engine.recorder = None
+        recorder.stop(wait)
+        self.update_status("Запись видео остановлена")
+        self.update_debug(f"Запись видео: кадров {recorder.frames_written}, "
+                          f"пропущено {recorder.frames_dropped}, повторено {recorder.frames_repeated}")
+        self.update_button_states()
+        
+    def on_recording_error(self, recorder, error):
+        """Кодировщик видео остановился с ошибкой: запись выключается и в интерфейсе"""
+        if self.video_recorder is not recorder:
+            return
+        self.stop_recording()
+        self.update_status(f"Ошибка записи видео: {error}")
+        
+    def take_photo_action(self, trigger=None):
+        """Действие по созданию снимка"""
+        if not self.camera_active:
+            self.update_status("Камера не активна! Невозможно сделать снимок.")
+            return
+            
+        self.take_photo(trigger)
+        
+    def take_photo(self, trigger=None):
+        """Создание снимка через PIL (рабочий метод); False - снимок не поставлен в очередь"""
+        if not self.camera_active or not self.capture_engine:
+            return False
+        if not self.patient_folder:
+            self.update_status("Пациент не выбран - снимок не сохранен")
+            return False
+            
+        if FLASH_CAPTURE and self.led_controller and self.arduino_connected:
+            # Снимок со вспышкой: кадры выбираются после подтверждения вспышки скетчем
+            self.flash_until = float("inf")
+            self.led_controller.flash(FLASH_DURATION_MS, on_ack=lambda state: self.post_to_gui(
+                self.on_flash_ack, state, trigger, time.monotonic()))
+            return True
+            
+        # Берем кадры из буфера - без блокирующего чтения с устройства
+        return self.save_photo(self.grab_photo_frames(), trigger)
+        
+    def take_burst_action(self, trigger=None):
+        """Серия: последние BURST_FRAMES кадров сливаются в один снимок в процессе-обработчике"""
+        if not self.camera_active or not self.capture_engine:
+            self.update_status("Камера не активна! Невозможно сделать серию.")
+            return
+            
+        # Последние кадры подряд уже есть в буфере - ждать новых не нужно;
+        # берутся только BURST_FRAMES последних слотов, закрепленными, без копирования
+        frames = self.capture_engine.recent_frames(float("inf"), count=BURST_FRAMES, pin=True)
+        release = self.capture_engine.release_frames
+        if len(frames) < 2:
+            release([frame for _, _, frame in frames])
+            self.take_photo(trigger)
+            return
+        timestamp = frames[-1][1]
+        frames = [frame for _, _, frame in frames]
+        self.update_debug(f"Серия: {len(frames)} кадров отправлено на слияние")
+        # Копирование в разделяемую память - вне потока GUI
+        threading.Thread(target=self.submit_burst, args=(frames, release, trigger, timestamp),
+                         name="burst-submit", daemon=True).start()
+        
+    def submit_burst(self, frames, release, trigger, timestamp):
+        """Передача серии обработчику (в фоновом потоке); закрепленные кадры затем возвращаются в буфер"""
+        shared = None
+        try:
+            if is_jpeg_buffer(frames[0]):
+                # Сжатые кадры малы - передаем как есть, декодирует обработчик
+                future = get_process_pool().submit(merge_burst, frames, BURST_MERGE)
+            else:
+                # Несжатые кадры - одно копирование из слотов буфера прямо в разделяемую память
+                stack = SharedFrame.from_frames(frames)
+                shared = (stack,)  # закрывается при ошибке ниже
+                target = SharedFrame(frames[0].shape, frames[0].dtype)
+                shared = (stack, target)
+                future = get_process_pool().submit(merge_burst_shared, stack.descriptor(),
+                                                   target.descriptor(), BURST_MERGE)
+        except Exception as e:
+            for block in shared or ():
+                block.close()
+            self.update_status(f"Ошибка обработки серии: {e}")
+            return
+        finally:
+            # Сжатые кадры буфер не перезаписывает на месте, несжатые уже скопированы
+            release(frames)
+        future.add_done_callback(lambda f: self.post_to_gui(self.on_burst_merged, f, trigger,
+                                                            timestamp, shared))
+        
+    def on_burst_merged(self, future, trigger, timestamp, shared=None):
+        """Результат слияния серии (в потоке GUI): снимок ставится в очередь записи"""
+        try:
+            if shared:
+                info = future.result()
+                merged = shared[1].array.copy()
+            else:
+                merged, info = future.result()
+        except Exception as e:
+            self.update_status(f"Ошибка обработки серии: {e}")
+            return
+        finally:
+            for block in shared or ():
+                block.close()
+        pipeline_metrics.observe("burst_merge", info["elapsed"])
+        self.update_debug(f"Серия: использовано {info['used']} из {info['frames']} кадров, "
+                          f"слияние {info['elapsed'] * 1000:.0f} мс")
+        self.save_photo([(0, timestamp, merged)], trigger)
+        
+    def on_flash_ack(self, state, trigger, ack_time):
+        """Вспышка подтверждена: ждем установки экспозиции и окна кадров со вспышкой"""
+        if state is None:
+            self.flash_until = 0.0
+        else:
+            # Вспышка гаснет через FLASH_DURATION_MS, затем снова устанавливается экспозиция
+            self.flash_until = ack_time + (FLASH_DURATION_MS + FLASH_SETTLE_MS) / 1000
+        if not self.camera_active or not self.capture_engine:
+            return
+        if state is None:
+            self.update_debug("Вспышка не подтверждена - снимок без вспышки")
+            self.save_photo(self.grab_photo_frames(), trigger)
+            return
+        since = ack_time + FLASH_SETTLE_MS / 1000
+        delay = since + FLASH_CAPTURE_WINDOW_MS / 1000 - time.monotonic()
+        self.root.after(max(0, int(delay * 1000)), self.capture_flash_frames, trigger, since)
+        
+    def capture_flash_frames(self, trigger, since):
+        """Снимок из кадров, снятых при включенной вспышке"""
+        if not self.camera_active or not self.capture_engine:
+            return
+        frames = self.capture_engine.recent_frames(time.monotonic() - since, pin=True)
+        self.save_photo(frames or self.grab_photo_frames(), trigger)
+        
+    def save_photo(self, frames, trigger=None):
+        """Постановка кадров-кандидатов в очередь записи; True - снимок поставлен в очередь"""
+        if not frames:
+            # Буфер еще пуст (камера только включена) или камера остановлена
+            self.update_status("Нет кадров с камеры - снимок не сделан")
+            return False
+        # Кадры могут быть закреплены в буфере захвата - их вернет поток записи
+        release = self.capture_engine.release_frames if self.capture_engine else None
+        try:
+            filepath = self.make_photo_path(datetime.now())
+            
+            # Выбор кадра, кодирование и запись - в фоновом потоке
+            job = PhotoJob(filepath, frames, trigger=trigger, release=release,
+                           callback=lambda job: self.post_to_gui(self.on_photo_saved, job))
+            if not self.photo_writer.submit(job):
+                self.update_status("Очередь записи переполнена - снимок пропущен!")
+                return False
+            self.update_debug(f"Снимок поставлен в очередь записи: {filepath}")
+            return True
+                
+        except Exception as e:
+            if release:
+                release([frame for _, _, frame in frames])
+            error_msg = f"Ошибка создания снимка: {str(e)}"
+            self.update_status(error_msg)
+            self.update_debug(f"❌ {error_msg}")
+            return False
+        
+    def on_photo_saved(self, job):
+        """Завершение фоновой записи снимка (вызывается в потоке GUI)"""
+        if job.error:
+            error_msg = f"Ошибка создания снимка: {str(job.error)}"
+            self.update_status(error_msg)
+            self.update_debug(f"❌ {error_msg}")
+            return
+            
+        self.last_photo_path = job.filepath
+        self.update_photo_preview(job.frame)
+        self.emit("photo", path=job.filepath, width=job.width, height=job.height, size=job.file_size,
+                  sharpness=job.score)
+        if self.image_library:
+            future = self.image_library.add_async(job.filepath, job.width, job.height, job.score, job.dhash)
+            future.add_done_callback(lambda f: self.post_to_gui(self.on_photo_indexed, job, f))
+        self.update_status(f"Снимок сохранен: {job.filename}")
+        
+        details = f"Файл создан, размер: {job.file_size} байт, запись {job.elapsed * 1000:.0f} мс"
+        if job.candidates > 1:
+            details += f", ZSL: кадр #{job.seq} из {job.candidates}, резкость {job.score:.1f}"
+        if job.enhance:
+            details += f", улучшение {job.enhance['elapsed'] * 1000:.0f} мс (исходник в {ORIGINALS_DIR_NAME})"
+        if job.trigger:
+            details += ", " + self.record_press_latency(job.trigger)
+        self.update_debug(f"✅ {details}")
+        
+    def on_photo_indexed(self, job, future):
+        """Снимок добавлен в индекс: предупреждение, если такой снимок уже есть"""
+        if future.exception():
+            print(f"[LIBRARY] Ошибка добавления {job.filename}: {future.exception()}")
+            return
+        similar = future.result()
+        if similar:
+            distance, path = similar[0]
+            more = f" (и еще {len(similar) - 1})" if len(similar) > 1 else ""
+            self.update_status(f"⚠ Снимок {job.filename} почти совпадает с {os.path.basename(path)}{more}")
+            self.update_debug(f"Похожий снимок: {path}, различие хешей {distance} бит из 64")
+        
+    def record_press_latency(self, message):
+        """Замер задержки от нажатия кнопки до сохраненного файла"""
+        latency = time.perf_counter() - message.received
+        if self.serial_transport:
+            latency += self.serial_transport.transport_delay(message)
+        self.press_latencies.append(latency)
+        pipeline_metrics.observe("press_to_file", latency)
+        values = list(self.press_latencies)
+        return (f"нажатие->файл {latency * 1000:.0f} мс "
+                f"(p50 {percentile(values, 50) * 1000:.0f}, p95 {percentile(values, 95) * 1000:.0f} мс)")
+        
+    def get_available_cameras(self):
+        """Получение списка доступных камер (из кэша устройств)"""
+        return [device.index for device in self.camera_registry.available()]
+        
+    def mark_startup(self, stage):
+        """Отметка этапа запуска (только первая; из любого потока)"""
+        self.startup_times.setdefault(stage, time.perf_counter() - LAUNCH_TIME)
+        
+    def report_startup(self):
+        """Первый живой кадр: время от запуска и по этапам"""
+        self.startup_reported = True
+        self.mark_startup("first_frame")
+        times = dict(self.startup_times)
+        stages = ", ".join(f"{title} {times[stage] * 1000:.0f}" for stage, title in STARTUP_STAGES if stage in times)
+        text = f"Запуск -> первый кадр: {times['first_frame'] * 1000:.0f} мс (этапы, мс от запуска: {stages})"
+        if "camera_start" in times:
+            text += f"; включение -> кадр {(times['first_frame'] - times['camera_start']) * 1000:.0f} мс"
+        print(f"[STARTUP] {text}")
+        self.update_debug(text)
+        for stage, seconds in times.items():
+            pipeline_metrics.set_gauge(f"startup_{stage}_s", round(seconds, 3))
+        threading.Thread(target=self.warm_up, name="warm-up", daemon=True).start()
+        
+    def warm_up(self):
+        """Подготовка после первого кадра (в фоне), чтобы не задерживать окно и камеру"""
+        # Пул процессов запускается заранее, чтобы первая серия не ждала старта интерпретатора
+        get_process_pool().submit(int)
+        
+    def update_status(self, message):
+        """Обновление статус бара"""
+        if not self.on_gui_thread():
+            self.post_to_gui(self.update_status, message)
+            return
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self.show_status(f"[{timestamp}] {message}")
+        print(f"[{timestamp}] {message}")
+        self.emit("status", message=message)
+        
+    def update_debug(self, message):
+        """Обновление отладочной информации"""
+        if not self.on_gui_thread():
+            self.post_to_gui(self.update_debug, message)
+            return
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        self.show_debug(f"[{timestamp}] {message}")
+        print(f"[DEBUG] {message}")
+        self.emit("debug", message=message)
+        
+    def show_patient(self):
+        """Выбран пациент: отображение в интерфейсе"""
+        
+    def show_camera(self, active):
+        """Камера включена/выключена: отображение в интерфейсе"""
+        
+    def show_status(self, text):
+        """Строка статуса в интерфейсе"""
+        
+    def show_debug(self, text):
+        """Строка отладки в интерфейсе"""
+        
+    def update_gui_status(self):
+        """Обновление статусов подключения в интерфейсе"""
+        
+    def update_button_states(self):
+        """Обновление состояний кнопок ручного управления"""
+        
+    def update_button_status(self, message):
+        """Обновление статуса кнопки"""
+        
+    def update_photo_preview(self, frame):
+        """Обновление превью последнего снимка"""
+        
+    def emit(self, event_type, **data):
+        """Событие для клиентов API (в режиме без интерфейса)"""
+        
+    def state(self):
+        """Состояние для API"""
+        engine = self.capture_engine
+        return {
+            "patient": self.patient_surname or None,
+            "camera_active": self.camera_active,
+            "arduino_connected": self.arduino_connected,
+            "led": self.led_state,
+            "recording": self.video_recorder is not None,
+            "photo_queue": self.photo_writer.pending_count(),
+            "frames": ({"grabbed": engine.frames_grabbed, "shown": engine.frames_shown,
+                        "dropped": engine.frames_dropped} if engine else None),
+            "last_photo": self.last_photo_path,
+        }
+        
+    def collect_metrics(self):
+        """Счетчики для выгрузки метрик (вызывается из потока выгрузки)"""
+        engine = self.capture_engine
+        if engine:
+            pipeline_metrics.set_gauge("frames_grabbed", engine.frames_grabbed)
+            pipeline_metrics.set_gauge("frames_shown", engine.frames_shown)
+            pipeline_metrics.set_gauge("frames_dropped", engine.frames_dropped)
+            pipeline_metrics.set_gauge("read_errors", engine.read_errors)
+        pipeline_metrics.set_gauge("camera_active", int(self.camera_active))
+        pipeline_metrics.set_gauge("photo_queue", self.photo_writer.pending_count())
+        recorder = self.video_recorder
+        pipeline_metrics.set_gauge("recording", int(recorder is not None))
+        if recorder:
+            pipeline_metrics.set_gauge("record_frames_written", recorder.frames_written)
+            pipeline_metrics.set_gauge("record_frames_dropped", recorder.frames_dropped)
+        transport = self.serial_transport
+        if transport:
+            pipeline_metrics.set_gauge("serial_messages", transport.messages_received)
+            pipeline_metrics.set_gauge("serial_lost", transport.messages_lost)
+            pipeline_metrics.set_gauge("serial_crc_errors", transport.parser.crc_errors)
+        
+    def on_closing(self):
+        """Обработчик закрытия приложения"""
+        # Закрываем последний сегмент видео до выхода
+        self.stop_recording(wait=True)
+        self.stop_camera(release=True)
+        preopened = self.take_preopened_camera()
+        if preopened:
+            preopened[0].release()
+        # Дописываем снимки, оставшиеся в очереди
+        self.photo_writer.stop(wait=True)
+        if self.image_library:
+            self.image_library.close()
+        if self.metrics_exporter:
+            self.metrics_exporter.stop()
+        shutdown_process_pool()
+        if self.led_controller:
+            self.led_controller.close()
+        if self.serial_transport:
+            self.serial_transport.close()
+        elif self.arduino and self.arduino_connected:
+            self.arduino.close()
+        self.root.destroy()
 
-class MedicalCameraController:
-    def __init__(self, root):
-        self.root = root
-        self.patient_surname = ""
-        self.images_dir = "medical_images"
+
+class HeadlessController(MedicalCameraController):
+    """Работа без окна: управление через ControlServer (HTTP/WebSocket) на цикле HeadlessRoot"""
+    def __init__(self, root, frame_source=None, serial_port=None, images_dir=IMAGES_DIR, patient=None,
+                 api_host=API_HOST, api_port=API_PORT, metrics_path=METRICS_EXPORT_PATH):
+        self.patient = patient
+        self.api_host = api_host
+        self.api_port = api_port
+        self.api = None
+        super().__init__(root, frame_source, serial_port, images_dir, metrics_path)
         
-        self.setup_variables()
-        self.get_patient_info()
-        self.create_gui()
-        self.setup_arduino()
+    def setup_interface(self):
+        # Пациента можно выбрать позже через API
+        if self.patient:
+            self.select_patient(self.patient)
+        self.api = ControlServer(self, self.api_host, self.api_port)
+        self.root.loop.run_until_complete(self.api.start())
         
-    def get_patient_info(self):
-        """Запрос фамилии пациента при запуске программы"""
-        while not self.patient_surname:
-            surname = simpledialog.askstring("Пациент", "Введите фамилию пациента:", 
-                                           parent=self.root)
-            if surname:
-                self.patient_surname = surname.strip()
-                # Создаем основную папку если ее нет
-                os.makedirs(self.images_dir, exist_ok=True)
-                # Создаем папку для пациента
-                self.patient_folder = os.path.join(self.images_dir, self.patient_surname)
-                os.makedirs(self.patient_folder, exist_ok=True)
-                print(f"[INIT] Папка пациента создана: {self.patient_folder}")
-            else:
-                if messagebox.askretrycancel("Ошибка", "Фамилия пациента обязательна для работы программы."):
-                    continue
-                else:
-                    self.root.destroy()
-                    return
+    def show_camera(self, active):
+        if active and not self.startup_reported:
+            self.watch_first_frame()
+        
+    def watch_first_frame(self):
+        """Ожидание первого кадра без интерфейса (кадры не отрисовываются)"""
+        if self.startup_reported or not self.camera_active or not self.capture_engine:
+            return
+        if self.capture_engine.frames_grabbed:
+            self.report_startup()
+        else:
+            self.root.after(5, self.watch_first_frame)
+        
+    def update_gui_status(self):
+        self.emit("state", **self.state())
+        
+    def update_button_status(self, message):
+        self.emit("button", message=message)
+        
+    def emit(self, event_type, **data):
+        """Событие всем клиентам API"""
+        if self.api:
+            self.api.broadcast({"type": event_type, "time": datetime.now().isoformat(" ", "seconds"), **data})
+        
+    def on_closing(self):
+        super().on_closing()
+        if self.api:
+            self.api.close()
+
+
+class CameraWindow(MedicalCameraController):
+    """Окно программы (Tk): видео, статусы, ручное управление, галерея и статистика"""
+    PRELOAD_MODULES = MedicalCameraController.PRELOAD_MODULES + (ImageTk,)
         
     def setup_variables(self):
-        """Инициализация всех переменных состояния"""
-        self.camera_active = False
-        self.camera = None
-        self.arduino = None
-        self.arduino_connected = False
-        self.last_photo_path = None
+        super().setup_variables()
+        self.preview_seq = 0
+        self.preview_frame = None
+        self.video_renderer = None
+        self.photo_renderer = None
+        self.auto_capture = False
+        self.stability_detector = StabilityDetector()
+        self.thumbnail_cache = None
+        self.thumbnail_cache_lock = threading.Lock()
+        self.gallery = None
+        self.stats_window = None
         
-        # Инициализируем переменные для GUI
+        # Виджеты окна
         self.debug_label = None
         self.status_label = None
+        self.patient_label = None
+        self.folder_label = None
         self.video_label = None
         self.photo_label = None
         self.arduino_status = None
         self.camera_status = None
         self.button_status = None
         self.led_status = None  # Новый статус для светодиодов
+        self.frames_status = None
         self.start_camera_btn = None
         self.stop_camera_btn = None
         self.take_photo_btn = None
         
+    def get_thumbnail_cache(self):
+        """Кэш миниатюр (создается при первом обращении: подсчет размера обходит папку кэша)"""
+        with self.thumbnail_cache_lock:
+            if self.thumbnail_cache is None:
+                self.thumbnail_cache = ThumbnailCache(os.path.join(self.images_dir, THUMBNAIL_DIR_NAME))
+            return self.thumbnail_cache
+            
+    def warm_up(self):
+        super().warm_up()
+        self.get_thumbnail_cache()
+        
+    def setup_interface(self):
+        self.create_gui()
+        # Окно показывается сразу, фамилия запрашивается уже поверх него
+        self.root.after(0, self.get_patient_info)
+        
+    def show_patient(self):
+        self.root.title(f"Medical Camera Controller - Пациент: {self.patient_surname}")
+        self.patient_label.config(text=f"Пациент: {self.patient_surname}")
+        self.folder_label.config(text=f"Папка: {self.patient_folder}")
+        self.update_status(f"Программа запущена для пациента: {self.patient_surname}")
+        self.update_debug(f"Папка для снимков: {self.patient_folder}")
+        
+    def show_camera(self, active):
+        if active:
+            self.preview_seq = 0
+            self.video_renderer.reset()
+            self.video_placeholder.pack_forget()
+            self.update_video_feed()
+        else:
+            self.video_placeholder.pack(fill=tk.BOTH, expand=True)
+        
+    def show_status(self, text):
+        if self.status_label:
+            self.status_label.config(text=text)
+        
+    def show_debug(self, text):
+        if self.debug_label:
+            self.debug_label.config(text=text)
+        
+    def get_patient_info(self):
+        """Запрос фамилии пациента при запуске программы"""
+        while not self.patient_surname:
+            surname = simpledialog.askstring("Пациент", "Введите фамилию пациента:", 
+                                           parent=self.root)
+            if surname and surname.strip():
+                if not self.select_patient(surname.strip()):
+                    messagebox.showerror("Ошибка", "Фамилия не должна содержать символы / \\ и '..'")
+            else:
+                if messagebox.askretrycancel("Ошибка", "Фамилия пациента обязательна для работы программы."):
+                    continue
+                else:
+                    self.on_closing()
+                    return
+        
     def create_gui(self):
         """Создание графического интерфейса"""
         self.root.title(f"Medical Camera Controller - Пациент: {self.patient_surname}")
@@ -74,16 +4387,13 @@ class MedicalCameraController:
         self.create_status_bar()
         self.create_debug_panel(main_frame)
         
-        # Обновляем статус после создания всех элементов GUI
-        self.update_status(f"Программа запущена для пациента: {self.patient_surname}")
-        self.update_debug(f"Папка для снимков: {self.patient_folder}")
-        
     def create_video_panel(self, parent):
         video_frame = ttk.LabelFrame(parent, text="Видео с камеры", padding=10)
         video_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10))
         
-        self.video_label = ttk.Label(video_frame, background="black")
+        self.video_label = ttk.Label(video_frame, background="black", anchor=tk.CENTER)
         self.video_label.pack(fill=tk.BOTH, expand=True)
+        self.video_renderer = PreviewRenderer(self.video_label)
         
         self.video_placeholder = ttk.Label(video_frame, 
                                          text="Камера выключена\n\nКороткое нажатие: Вкл/Выкл камеры\nДлинное нажатие: Сделать снимок", 
@@ -99,16 +4409,16 @@ class MedicalCameraController:
         patient_frame = ttk.LabelFrame(control_frame, text="Информация о пациенте", padding=10)
         patient_frame.pack(fill=tk.X, pady=(0, 10))
         
-        patient_label = ttk.Label(patient_frame, text=f"Пациент: {self.patient_surname}", 
-                                font=("Arial", 10, "bold"))
-        patient_label.pack(anchor=tk.W)
+        self.patient_label = ttk.Label(patient_frame, text=f"Пациент: {self.patient_surname}", 
+                                       font=("Arial", 10, "bold"))
+        self.patient_label.pack(anchor=tk.W)
         
         date_label = ttk.Label(patient_frame, text=f"Дата: {datetime.now().strftime('%d.%m.%Y')}")
         date_label.pack(anchor=tk.W)
         
         # Путь к папке пациента
-        self.folder_label = ttk.Label(patient_frame, text=f"Папка: {self.patient_folder}", 
-                               foreground="gray", font=("Arial", 8))
+        self.folder_label = ttk.Label(patient_frame, text=f"Папка: {self.patient_folder or '-'}", 
+                                      foreground="gray", font=("Arial", 8))
         self.folder_label.pack(anchor=tk.W)
         
         # Статус системы
@@ -127,6 +4437,9 @@ class MedicalCameraController:
         self.button_status = ttk.Label(info_frame, text="Кнопка: Готова", foreground="blue")
         self.button_status.pack(anchor=tk.W)
         
+        self.frames_status = ttk.Label(info_frame, text="Кадры: -", foreground="gray")
+        self.frames_status.pack(anchor=tk.W)
+        
         # Превью последнего снимка
         photo_frame = ttk.LabelFrame(control_frame, text="Последний снимок", padding=10)
         photo_frame.pack(fill=tk.BOTH, expand=True, pady=10)
@@ -134,6 +4447,7 @@ class MedicalCameraController:
         self.photo_label = ttk.Label(photo_frame, text="Снимков еще нет", 
                                    background="lightgray", anchor=tk.CENTER)
         self.photo_label.pack(fill=tk.BOTH, expand=True, ipady=50)
+        self.photo_renderer = PreviewRenderer(self.photo_label, PHOTO_PREVIEW_SIZE, PHOTO_PREVIEW_SIZE)
         
         # Ручное управление
         manual_frame = ttk.LabelFrame(control_frame, text="Ручное управление", padding=10)
@@ -153,6 +4467,39 @@ class MedicalCameraController:
                                        state="disabled")
         self.take_photo_btn.pack(fill=tk.X, pady=2)
         
+        self.take_burst_btn = ttk.Button(manual_frame, text=f"Серия ({BURST_FRAMES} кадров)",
+                                       command=self.take_burst_action,
+                                       state="disabled")
+        self.take_burst_btn.pack(fill=tk.X, pady=2)
+        
+        self.record_btn = ttk.Button(manual_frame, text="Начать запись видео",
+                                     command=self.toggle_recording,
+                                     state="disabled")
+        self.record_btn.pack(fill=tk.X, pady=2)
+        
+        self.gallery_btn = ttk.Button(manual_frame, text="Галерея снимков", command=self.open_gallery)
+        self.gallery_btn.pack(fill=tk.X, pady=2)
+        
+        self.export_btn = ttk.Button(manual_frame, text="Экспорт снимков в архив", command=self.export_session)
+        self.export_btn.pack(fill=tk.X, pady=2)
+        
+        self.stats_btn = ttk.Button(manual_frame, text="Статистика конвейера", command=self.open_stats)
+        self.stats_btn.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(manual_frame, text="Яркость подсветки").pack(anchor=tk.W, pady=(6, 0))
+        self.brightness_scale = ttk.Scale(manual_frame, from_=0, to=255,
+                                          command=self.set_led_brightness)
+        self.brightness_scale.set(self.led_brightness)
+        self.brightness_scale.pack(fill=tk.X, pady=2)
+        
+        self.auto_capture_var = tk.BooleanVar(value=self.auto_capture)
+        ttk.Checkbutton(manual_frame, text="Автоснимок при неподвижной камере", variable=self.auto_capture_var,
+                        command=self.toggle_auto_capture).pack(anchor=tk.W, pady=(6, 0))
+        
+        self.enhance_var = tk.BooleanVar(value=self.photo_writer.enhance)
+        ttk.Checkbutton(manual_frame, text="Улучшение снимков", variable=self.enhance_var,
+                        command=self.toggle_enhance).pack(anchor=tk.W, pady=(6, 0))
+        
     def create_debug_panel(self, parent):
         """Панель отладки"""
         debug_frame = ttk.LabelFrame(parent, text="События кнопки", padding=10)
@@ -175,252 +4522,67 @@ class MedicalCameraController:
             self.start_camera_btn.config(state="disabled")
             self.stop_camera_btn.config(state="normal")
             self.take_photo_btn.config(state="normal")
+            self.take_burst_btn.config(state="normal")
+            self.record_btn.config(state="normal")
         else:
             # Камера выключена - активируем кнопку Старт, деактивируем Стоп и Снимок
             self.start_camera_btn.config(state="normal")
             self.stop_camera_btn.config(state="disabled")
             self.take_photo_btn.config(state="disabled")
-        
-    def setup_arduino(self):
-        """Настройка подключения к Arduino"""
-        def connect_arduino():
-            try:
-                ports = serial.tools.list_ports.comports()
-                arduino_port = None
-                
-                self.update_debug("Поиск Arduino...")
-                
-                for port in ports:
-                    port_description = port.description.lower()
-                    if any(keyword in port_description for keyword in 
-                          ['arduino', 'ch340', 'cp210', 'usb serial']):
-                        arduino_port = port.device
-                        self.update_debug(f"Arduino найден: {arduino_port}")
-                        break
-                
-                if not arduino_port:
-                    self.update_status("Arduino не найден!")
-                    return
-                
-                self.arduino = serial.Serial(arduino_port, 9600, timeout=1)
-                time.sleep(2)
-                self.arduino.reset_input_buffer()
-                
-                self.arduino_connected = True
-                self.update_gui_status()
-                self.update_status(f"Подключено к Arduino")
-                
-                # Запускаем мониторинг кнопки
-                self.start_button_monitoring()
-                
-            except Exception as e:
-                self.update_status(f"Ошибка подключения Arduino: {str(e)}")
-        
-        arduino_thread = threading.Thread(target=connect_arduino, daemon=True)
-        arduino_thread.start()
-        
-    def start_button_monitoring(self):
-        """Запуск мониторинга кнопки Arduino"""
-        def monitor_button():
-            self.update_debug("Мониторинг кнопки запущен - ожидание SHORT_PRESS или LONG_PRESS")
-            
-            while self.arduino_connected and self.arduino:
-                try:
-                    if self.arduino.in_waiting > 0:
-                        line = self.arduino.readline().decode('utf-8').strip()
-                        self.update_debug(f"Получено: '{line}'")
-                        
-                        # Обрабатываем команды
-                        if line == "SHORT_PRESS":
-                            self.update_debug("SHORT_PRESS обнаружено - переключение камеры")
-                            self.root.after(0, self.handle_short_press)
-                            
-                        elif line == "LONG_PRESS":
-                            self.update_debug("LONG_PRESS обнаружено - создание снимка")
-                            self.root.after(0, self.handle_long_press)
-                            
-                except Exception as e:
-                    self.update_debug(f"Ошибка мониторинга: {e}")
-                    time.sleep(0.1)
-                    
-                time.sleep(0.01)
-        
-        button_thread = threading.Thread(target=monitor_button, daemon=True)
-        button_thread.start()
-        
-    def handle_short_press(self):
-        """Обработка КОРОТКОГО нажатия - переключение камеры"""
-        self.update_button_status("Короткое нажатие - Переключение камеры")
-        self.toggle_camera()
-        
-    def handle_long_press(self):
-        """Обработка ДЛИННОГО нажатия - создание снимка"""
-        self.update_button_status("Длинное нажатие - Создание снимка")
-        self.take_photo_action()
-            
-    def toggle_camera(self):
-        """Включение/выключение камеры"""
-        if not self.camera_active:
-            self.start_camera()
-        else:
-            self.stop_camera()
-            
-    def start_camera(self):
-        """Запуск камеры"""
-        try:
-            available_cameras = self.get_available_cameras()
-            
-            if not available_cameras:
-                self.update_status("Камеры не найдены!")
-                return
-                
-            camera_index = max(available_cameras)
-            self.camera = cv2.VideoCapture(camera_index)
-            
-            if not self.camera.isOpened():
-                self.update_status(f"Не удалось открыть камеру {camera_index}")
-                return
-                
-            self.camera_active = True
-            self.update_gui_status()
-            self.update_status(f"Камера включена")
-            self.update_button_states()
-            
-            self.video_placeholder.pack_forget()
-            self.update_video_feed()
-            
-        except Exception as e:
-            self.update_status(f"Ошибка запуска камеры: {str(e)}")
-            
-    def stop_camera(self):
-        """Остановка камеры"""
-        if self.camera:
-            self.camera.release()
-            self.camera = None
-            
-        self.camera_active = False
-        self.update_gui_status()
-        self.update_status("Камера выключена")
-        self.update_button_states()
-        
-        self.video_placeholder.pack(fill=tk.BOTH, expand=True)
-        
-    def take_photo_action(self):
-        """Действие по созданию снимка"""
-        if not self.camera_active:
-            self.update_status("Камера не активна! Невозможно сделать снимок.")
-            return
-            
-        self.take_photo()
-        
-    def take_photo(self):
-        """Создание снимка через PIL (рабочий метод)"""
-        if not self.camera_active or not self.camera:
-            return
-            
-        try:
-            ret, frame = self.camera.read()
-            
-            if ret:
-                # Создаем имя файла: Фамилия_ГГГГ-ММ-ДД_ЧЧ-ММ-СС.jpg
-                timestamp = datetime.now()
-                date_str = timestamp.strftime("%Y-%m-%d")
-                time_str = timestamp.strftime("%H-%M-%S")
-                
-                # Имя файла
-                filename = f"{self.patient_surname}_{date_str}_{time_str}.jpg"
-                filepath = os.path.join(self.patient_folder, filename)
-                
-                self.update_debug(f"Сохранение снимка через PIL: {filepath}")
-                
-                # СОХРАНЕНИЕ ЧЕРЕЗ PIL (РАБОЧИЙ МЕТОД)
-                # Конвертируем BGR (OpenCV) в RGB (PIL)
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(frame_rgb)
-                
-                # Сохраняем через PIL с высоким качеством
-                pil_image.save(filepath, 'JPEG', quality=95)
-                
-                self.last_photo_path = filepath
-                self.update_photo_preview(frame)
-                self.update_status(f"Снимок сохранен: {filename}")
-                self.update_debug("✅ Снимок успешно сохранен через PIL!")
-                
-                # Проверяем что файл действительно создался
-                if os.path.exists(filepath):
-                    file_size = os.path.getsize(filepath)
-                    self.update_debug(f"Файл создан, размер: {file_size} байт")
-                else:
-                    self.update_debug("❌ ОШИБКА: Файл не создан!")
-                
-        except Exception as e:
-            error_msg = f"Ошибка создания снимка: {str(e)}"
-            self.update_status(error_msg)
-            self.update_debug(f"❌ {error_msg}")
-            
-    def get_available_cameras(self, max_test=5):
-        """Получение списка доступных камер"""
-        available_cameras = []
-        
-        for i in range(max_test):
-            cap = cv2.VideoCapture(i)
-            if cap.isOpened():
-                available_cameras.append(i)
-                cap.release()
-                
-        return available_cameras
+            self.take_burst_btn.config(state="disabled")
+            self.record_btn.config(state="disabled")
+        recording = self.video_recorder is not None
+        self.record_btn.config(text="Остановить запись" if recording else "Начать запись видео")
         
     def update_video_feed(self):
         """Обновление видео потока в GUI"""
-        if self.camera_active and self.camera:
+        if self.camera_active and self.capture_engine:
             try:
-                ret, frame = self.camera.read()
+                seq, self.preview_frame = self.capture_engine.latest_frame(self.preview_frame)
+                frame = self.preview_frame
                 
-                if ret:
-                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    
-                    h, w = frame_rgb.shape[:2]
-                    max_width = 800
-                    max_height = 600
-                    
-                    if w > max_width or h > max_height:
-                        scale = min(max_width/w, max_height/h)
-                        new_w, new_h = int(w*scale), int(h*scale)
-                        frame_rgb = cv2.resize(frame_rgb, (new_w, new_h))
+                # Рисуем только новые кадры
+                if frame is not None and seq != self.preview_seq:
+                    self.preview_seq = seq
+                    self.capture_engine.mark_shown(seq)
+                    self.video_renderer.render(frame)
+                    if not self.startup_reported:
+                        self.report_startup()
                     
-                    photo = ImageTk.PhotoImage(Image.fromarray(frame_rgb))
+                    # Кадры со вспышкой не анализируются: скачок яркости выглядел бы как движение,
+                    # а завышенная резкость надолго подняла бы порог peak_focus
+                    now = time.monotonic()
+                    if (self.auto_capture and now >= self.flash_until
+                            and self.stability_detector.update(self.video_renderer.rgb, now)):
+                        self.update_debug(f"Автоснимок: движение {self.stability_detector.motion:.1f}, "
+                                          f"резкость {self.stability_detector.focus:.0f}")
+                        # Следующий автоснимок - только после перемещения камеры
+                        self.stability_detector.reset(moved=False)
+                        self.take_photo()
                     
-                    self.video_label.configure(image=photo)
-                    self.video_label.image = photo
+                    if self.capture_engine.frames_shown % 30 == 0:
+                        text = self.capture_engine.stats_text()
+                        if self.video_recorder:
+                            text += "\n" + self.video_recorder.stats_text()
+                        self.frames_status.config(text=text)
                     
             except Exception as e:
                 print(f"Ошибка обновления видео: {e}")
                 
         if self.camera_active:
-            self.root.after(30, self.update_video_feed)
-            
+            # Интервал подстраивается под время отрисовки и частоту камеры
+            fps = self.camera.get(cv2.CAP_PROP_FPS) if self.camera else 0
+            frame_interval = 1 / fps if fps and fps > 0 else 1 / CAMERA_FPS
+            self.root.after(self.video_renderer.next_interval_ms(frame_interval), self.update_video_feed)
+        
     def update_photo_preview(self, frame):
         """Обновление превью последнего снимка"""
         try:
-            h, w = frame.shape[:2]
-            max_size = 300
-            
-            if w > max_size or h > max_size:
-                scale = min(max_size/w, max_size/h)
-                new_w, new_h = int(w*scale), int(h*scale)
-                frame_resized = cv2.resize(frame, (new_w, new_h))
-            else:
-                frame_resized = frame
-                
-            frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-            photo = ImageTk.PhotoImage(Image.fromarray(frame_rgb))
-            
-            self.photo_label.configure(image=photo, text="")
-            self.photo_label.image = photo
+            self.photo_renderer.render(frame)
             
         except Exception as e:
             print(f"Ошибка обновления превью: {e}")
-            
+        
     def update_gui_status(self):
         """Обновление статусов в GUI"""
         arduino_text = "Arduino: Подключен" if self.arduino_connected else "Arduino: Не подключен"
@@ -431,9 +4593,17 @@ class MedicalCameraController:
         camera_color = "green" if self.camera_active else "red"
         self.camera_status.config(text=camera_text, foreground=camera_color)
         
-        # Новый статус для светодиодов
-        led_text = "Светодиоды: ВКЛ" if self.camera_active else "Светодиоды: ВЫКЛ"
-        led_color = "green" if self.camera_active else "red"
+        # Статус светодиодов: подтвержденный скетчем, иначе - по состоянию камеры
+        if self.led_state is not None:
+            pattern = self.led_state["pattern"]
+            led_on = pattern != LED_PATTERN_OFF
+            led_text = f"Светодиоды: {LED_PATTERN_NAMES.get(pattern, pattern)}"
+            if led_on:
+                led_text += f", яркость {self.led_state['brightness']}"
+            led_color = "green" if led_on else "red"
+        else:
+            led_text = "Светодиоды: ВКЛ" if self.camera_active else "Светодиоды: ВЫКЛ"
+            led_color = "green" if self.camera_active else "red"
         self.led_status.config(text=led_text, foreground=led_color)
         
     def update_button_status(self, message):
@@ -441,43 +4611,190 @@ class MedicalCameraController:
         self.button_status.config(text=f"Кнопка: {message}", foreground="green")
         self.root.after(2000, lambda: self.button_status.config(text="Кнопка: Готова", foreground="blue"))
         
-    def update_status(self, message):
-        """Обновление статус бара"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.status_label.config(text=f"[{timestamp}] {message}")
-        print(f"[{timestamp}] {message}")
+    def toggle_auto_capture(self):
+        """Включение/выключение автоснимка по стабильному изображению"""
+        self.auto_capture = self.auto_capture_var.get()
+        self.stability_detector.reset()
+        state = "включен" if self.auto_capture else "выключен"
+        self.update_debug(f"Автоснимок {state}: снимок после {AUTO_CAPTURE_HOLD_MS} мс без движения")
         
-    def update_debug(self, message):
-        """Обновление отладочной информации"""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.debug_label.config(text=f"[{timestamp}] {message}")
-        print(f"[DEBUG] {message}")
+    def toggle_enhance(self):
+        """Включение/выключение улучшения для следующих снимков"""
+        self.photo_writer.enhance = self.enhance_var.get()
+        state = "включено" if self.photo_writer.enhance else "выключено"
+        self.update_debug(f"Улучшение снимков {state}")
+        
+    def open_gallery(self):
+        """Окно галереи снимков пациента"""
+        if self.gallery:
+            self.gallery.window.lift()
+            return
+        self.gallery = GalleryWindow(self, self.patient_surname)
+        
+    def export_session(self):
+        """Экспорт снимков пациента за период в ZIP (в фоновом потоке)"""
+        today = datetime.now().strftime("%Y-%m-%d")
+        period = simpledialog.askstring("Экспорт снимков", "Период (ГГГГ-ММ-ДД ГГГГ-ММ-ДД):",
+                                        initialvalue=f"{today} {today}", parent=self.root)
+        if not period:
+            return
+        try:
+            dates = [datetime.strptime(value, "%Y-%m-%d").date() for value in period.split()]
+            date_from, date_to = dates[0], dates[-1]
+        except (ValueError, IndexError):
+            messagebox.showerror("Экспорт снимков", f"Неверный период: {period}")
+            return
+        archive_path = filedialog.asksaveasfilename(
+            parent=self.root, defaultextension=".zip", filetypes=[("ZIP", "*.zip")],
+            initialfile=f"{self.patient_surname}_{date_from}_{date_to}.zip")
+        if not archive_path:
+            return
+        review = messagebox.askyesno("Экспорт снимков",
+                                     f"Добавить уменьшенные копии для просмотра ({EXPORT_REVIEW_SIZE} пикс.)?")
+        
+        exporter = SessionExporter(self.images_dir, self.image_library, review=review,
+                                   progress=lambda done, total: self.update_status(
+                                       f"Экспорт: {done} из {total}"))
+        
+        def run():
+            try:
+                summary = exporter.export(self.patient_surname, archive_path, date_from, date_to)
+                self.update_status(f"Экспорт завершен: {summary['images']} снимков, "
+                                   f"{summary['bytes'] / 1024 / 1024:.1f} МБ, {summary['elapsed']:.1f} с")
+            except Exception as e:
+                self.update_status(f"Ошибка экспорта: {e}")
+                
+        self.update_status("Экспорт снимков...")
+        threading.Thread(target=run, name="export", daemon=True).start()
+        
+    def open_stats(self):
+        """Окно статистики стадий конвейера"""
+        if self.stats_window and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        self.stats_window = tk.Toplevel(self.root)
+        self.stats_window.title("Статистика конвейера")
+        self.stats_window.geometry("520x320")
+        
+        columns = ("count", "p50", "p95", "p99")
+        self.stats_tree = ttk.Treeview(self.stats_window, columns=columns)
+        self.stats_tree.heading("#0", text="Стадия")
+        for column, title in zip(columns, ("Замеров", "p50, мс", "p95, мс", "p99, мс")):
+            self.stats_tree.heading(column, text=title)
+            self.stats_tree.column(column, width=90, anchor=tk.E)
+        self.stats_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        self.stats_counters = ttk.Label(self.stats_window, text="", foreground="gray")
+        self.stats_counters.pack(anchor=tk.W, padx=5, pady=(0, 5))
+        self.refresh_stats()
+        
+    def refresh_stats(self):
+        if not self.stats_window or not self.stats_window.winfo_exists():
+            self.stats_window = None
+            return
+        self.stats_tree.delete(*self.stats_tree.get_children())
+        for stage, (count, total, quantiles) in sorted(pipeline_metrics.snapshot().items()):
+            self.stats_tree.insert("", tk.END, text=stage,
+                                   values=(count, *(f"{quantiles[q] * 1000:.1f}" for q in StageMetrics.QUANTILES)))
+        counters = self.capture_engine.stats_text() if self.capture_engine else "Кадры: -"
+        if self.serial_transport:
+            counters += (f" | Порт: {self.serial_transport.messages_received} сообщ., "
+                         f"потеряно {self.serial_transport.messages_lost}")
+        self.stats_counters.config(text=counters)
+        self.root.after(STATS_REFRESH_MS, self.refresh_stats)
         
     def manual_start_camera(self):
         """Ручное включение камеры"""
         if not self.camera_active:
             self.start_camera()
-            
+        
     def manual_stop_camera(self):
         """Ручное выключение камеры"""
         if self.camera_active:
             self.stop_camera()
-            
+        
     def manual_take_photo(self):
         """Ручное создание снимка"""
         if self.camera_active:
             self.take_photo()
-            
-    def on_closing(self):
-        """Обработчик закрытия приложения"""
-        self.stop_camera()
-        if self.arduino and self.arduino_connected:
-            self.arduino.close()
-        self.root.destroy()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Medical Camera Controller")
+    parser.add_argument("--source", help="источник кадров вместо камеры: "
+                                         "synthetic[-mjpeg][:ШxВ[@fps]] или путь к видеофайлу")
+    parser.add_argument("--serial", help="порт Arduino вместо автопоиска: COM3, /dev/ttyUSB0, "
+                                         "loop:// или fake[:short@1,long@3,...]")
+    parser.add_argument("--find-duplicates", nargs="?", const="", metavar="ФАМИЛИЯ",
+                        help="без интерфейса: обновить индекс и вывести группы почти одинаковых "
+                             "снимков (всех пациентов или одного)")
+    parser.add_argument("--export", metavar="ZIP", help="без интерфейса: экспорт снимков пациента "
+                                                         "(--patient) в архив")
+    parser.add_argument("--patient", help="фамилия пациента (для экспорта и режима без интерфейса)")
+    parser.add_argument("--headless", action="store_true",
+                        help="без интерфейса: управление через HTTP/WebSocket API")
+    parser.add_argument("--host", default=API_HOST, help="адрес API в режиме без интерфейса (0.0.0.0 - доступ из сети, без авторизации)")
+    parser.add_argument("--port", type=int, default=API_PORT, help="порт API в режиме без интерфейса")
+    parser.add_argument("--date-from", help="начало периода экспорта, ГГГГ-ММ-ДД")
+    parser.add_argument("--date-to", help="конец периода экспорта, ГГГГ-ММ-ДД (включительно)")
+    parser.add_argument("--review", action="store_true", help="добавить уменьшенные копии для просмотра")
+    parser.add_argument("--images-dir", default=IMAGES_DIR, help="папка снимков")
+    parser.add_argument("--metrics", default=METRICS_EXPORT_PATH, metavar="ФАЙЛ",
+                        help=f"выгружать метрики конвейера в файл (формат Prometheus) "
+                             f"каждые {METRICS_EXPORT_INTERVAL_S} с")
+    args = parser.parse_args(argv)
+    if args.export and not args.patient:
+        parser.error("для --export нужен --patient")
+    return args
+
+
+def parse_date(value):
+    """Дата ГГГГ-ММ-ДД из командной строки (None, если не задана)"""
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+def find_duplicates(images_dir, patient=None):
+    """Пакетный поиск почти одинаковых снимков в архиве"""
+    library = ImageLibrary(images_dir)
+    try:
+        library.rescan()
+        start = time.perf_counter()
+        groups = library.duplicate_groups(patient or None)
+        elapsed = time.perf_counter() - start
+        for number, group in enumerate(groups, 1):
+            print(f"Группа {number} ({group[0].patient}):")
+            for image in group:
+                print(f"    {image.path}  {image.taken_at}  {image.size} байт")
+        extra = sum(len(group) - 1 for group in groups)
+        print(f"[LIBRARY] Групп: {len(groups)}, лишних снимков: {extra}, поиск {elapsed:.2f} с")
+    finally:
+        library.close()
+
 
 def main():
+    args = parse_args()
+    if args.find_duplicates is not None:
+        find_duplicates(args.images_dir, args.find_duplicates)
+        return
+    if args.export:
+        library = ImageLibrary(args.images_dir)
+        try:
+            SessionExporter(args.images_dir, library, review=args.review).export(
+                args.patient, args.export, parse_date(args.date_from), parse_date(args.date_to))
+        finally:
+            library.close()
+        return
+    if args.headless:
+        root = HeadlessRoot()
+        app = HeadlessController(root, frame_source=args.source, serial_port=args.serial,
+                                 images_dir=args.images_dir, patient=args.patient,
+                                 api_host=args.host, api_port=args.port, metrics_path=args.metrics)
+        root.install_signal_handlers(app.on_closing)
+        root.mainloop()
+        return
     root = tk.Tk()
-    app = MedicalCameraController(root)
+    app = CameraWindow(root, frame_source=args.source, serial_port=args.serial, images_dir=args.images_dir,
+                       metrics_path=args.metrics)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
 
@@ -0,0 +1,88 @@
+"""Слияние серии снимков: выравнивание по известным сдвигам, усреднение шума, отбраковка кадров.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+WIDTH, HEIGHT = 320, 240
+SHIFTS = [(3, -2), (-4, 1), (0, 0), (2, 5), (-1, -3)]
+# Края кадра после сдвига отражены, а не сдвинуты - их не сравниваем
+MARGIN = slice(10, -10)
+
+
+def texture(seed):
+    """Гладкая случайная текстура: у фазовой корреляции однозначный пик"""
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8), (0, 0), 3)
+    return cv2.normalize(image, None, 0, 255, cv2.NORM_MINMAX)
+
+
+def shifted(image, dx, dy):
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, (WIDTH, HEIGHT), borderMode=cv2.BORDER_REFLECT)
+
+
+def noisy_burst(base, shifts, sigma=12, seed=0):
+    rng = np.random.default_rng(seed)
+    return [np.clip(shifted(base, dx, dy) + rng.normal(0, sigma, base.shape), 0, 255).astype(np.uint8)
+            for dx, dy in shifts]
+
+
+def error(image, base):
+    return np.abs(image[MARGIN, MARGIN].astype(np.float32) - base[MARGIN, MARGIN]).mean()
+
+
+class MergeBurstTest(unittest.TestCase):
+    def setUp(self):
+        self.base = texture(1)
+        self.frames = noisy_burst(self.base, SHIFTS)
+
+    def test_recovers_known_shifts(self):
+        merged, info = main.merge_burst(self.frames)
+        self.assertEqual((info["frames"], info["used"]), (5, 5))
+        self.assertEqual(merged.shape, self.base.shape)
+        self.assertEqual(merged.dtype, np.uint8)
+        for (dx, dy), (got_dx, got_dy) in zip(SHIFTS, info["shifts"]):
+            self.assertAlmostEqual(got_dx, dx, delta=0.5)
+            self.assertAlmostEqual(got_dy, dy, delta=0.5)
+
+    def test_reduces_noise(self):
+        single = error(self.frames[len(self.frames) // 2], self.base)
+        for method in ("mean", "median"):
+            with self.subTest(method=method):
+                merged, _ = main.merge_burst(self.frames, method)
+                self.assertLess(error(merged, self.base), single * 0.6)
+
+    def test_unaligned_mean_is_blurred(self):
+        # Без выравнивания те же кадры дают заметно худший результат
+        mean = np.mean(np.stack(self.frames), axis=0)
+        merged, _ = main.merge_burst(self.frames)
+        self.assertLess(error(merged, self.base), error(mean, self.base))
+
+    def test_drops_unrelated_frame(self):
+        frames = [self.base, self.base, texture(2)]
+        merged, info = main.merge_burst(frames)
+        self.assertEqual(info["used"], 2)
+        self.assertEqual(len(info["shifts"]), 2)
+        self.assertTrue(np.array_equal(merged, self.base))
+
+    def test_jpeg_frames_decoded(self):
+        encoded = cv2.imencode(".jpg", self.base)[1]
+        self.assertTrue(main.is_jpeg_buffer(encoded))
+        merged, info = main.merge_burst([encoded, self.base, encoded])
+        self.assertEqual(info["used"], 3)
+        self.assertEqual(merged.shape, self.base.shape)
+        self.assertLess(error(merged, self.base), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
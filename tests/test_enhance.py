@@ -0,0 +1,94 @@
+"""Улучшение снимка: баланс белого, подавление бликов, CLAHE по яркости.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def gradient(width=320, height=240, tint=(1.0, 1.0, 1.0)):
+    """Плавный градиент яркости с оттенком tint (множители B, G, R)"""
+    ramp = np.tile(np.linspace(60, 180, width, dtype=np.float32), (height, 1))
+    return np.clip(np.dstack([ramp * k for k in tint]), 0, 255).astype(np.uint8)
+
+
+class WhiteBalanceTest(unittest.TestCase):
+    def test_gray_world_removes_tint(self):
+        frame = gradient(tint=(0.8, 1.0, 1.25))
+        gains = main.white_balance_gains(frame, "gray_world")
+        balanced = cv2.transform(frame, np.diag(np.array(gains, np.float32)))
+        means = np.array(cv2.mean(balanced)[:3])
+        self.assertLess(means.max() - means.min(), 2.0)
+        # Синий канал слабее - его коэффициент больше
+        self.assertGreater(gains[0], 1.0)
+        self.assertLess(gains[2], 1.0)
+
+    def test_gain_is_limited(self):
+        frame = np.zeros((32, 32, 3), np.uint8)
+        frame[..., 2] = 200
+        gains = main.white_balance_gains(frame, "gray_world")
+        for gain in gains:
+            self.assertGreaterEqual(gain, 1 / main.WHITE_BALANCE_MAX_GAIN - 1e-6)
+            self.assertLessEqual(gain, main.WHITE_BALANCE_MAX_GAIN + 1e-6)
+
+    def test_modes(self):
+        frame = gradient()
+        self.assertEqual(main.white_balance_gains(frame, "led"), main.LED_WHITE_GAINS)
+        self.assertIsNone(main.white_balance_gains(frame, None))
+
+
+class EnhanceFrameTest(unittest.TestCase):
+    def test_disabled_returns_same_frame(self):
+        frame = gradient()
+        image, info = main.enhance_frame(frame, white_balance=None, clahe_clip=0, glare=False)
+        self.assertIs(image, frame)
+        self.assertIsNone(info["gains"])
+        self.assertEqual(info["glare"], 0.0)
+
+    def test_input_not_modified(self):
+        frame = gradient(tint=(0.8, 1.0, 1.2))
+        original = frame.copy()
+        image, info = main.enhance_frame(frame)
+        self.assertTrue(np.array_equal(frame, original))
+        self.assertEqual(image.shape, frame.shape)
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertEqual(len(info["gains"]), 3)
+
+    def test_clahe_raises_local_contrast(self):
+        rng = np.random.default_rng(0)
+        # Тусклая текстура с малым разбросом яркости
+        frame = np.clip(100 + rng.normal(0, 4, (240, 320)), 0, 255).astype(np.uint8)
+        frame = cv2.cvtColor(cv2.GaussianBlur(frame, (0, 0), 1.5), cv2.COLOR_GRAY2BGR)
+        image, _ = main.enhance_frame(frame, white_balance=None, clahe_clip=main.ENHANCE_CLAHE_CLIP, glare=False)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        self.assertGreater(gray.std(), cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).std() * 1.5)
+
+    def test_small_glare_inpainted(self):
+        frame = gradient()
+        cv2.circle(frame, (160, 120), 6, (255, 255, 255), -1)
+        image, info = main.enhance_frame(frame, white_balance=None, clahe_clip=0, glare=True)
+        self.assertGreater(info["glare"], 0)
+        self.assertLessEqual(info["glare"], main.GLARE_MAX_FRACTION)
+        self.assertLess(image[120, 160].max(), main.GLARE_THRESHOLD)
+        # Вдали от блика кадр не меняется
+        self.assertTrue(np.array_equal(image[:, :100], frame[:, :100]))
+
+    def test_large_bright_area_kept(self):
+        # Большая светлая область - не блик, а сюжет: не закрашивается
+        frame = gradient()
+        frame[:, :160] = 255
+        image, info = main.enhance_frame(frame, white_balance=None, clahe_clip=0, glare=True)
+        self.assertGreater(info["glare"], main.GLARE_MAX_FRACTION)
+        self.assertTrue(np.array_equal(image, frame))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Экспорт сеанса SessionExporter: отбор по датам, содержимое ZIP, манифест, уборка при сбое.
+
+    python -m unittest discover tests
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from datetime import date
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+PATIENT = "Иванов"
+NAMES = [f"{PATIENT}_2024-03-01_10-00-00.jpg", f"{PATIENT}_2024-03-02_09-15-00.jpg",
+         f"{PATIENT}_2024-03-02_17-40-30_1.jpg", f"{PATIENT}_2024-03-05_12-00-00.jpg"]
+
+
+def save_jpeg(path, seed, width=320, height=240):
+    rng = np.random.default_rng(seed)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 4)
+    cv2.imencode(".jpg", frame)[1].tofile(path)
+    return path
+
+
+class SessionExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.images_dir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.images_dir, PATIENT)
+        os.makedirs(os.path.join(self.folder, main.ORIGINALS_DIR_NAME))
+        for seed, name in enumerate(NAMES):
+            save_jpeg(os.path.join(self.folder, name), seed)
+        # Файлы не по шаблону имени снимка не экспортируются
+        save_jpeg(os.path.join(self.folder, "scan.jpg"), 10)
+        self.archive = os.path.join(self.images_dir, "export.zip")
+
+    def tearDown(self):
+        shutil.rmtree(self.images_dir, ignore_errors=True)
+
+    def read_archive(self):
+        with zipfile.ZipFile(self.archive) as archive:
+            manifest = json.loads(archive.read(main.EXPORT_MANIFEST_NAME).decode("utf-8"))
+            files = {info.filename: archive.read(info) for info in archive.infolist()}
+            compress = {info.compress_type for info in archive.infolist()}
+        return manifest, files, compress
+
+    def test_period_and_contents(self):
+        progress = []
+        exporter = main.SessionExporter(self.images_dir, in_flight=1,
+                                        progress=lambda done, total: progress.append((done, total)))
+        summary = exporter.export(PATIENT, self.archive, date(2024, 3, 2), date(2024, 3, 5))
+        self.assertEqual(summary["images"], 3)
+        self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+
+        manifest, files, compress = self.read_archive()
+        self.assertEqual(compress, {zipfile.ZIP_STORED})
+        self.assertEqual((manifest["patient"], manifest["date_from"], manifest["date_to"]),
+                         (PATIENT, "2024-03-02", "2024-03-05"))
+        # По времени съемки; дата окончания - включительно
+        expected = [f"{PATIENT}/{name}" for name in NAMES[1:]]
+        self.assertEqual([entry["file"] for entry in manifest["images"]], expected)
+        self.assertEqual(sorted(files), sorted(expected + [main.EXPORT_MANIFEST_NAME]))
+        for entry in manifest["images"]:
+            with open(os.path.join(self.images_dir, *entry["file"].split("/")), "rb") as f:
+                data = f.read()
+            self.assertEqual(files[entry["file"]], data)
+            self.assertEqual(entry["size"], len(data))
+            self.assertEqual(entry["sha256"], hashlib.sha256(data).hexdigest())
+        self.assertEqual(manifest["images"][1]["taken_at"], "2024-03-02 17:40:30")
+        self.assertEqual(summary["bytes"], sum(entry["size"] for entry in manifest["images"]))
+
+    def test_originals_review_and_metadata(self):
+        large = NAMES[0]
+        save_jpeg(os.path.join(self.folder, large), 20, width=2000, height=1500)
+        save_jpeg(os.path.join(self.folder, main.ORIGINALS_DIR_NAME, large), 21, width=2000, height=1500)
+        library = main.ImageLibrary(self.images_dir)
+        try:
+            library.rescan()
+            main.SessionExporter(self.images_dir, library, review=True).export(PATIENT, self.archive,
+                                                                              date_to=date(2024, 3, 1))
+        finally:
+            library.close()
+
+        manifest, files, _ = self.read_archive()
+        (entry,) = manifest["images"]
+        self.assertEqual((entry["width"], entry["height"]), (2000, 1500))
+        self.assertEqual(len(entry["dhash"]), 16)
+        self.assertEqual(entry["original"]["file"], f"{PATIENT}/{main.ORIGINALS_DIR_NAME}/{large}")
+        self.assertEqual(entry["review"]["file"], f"{PATIENT}/review/{large}")
+        for kind in ("original", "review"):
+            data = files[entry[kind]["file"]]
+            self.assertEqual(entry[kind]["sha256"], hashlib.sha256(data).hexdigest())
+        with Image.open(io.BytesIO(files[entry["review"]["file"]])) as review:
+            self.assertLessEqual(max(review.size), main.EXPORT_REVIEW_SIZE)
+
+    def test_failure_leaves_no_archive(self):
+        exporter = main.SessionExporter(self.images_dir)
+        read = exporter.read
+
+        def failing_read(path):
+            if path.endswith(NAMES[2]):
+                raise OSError("файл недоступен")
+            return read(path)
+
+        exporter.read = failing_read
+        with self.assertRaises(OSError):
+            exporter.export(PATIENT, self.archive)
+        self.assertFalse(os.path.exists(self.archive))
+        self.assertFalse(os.path.exists(self.archive + main.PARTIAL_SUFFIX))
+
+
+if __name__ == "__main__":
+    unittest.main()
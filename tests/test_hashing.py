@@ -0,0 +1,96 @@
+"""Поиск похожих снимков: group_hashes и BKTree против полного перебора.
+
+    python -m unittest discover tests
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def random_hashes(count, seed):
+    """Кластеры близких 64-битных хешей (знаковые, как в базе) и одиночные хеши"""
+    rng = random.Random(seed)
+    hashes = []
+    while len(hashes) < count:
+        center = rng.getrandbits(64)
+        for _ in range(rng.randint(1, 5)):
+            value = center
+            for bit in rng.sample(range(64), rng.randint(0, 8)):
+                value ^= 1 << bit
+            hashes.append(value - (1 << 64) if value >= 1 << 63 else value)
+    return hashes[:count]
+
+
+def brute_force_groups(hashes, radius):
+    """Компоненты связности графа "расстояние <= radius" перебором всех пар"""
+    parent = list(range(len(hashes)))
+
+    def find(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+
+    for i in range(len(hashes)):
+        for j in range(i + 1, len(hashes)):
+            if main.hamming(hashes[i], hashes[j]) <= radius:
+                parent[find(i)] = find(j)
+    groups = {}
+    for i in range(len(hashes)):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def normalized(groups):
+    return sorted(sorted(members) for members in groups)
+
+
+class GroupHashesTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        for seed in range(5):
+            hashes = random_hashes(300, seed)
+            # Повторы и однотонные кадры (хеш 0, -1)
+            hashes += hashes[:10] + [0, 0, -1]
+            for radius in (0, 3, main.DUPLICATE_MAX_DISTANCE):
+                with self.subTest(seed=seed, radius=radius):
+                    self.assertEqual(normalized(main.group_hashes(hashes, radius)),
+                                     normalized(brute_force_groups(hashes, radius)))
+
+    def test_small_blocks(self):
+        # Корзина больше блока обрабатывается по частям с тем же результатом
+        hashes = [0] * 5 + [1 << bit for bit in range(20)]
+        self.assertEqual(normalized(main.group_hashes(hashes, 2, block=3)),
+                         normalized(brute_force_groups(hashes, 2)))
+
+    def test_empty(self):
+        self.assertEqual(main.group_hashes([]), [])
+
+
+class BKTreeTest(unittest.TestCase):
+    def test_search_matches_brute_force(self):
+        hashes = random_hashes(500, 42)
+        tree = main.BKTree()
+        for index, value in enumerate(hashes):
+            tree.add(value, index)
+        rng = random.Random(7)
+        for query in rng.sample(hashes, 20) + [0, -1]:
+            for radius in (0, 4, 10):
+                expected = sorted((main.hamming(query, value), index) for index, value in enumerate(hashes)
+                                  if main.hamming(query, value) <= radius)
+                self.assertEqual(sorted(tree.search(query, radius)), expected)
+
+    def test_duplicate_item_added_once(self):
+        tree = main.BKTree()
+        tree.add(5, "a.jpg")
+        tree.add(5, "a.jpg")
+        tree.add(7, "a.jpg")
+        self.assertEqual(tree.size, 1)
+        self.assertEqual(tree.search(5, 0), [(0, "a.jpg")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""Команды светодиодному кольцу: объединение, повторы, подтверждения от имитации скетча.
+
+    python -m unittest discover tests
+"""
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class RecordingTransport:
+    """Порт без ответа: запоминает записанные пакеты"""
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            self.batches.append(main.FrameParser().feed(data)[0])
+
+    def commands(self):
+        with self.lock:
+            return [(m.type, m.arg) for batch in self.batches for m in batch]
+
+
+class LedControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.ack_timeout = main.LED_ACK_TIMEOUT_S
+        main.LED_ACK_TIMEOUT_S = 0.05
+
+    def tearDown(self):
+        main.LED_ACK_TIMEOUT_S = self.ack_timeout
+
+    def test_coalescing_into_one_batch(self):
+        transport = RecordingTransport()
+        led = main.LedController(transport)
+        try:
+            # Пока поток отправки ждет блокировку, команды копятся в очереди
+            with led.cond:
+                for value in (10, 20, 30):
+                    led.set_brightness(value)
+                led.set_pattern(main.LED_PATTERN_WARM)
+            self.assertTrue(wait_for(lambda: transport.batches))
+        finally:
+            led.close()
+        self.assertEqual(led.commands_coalesced, 2)
+        self.assertEqual(sorted((m.type, m.arg) for m in transport.batches[0]),
+                         [(main.CMD_SET_BRIGHTNESS, 30), (main.CMD_SET_PATTERN, main.LED_PATTERN_WARM)])
+
+    def test_retries_then_fails(self):
+        transport = RecordingTransport()
+        results = queue.Queue()
+        led = main.LedController(transport)
+        try:
+            led.flash(on_ack=results.put)
+            self.assertIsNone(results.get(timeout=2))
+        finally:
+            led.close()
+        self.assertEqual(len(transport.commands()), main.LED_MAX_ATTEMPTS)
+        self.assertEqual(led.commands_failed, 1)
+        self.assertFalse(led.waiting)
+
+    def test_ack_from_fake_arduino(self):
+        device = main.FakeArduino()
+        states = queue.Queue()
+        led = None
+        transport = main.SerialTransport(
+            device, on_message=lambda message: led.on_ack(message) if message.type == main.EVENT_ACK else None)
+        led = main.LedController(transport)
+        transport.start()
+        try:
+            led.set_pattern(main.LED_PATTERN_WHITE)
+            led.flash(on_ack=states.put)
+            state = states.get(timeout=2)
+            self.assertTrue(wait_for(lambda: not led.waiting))
+        finally:
+            led.close()
+            transport.close()
+        self.assertEqual(state, {"brightness": main.LED_BRIGHTNESS, "pattern": main.LED_PATTERN_WHITE,
+                                 "flash": True})
+        self.assertEqual(led.commands_failed, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
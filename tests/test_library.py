@@ -0,0 +1,126 @@
+"""Индекс снимков ImageLibrary: инкрементальное сканирование, добавление после съемки, дубликаты.
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+PATIENT = "Иванов"
+
+
+def texture(seed, width=320, height=240):
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 4)
+
+
+def save_jpeg(path, frame, quality=95):
+    # np.tofile вместо cv2.imwrite: путь с кириллицей
+    cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tofile(path)
+    return path
+
+
+class ImageLibraryTest(unittest.TestCase):
+    def setUp(self):
+        self.images_dir = tempfile.mkdtemp()
+        self.folder = os.path.join(self.images_dir, PATIENT)
+        os.makedirs(self.folder)
+        self.library = main.ImageLibrary(self.images_dir)
+
+    def tearDown(self):
+        self.library.close()
+        shutil.rmtree(self.images_dir, ignore_errors=True)
+
+    def photo(self, name, seed, folder=None, **kwargs):
+        return save_jpeg(os.path.join(folder or self.folder, name), texture(seed), **kwargs)
+
+    def test_rescan_indexes_photos(self):
+        self.photo(f"{PATIENT}_2024-03-01_10-00-00.jpg", 1)
+        self.photo(f"{PATIENT}_2024-03-02_11-30-00.jpg", 2)
+        self.photo("scan.jpeg", 3)
+        with open(os.path.join(self.folder, "notes.txt"), "w") as f:
+            f.write("не снимок")
+        # Служебные папки (миниатюры) не индексируются
+        hidden = os.path.join(self.images_dir, main.THUMBNAIL_DIR_NAME)
+        os.makedirs(hidden)
+        self.photo("cached.jpg", 4, folder=hidden)
+
+        self.assertEqual(self.library.rescan(), (3, 0))
+        self.assertEqual(self.library.patients(), [PATIENT])
+        images = self.library.images(PATIENT)
+        self.assertEqual(len(images), 3)
+        dated = [image for image in images if image.path.startswith(f"{PATIENT}/{PATIENT}_")]
+        # Новые первыми, время съемки - из имени файла
+        self.assertEqual([image.taken_at for image in dated], ["2024-03-02 11:30:00", "2024-03-01 10:00:00"])
+        for image in images:
+            self.assertEqual((image.width, image.height), (320, 240))
+            self.assertIsNotNone(image.dhash)
+            self.assertEqual(image.size, os.path.getsize(self.library.absolute(image.path)))
+
+    def test_rescan_is_incremental(self):
+        first = self.photo(f"{PATIENT}_2024-03-01_10-00-00.jpg", 1)
+        second = self.photo(f"{PATIENT}_2024-03-01_10-00-05.jpg", 2)
+        self.assertEqual(self.library.rescan(), (2, 0))
+        self.assertEqual(self.library.rescan(), (0, 0))
+
+        self.photo(os.path.basename(first), 5, quality=60)
+        os.remove(second)
+        self.assertEqual(self.library.rescan(), (1, 1))
+        (image,) = self.library.images(PATIENT)
+        self.assertEqual(image.size, os.path.getsize(first))
+
+    def test_add_keeps_sharpness_on_rescan(self):
+        path = self.photo(f"{PATIENT}_2024-03-01_10-00-00.jpg", 1)
+        self.assertEqual(self.library.add(path, 320, 240, sharpness=123.5), [])
+        # Снимок без хеша перечитывается, но известная резкость не теряется
+        self.assertEqual(self.library.rescan(), (1, 0))
+        (image,) = self.library.images(PATIENT)
+        self.assertEqual(image.sharpness, 123.5)
+        self.assertIsNotNone(image.dhash)
+
+    def test_add_reports_similar(self):
+        frame = texture(1)
+        first = save_jpeg(os.path.join(self.folder, f"{PATIENT}_2024-03-01_10-00-00.jpg"), frame)
+        second = save_jpeg(os.path.join(self.folder, f"{PATIENT}_2024-03-01_10-00-02.jpg"), frame, quality=70)
+        other = self.photo(f"{PATIENT}_2024-03-01_10-05-00.jpg", 9)
+        self.assertEqual(self.library.add(first, dhash=main.dhash(frame)), [])
+        similar = self.library.add(second, dhash=main.dhash(cv2.imread(second)))
+        self.assertEqual([path for _, path in similar], [self.library.relative(first)])
+        self.assertEqual(self.library.add(other, dhash=main.dhash(texture(9))), [])
+
+    def test_duplicate_groups(self):
+        frame = texture(1)
+        save_jpeg(os.path.join(self.folder, f"{PATIENT}_2024-03-01_10-00-00.jpg"), frame)
+        save_jpeg(os.path.join(self.folder, f"{PATIENT}_2024-03-01_10-00-02.jpg"), frame, quality=70)
+        self.photo(f"{PATIENT}_2024-03-01_10-05-00.jpg", 9)
+        # У другого пациента тот же кадр - не дубликат
+        other = os.path.join(self.images_dir, "Петров")
+        os.makedirs(other)
+        save_jpeg(os.path.join(other, "Петров_2024-03-01_10-00-00.jpg"), frame)
+        self.library.rescan()
+
+        (group,) = self.library.duplicate_groups()
+        self.assertEqual([image.path for image in group],
+                         [f"{PATIENT}/{PATIENT}_2024-03-01_10-00-00.jpg", f"{PATIENT}/{PATIENT}_2024-03-01_10-00-02.jpg"])
+        self.assertEqual(self.library.duplicate_groups("Петров"), [])
+
+    def test_unreadable_file_indexed_without_hash(self):
+        with open(os.path.join(self.folder, "broken.jpg"), "wb") as f:
+            f.write(b"not a jpeg")
+        self.assertEqual(self.library.rescan(), (1, 0))
+        (image,) = self.library.images(PATIENT)
+        self.assertIsNone(image.dhash)
+        self.assertIsNone(image.width)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+"""Кадры MJPEG: размер из заголовка JPEG, дополнение таблицами Хаффмана.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+class JpegHeaderTest(unittest.TestCase):
+    def setUp(self):
+        frame = np.random.default_rng(0).integers(0, 255, (48, 80, 3), dtype=np.uint8)
+        ok, self.encoded = main.cv2.imencode(".jpg", frame)
+        self.assertTrue(ok)
+
+    def test_jpeg_size(self):
+        self.assertTrue(main.is_jpeg_buffer(self.encoded))
+        self.assertEqual(main.jpeg_size(self.encoded), (80, 48))
+
+    def test_complete_mjpeg_frame(self):
+        data = self.encoded.tobytes()
+        # Кадр UVC-камеры: те же данные без сегментов DHT
+        stripped, pos = bytearray(data[:2]), 2
+        while data[pos + 1] != 0xDA:
+            length = int.from_bytes(data[pos + 2:pos + 4], "big")
+            if data[pos + 1] != 0xC4:
+                stripped += data[pos:pos + 2 + length]
+            pos += 2 + length
+        stripped += data[pos:]
+        completed = main.complete_mjpeg_frame(np.frombuffer(bytes(stripped), np.uint8))
+        self.assertEqual(completed, data)
+        # Полный JPEG не меняется
+        self.assertEqual(main.complete_mjpeg_frame(self.encoded), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Запись снимков: атомарная запись через .part, уборка после сбоев, фоновая очередь PhotoWriter.
+
+    python -m unittest discover tests
+"""
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def texture(seed=0, width=320, height=240):
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (0, 0), 1)
+
+
+class WriteAtomicTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, "photo.jpg")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_writes_without_partial(self):
+        main.PhotoWriter.write_atomic(self.path, lambda f: f.write(b"data"))
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"data")
+        self.assertEqual(os.listdir(self.folder), ["photo.jpg"])
+
+    def test_error_removes_partial(self):
+        def write(f):
+            f.write(b"half of a jpeg")
+            # Временный файл уже на диске, когда запись обрывается
+            self.assertTrue(os.path.exists(self.path + main.PARTIAL_SUFFIX))
+            raise OSError("диск заполнен")
+
+        with self.assertRaises(OSError):
+            main.PhotoWriter.write_atomic(self.path, write)
+        self.assertEqual(os.listdir(self.folder), [])
+
+    def test_error_keeps_previous_file(self):
+        main.PhotoWriter.write_atomic(self.path, lambda f: f.write(b"old"))
+
+        def write(f):
+            f.write(b"new")
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            main.PhotoWriter.write_atomic(self.path, write)
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(os.listdir(self.folder), ["photo.jpg"])
+
+    def test_cleanup_partial(self):
+        originals = os.path.join(self.folder, main.ORIGINALS_DIR_NAME)
+        os.makedirs(originals)
+        for path in (self.path + main.PARTIAL_SUFFIX, os.path.join(originals, "a.jpg" + main.PARTIAL_SUFFIX),
+                     self.path, os.path.join(originals, "a.jpg")):
+            with open(path, "wb") as f:
+                f.write(b"x")
+        self.assertEqual(main.PhotoWriter.cleanup_partial(self.folder), 2)
+        self.assertEqual(sorted(os.listdir(self.folder)), [main.ORIGINALS_DIR_NAME, "photo.jpg"])
+        self.assertEqual(os.listdir(originals), ["a.jpg"])
+        self.assertEqual(main.PhotoWriter.cleanup_partial(os.path.join(self.folder, "missing")), 0)
+
+
+class PhotoWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.writer = main.PhotoWriter(workers=1, enhance=False)
+        self.done = queue.Queue()
+
+    def tearDown(self):
+        self.writer.stop()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def run_job(self, name, frames):
+        job = main.PhotoJob(os.path.join(self.folder, name), frames, callback=self.done.put)
+        self.assertTrue(self.writer.submit(job))
+        return self.done.get(timeout=5)
+
+    def test_writes_jpeg(self):
+        frame = cv2.GaussianBlur(texture(), (0, 0), 3)
+        job = self.run_job("photo.jpg", [(1, 0.0, frame)])
+        self.assertIsNone(job.error)
+        self.assertEqual((job.width, job.height), (320, 240))
+        self.assertEqual(job.file_size, os.path.getsize(job.filepath))
+        decoded = cv2.imread(job.filepath)
+        self.assertEqual(decoded.shape, frame.shape)
+        self.assertLess(np.abs(decoded.astype(np.int16) - frame).mean(), 4)
+        self.assertFalse(self.writer.is_pending(job.filepath))
+        self.assertEqual(os.listdir(self.folder), ["photo.jpg"])
+
+    def test_selects_sharpest_frame(self):
+        sharp = texture()
+        blurred = cv2.GaussianBlur(sharp, (0, 0), 3)
+        job = self.run_job("photo.jpg", [(1, 0.0, blurred), (2, 0.03, sharp), (3, 0.06, blurred)])
+        self.assertIsNone(job.error)
+        self.assertEqual(job.seq, 2)
+
+    def test_encode_error_leaves_no_files(self):
+        def fail(frame):
+            raise ValueError("кодирование не удалось")
+
+        self.writer.encode = fail
+        job = self.run_job("photo.jpg", [(1, 0.0, texture())])
+        self.assertIsInstance(job.error, ValueError)
+        self.assertEqual(os.listdir(self.folder), [])
+        self.assertFalse(self.writer.is_pending(job.filepath))
+
+    def test_write_error_leaves_no_partial(self):
+        # Данные, которые нельзя записать: сбой уже после создания временного файла
+        self.writer.encode = lambda frame: (object(), 320, 240)
+        job = self.run_job("photo.jpg", [(1, 0.0, texture())])
+        self.assertIsInstance(job.error, TypeError)
+        self.assertEqual(os.listdir(self.folder), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
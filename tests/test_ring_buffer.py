@@ -0,0 +1,219 @@
+"""Кольцевой буфер кадров: закрепление слотов для снимка, запасные буферы, возврат после записи.
+
+    python -m unittest discover tests
+"""
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import types
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+SHAPE = (48, 64, 3)
+
+
+def write_frames(buffer, values, timestamp=None):
+    """Запись кадров, заполненных значениями values, как это делает поток захвата"""
+    for value in values:
+        slot = buffer.begin_write()
+        slot[:] = value
+        buffer.commit(time.monotonic() if timestamp is None else timestamp)
+
+
+def make_buffer(capacity=4):
+    buffer = main.FrameRingBuffer(capacity)
+    buffer.allocate(SHAPE, np.uint8)
+    return buffer
+
+
+class PinTest(unittest.TestCase):
+    def test_pinned_slot_not_overwritten_on_wrap(self):
+        buffer = make_buffer()
+        write_frames(buffer, range(1, 5))
+        pinned = buffer.recent(float("inf"), pin=True)
+        self.assertEqual([int(frame[0, 0, 0]) for _, _, frame in pinned], [1, 2, 3, 4])
+        # Кольцо оборачивается несколько раз, пока кадры ждут записи
+        write_frames(buffer, range(10, 22))
+        for expected, (_, _, frame) in zip(range(1, 5), pinned):
+            self.assertTrue((frame == expected).all())
+        self.assertEqual(sorted(int(frame[0, 0, 0]) for _, _, frame in buffer.recent(float("inf"))),
+                         [18, 19, 20, 21])
+        buffer.release([frame for _, _, frame in pinned])
+        self.assertEqual(buffer.pins, {})
+
+    def test_copies_are_not_slots(self):
+        buffer = make_buffer()
+        write_frames(buffer, [7])
+        (_, _, frame), = buffer.recent(float("inf"))
+        self.assertFalse(any(frame is slot for slot in buffer.slots))
+        self.assertEqual(buffer.pins, {})
+
+    def test_count_keeps_latest(self):
+        buffer = make_buffer(6)
+        write_frames(buffer, range(1, 10))
+        frames = buffer.recent(float("inf"), count=3, pin=True)
+        self.assertEqual([int(frame[0, 0, 0]) for _, _, frame in frames], [7, 8, 9])
+        self.assertEqual([seq for seq, _, _ in frames], [7, 8, 9])
+        buffer.release([frame for _, _, frame in frames])
+
+    def test_pinned_twice_needs_two_releases(self):
+        buffer = make_buffer()
+        write_frames(buffer, [1])
+        (_, _, first), = buffer.recent(float("inf"), pin=True)
+        (_, _, second), = buffer.recent(float("inf"), pin=True)
+        self.assertIs(first, second)
+        buffer.release([first])
+        self.assertIn(id(first), buffer.pins)
+        buffer.release([second])
+        self.assertEqual(buffer.pins, {})
+
+
+class SpareTest(unittest.TestCase):
+    def test_released_slot_becomes_spare_and_is_reused(self):
+        buffer = make_buffer()
+        write_frames(buffer, range(1, 5))
+        (_, _, displaced), = buffer.recent(float("inf"), count=1, pin=True)
+        # Слот с закрепленным кадром заменяется новым буфером
+        write_frames(buffer, range(5, 9))
+        self.assertFalse(any(slot is displaced for slot in buffer.slots))
+        buffer.release([displaced])
+        self.assertEqual(len(buffer.spare), 1)
+        self.assertIs(buffer.spare[0], displaced)
+
+        # Следующее вытеснение берет буфер из запаса, а не выделяет новый
+        (_, _, pinned), = buffer.recent(float("inf"), count=1, pin=True)
+        index = next(i for i, slot in enumerate(buffer.slots) if slot is pinned)
+        write_frames(buffer, range(9, 13))
+        self.assertIs(buffer.slots[index], displaced)
+        self.assertEqual(buffer.spare, [])
+        buffer.release([pinned])
+
+    def test_slot_still_in_ring_is_not_spare(self):
+        buffer = make_buffer()
+        write_frames(buffer, [1, 2])
+        frames = buffer.recent(float("inf"), pin=True)
+        buffer.release([frame for _, _, frame in frames])
+        self.assertEqual(buffer.spare, [])
+        self.assertEqual(buffer.pins, {})
+
+    def test_reallocation_drops_old_shape(self):
+        buffer = make_buffer()
+        write_frames(buffer, range(1, 5))
+        (_, _, old), = buffer.recent(float("inf"), count=1, pin=True)
+        # Камера сменила разрешение: старый кадр в запас не годится
+        buffer.allocate((24, 32, 3), np.uint8)
+        buffer.release([old])
+        self.assertEqual(buffer.spare, [])
+
+
+class LatestFallbackTest(unittest.TestCase):
+    def test_latest_is_copy(self):
+        buffer = make_buffer()
+        self.assertEqual(buffer.latest(), (0, None))
+        write_frames(buffer, [3, 4])
+        seq, frame = buffer.latest()
+        self.assertEqual(seq, 2)
+        self.assertTrue((frame == 4).all())
+        self.assertFalse(any(frame is slot for slot in buffer.slots))
+        out = np.empty(SHAPE, np.uint8)
+        self.assertIs(buffer.latest(out)[1], out)
+
+    def test_grab_photo_frames_falls_back_to_latest(self):
+        engine = main.CaptureEngine(camera=None, buffer_size=4)
+        engine.buffer.allocate(SHAPE, np.uint8)
+        # Все кадры старше окна ZSL - снимок из последнего кадра
+        write_frames(engine.buffer, [5, 6], timestamp=time.monotonic() - 10)
+        controller = types.SimpleNamespace(capture_engine=engine)
+        frames = main.MedicalCameraController.grab_photo_frames(controller)
+        self.assertEqual(len(frames), 1)
+        seq, _, frame = frames[0]
+        self.assertEqual(seq, 2)
+        self.assertTrue((frame == 6).all())
+        self.assertEqual(engine.buffer.pins, {})
+
+    def test_grab_photo_frames_pins_window(self):
+        engine = main.CaptureEngine(camera=None, buffer_size=4)
+        engine.buffer.allocate(SHAPE, np.uint8)
+        write_frames(engine.buffer, [5, 6])
+        frames = main.MedicalCameraController.grab_photo_frames(types.SimpleNamespace(capture_engine=engine))
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(len(engine.buffer.pins), 2)
+        engine.release_frames([frame for _, _, frame in frames])
+        self.assertEqual(engine.buffer.pins, {})
+
+
+class PhotoWriterReleaseTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.buffer = make_buffer()
+        rng = np.random.default_rng(0)
+        for _ in range(4):
+            slot = self.buffer.begin_write()
+            slot[:] = rng.integers(0, 255, SHAPE, dtype=np.uint8)
+            self.buffer.commit(time.monotonic())
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def run_job(self, writer, filepath):
+        done = queue.Queue()
+        job = main.PhotoJob(filepath, self.buffer.recent(float("inf"), pin=True), callback=done.put,
+                            release=self.buffer.release)
+        self.assertEqual(len(self.buffer.pins), 4)
+        self.assertTrue(writer.submit(job))
+        return done.get(timeout=5)
+
+    def test_success_releases_pins(self):
+        writer = main.PhotoWriter(workers=1)
+        try:
+            job = self.run_job(writer, os.path.join(self.folder, "ok.jpg"))
+        finally:
+            writer.stop()
+        self.assertIsNone(job.error)
+        self.assertTrue(os.path.exists(job.filepath))
+        self.assertEqual(self.buffer.pins, {})
+
+    def test_write_error_releases_pins(self):
+        writer = main.PhotoWriter(workers=1)
+        try:
+            job = self.run_job(writer, os.path.join(self.folder, "missing", "fail.jpg"))
+        finally:
+            writer.stop()
+        self.assertIsInstance(job.error, OSError)
+        self.assertEqual(self.buffer.pins, {})
+
+    def test_processing_error_releases_pins(self):
+        writer = main.PhotoWriter(workers=1)
+
+        def fail(job):
+            raise RuntimeError("сбой до выбора кадра")
+
+        writer.process = fail
+        try:
+            job = self.run_job(writer, os.path.join(self.folder, "fail.jpg"))
+        finally:
+            writer.stop()
+        self.assertIsInstance(job.error, RuntimeError)
+        self.assertEqual(self.buffer.pins, {})
+
+    def test_full_queue_releases_pins(self):
+        writer = main.PhotoWriter(workers=0, queue_size=1)
+        first = main.PhotoJob(os.path.join(self.folder, "1.jpg"), [(0, 0.0, np.zeros(SHAPE, np.uint8))])
+        self.assertTrue(writer.submit(first))
+        job = main.PhotoJob(os.path.join(self.folder, "2.jpg"), self.buffer.recent(float("inf"), pin=True),
+                            release=self.buffer.release)
+        self.assertFalse(writer.submit(job))
+        self.assertEqual(self.buffer.pins, {})
+        self.assertFalse(writer.is_pending(job.filepath))
+
+
+if __name__ == "__main__":
+    unittest.main()
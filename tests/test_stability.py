@@ -0,0 +1,96 @@
+"""Автоснимок: пороги движения и резкости StabilityDetector, удержание и перевзвод.
+
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+FRAME_INTERVAL = 1 / 30
+
+
+def sharp_frame(seed=0, width=640, height=360):
+    """Мелкая контрастная текстура (кадр превью RGB)"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+
+
+class StabilityDetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = main.StabilityDetector()
+        self.now = 100.0
+
+    def feed(self, frame, seconds):
+        """Кадры с частотой превью в течение seconds; моменты срабатывания"""
+        fired = []
+        for _ in range(round(seconds / FRAME_INTERVAL)):
+            if self.detector.update(frame, self.now):
+                fired.append(self.now)
+            self.now += FRAME_INTERVAL
+        return fired
+
+    def test_fires_after_hold(self):
+        start = self.now
+        fired = self.feed(sharp_frame(), 1.0)
+        self.assertEqual(len(fired), 1)
+        hold = main.AUTO_CAPTURE_HOLD_MS / 1000
+        self.assertGreaterEqual(fired[0] - start, hold)
+        self.assertLess(fired[0] - start, hold + 3 * FRAME_INTERVAL)
+        self.assertLessEqual(self.detector.motion, main.AUTO_CAPTURE_MOTION_MAX)
+
+    def test_no_repeat_without_movement(self):
+        frame = sharp_frame()
+        self.assertEqual(len(self.feed(frame, 1.0)), 1)
+        self.assertEqual(self.feed(frame, 2.0), [])
+
+    def test_rearmed_after_movement(self):
+        self.assertEqual(len(self.feed(sharp_frame(0), 1.0)), 1)
+        # Камеру перевели на другой зуб: сильное движение взводит автоснимок снова
+        self.detector.update(sharp_frame(1), self.now)
+        self.assertGreaterEqual(self.detector.motion, main.AUTO_CAPTURE_REARM_MOTION)
+        self.assertTrue(self.detector.moved)
+        self.assertEqual(len(self.feed(sharp_frame(1), 1.0)), 1)
+
+    def test_motion_resets_hold(self):
+        frames = [sharp_frame(0), sharp_frame(1)]
+        fired = []
+        for index in range(60):
+            if self.detector.update(frames[index % 2], self.now):
+                fired.append(self.now)
+            self.now += FRAME_INTERVAL
+        self.assertEqual(fired, [])
+        self.assertIsNone(self.detector.stable_since)
+
+    def test_flat_frame_never_fires(self):
+        # Однотонный кадр (камера в чехле, засветка) ниже порога резкости
+        flat = np.full((360, 640, 3), 128, np.uint8)
+        self.assertEqual(self.feed(flat, 2.0), [])
+        self.assertLess(self.detector.focus, main.AUTO_CAPTURE_FOCUS_MIN)
+
+    def test_blur_below_peak_ratio(self):
+        frame = sharp_frame()
+        self.detector.update(frame, self.now)
+        peak = self.detector.focus
+        # Расфокус: резкость выше абсолютного минимума, но ниже доли от пика
+        blurred = cv2.GaussianBlur(frame, (0, 0), 2)
+        self.detector.reset()
+        self.detector.peak_focus = peak
+        self.assertEqual(self.feed(blurred, 0.3), [])
+        self.assertGreater(self.detector.focus, main.AUTO_CAPTURE_FOCUS_MIN)
+        self.assertLess(self.detector.focus, main.AUTO_CAPTURE_FOCUS_RATIO * peak)
+
+    def test_reset_after_capture_requires_movement(self):
+        self.detector.reset(moved=False)
+        self.assertEqual(self.feed(sharp_frame(), 1.5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
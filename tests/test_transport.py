@@ -0,0 +1,109 @@
+"""Протокол Arduino: кадры и CRC, порт через loop://, имитация скетча.
+
+    python -m unittest discover tests
+"""
+import os
+import queue
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class FrameParserTest(unittest.TestCase):
+    def test_roundtrip(self):
+        parser = main.FrameParser()
+        messages, lines = parser.feed(main.encode_frame(main.EVENT_LONG_PRESS, 7, 3, 123456))
+        self.assertEqual(lines, [])
+        self.assertEqual([(m.type, m.seq, m.arg, m.device_ms) for m in messages],
+                         [(main.EVENT_LONG_PRESS, 7, 3, 123456)])
+        self.assertEqual(parser.crc_errors, 0)
+
+    def test_resync_after_garbage_and_corrupt_frame(self):
+        parser = main.FrameParser()
+        corrupt = bytearray(main.encode_frame(main.EVENT_SHORT_PRESS, 1, 0, 100))
+        corrupt[-1] ^= 0xFF
+        data = (b"ARDUINO_READY\r\n" + bytes([main.FRAME_SYNC, 0x00, 0x13]) + bytes(corrupt)
+                + main.encode_frame(main.EVENT_SHORT_PRESS, 2, 0, 200))
+        messages, lines = [], []
+        # По одному байту - кадр собирается из частей
+        for byte in data:
+            got_messages, got_lines = parser.feed(bytes([byte]))
+            messages += got_messages
+            lines += got_lines
+        self.assertEqual(lines, ["ARDUINO_READY"])
+        self.assertEqual([m.seq for m in messages], [2])
+        self.assertGreater(parser.crc_errors, 0)
+
+    def test_crc_matches_sketch(self):
+        # CRC-8/SMBUS (полином 0x07, начальное значение 0): контрольное значение "123456789"
+        self.assertEqual(main.crc8(b"123456789"), 0xF4)
+
+
+class SerialTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.messages = queue.Queue()
+        self.transport = main.SerialTransport.open("loop://", on_message=self.messages.put)
+        self.transport.start()
+
+    def tearDown(self):
+        self.transport.close()
+
+    def receive(self, count):
+        return [self.messages.get(timeout=2) for _ in range(count)]
+
+    def test_ready_line(self):
+        self.assertFalse(self.transport.ready.is_set())
+        self.transport.write(b"ARDUINO_READY\r\n")
+        self.assertTrue(self.transport.ready.wait(2))
+
+    def test_lost_and_duplicate_frames(self):
+        for seq in (0, 1, 4, 4, 5):
+            self.transport.write(main.encode_frame(main.EVENT_SHORT_PRESS, seq, 0, seq * 10))
+        self.assertEqual([m.seq for m in self.receive(4)], [0, 1, 4, 5])
+        self.assertTrue(wait_for(lambda: self.transport.duplicates == 1))
+        self.assertEqual(self.transport.messages_received, 4)
+        self.assertEqual(self.transport.messages_lost, 2)
+
+    def test_sequence_wraps(self):
+        for seq in (254, 255, 0, 1):
+            self.transport.write(main.encode_frame(main.EVENT_SHORT_PRESS, seq))
+        self.receive(4)
+        self.assertEqual(self.transport.messages_lost, 0)
+        self.assertEqual(self.transport.duplicates, 0)
+
+
+class FakeArduinoTest(unittest.TestCase):
+    def test_parse_script(self):
+        self.assertEqual(main.FakeArduino.parse_script("short@1,long@3.5"),
+                         [(1.0, main.EVENT_SHORT_PRESS), (3.5, main.EVENT_LONG_PRESS)])
+
+    def test_ready_then_script(self):
+        device = main.FakeArduino(main.FakeArduino.parse_script("short@0.05,long@0.1"), ready_delay=0.02)
+        messages = queue.Queue()
+        transport = main.SerialTransport(device, on_message=messages.put)
+        transport.start()
+        try:
+            self.assertTrue(transport.ready.wait(2))
+            received = [messages.get(timeout=2) for _ in range(2)]
+        finally:
+            transport.close()
+        self.assertEqual([m.type for m in received], [main.EVENT_SHORT_PRESS, main.EVENT_LONG_PRESS])
+        self.assertEqual([m.seq for m in received], [0, 1])
+        self.assertEqual(transport.messages_lost, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()